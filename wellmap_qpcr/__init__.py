@@ -7,3 +7,4 @@ Helper scripts and APIs for working with qPCR data.
 __version__ = '0.0.0'
 
 from .load import load_cq, load_trace
+from .compute import agg_cq, calc_Δcq, calc_ΔΔcq
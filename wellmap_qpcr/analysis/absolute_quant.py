@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+"""\
+Infer the amount of template in each well from previously fit standard curves.
+
+Usage:
+    qpcr-absolute-quant <toml>... [-s <toml>]... [-d <path>] [-g <cols>]
+        [-e <dir>]
+
+Arguments:
+    <toml>
+        Wellmap files describing the samples to quantify.  Wells from every
+        layout are quantified together.  Each layout should contain the
+        following information (<well> indicates any well specification, e.g.
+        `row.A`, `col.1`, `block.2x2.A1`, etc.):
+
+        <well>.primers: string, required
+            The name of the primers used in the given well.  The well is
+            quantified using a standard curve for the same primers.
+
+        <well>.standard: string, optional
+            The name of the template used to make the standard curve for the
+            given well, i.e. the `template` of the standard curve layout (see
+            `qpcr-check-efficiency -h`).  If not specified, a standard curve
+            for any template can be used.
+
+        <well>.date: date, optional
+            The date of the experiment.  Each well is quantified using the
+            most recent standard curve from on or before this date, or the
+            earliest standard curve after it if there aren't any.  If not
+            specified, the modification date of the data file (i.e. the day
+            it was exported from the instrument) is used.
+
+Options:
+    -s --standards <toml>
+        Fit standard curves to the given layout (see `qpcr-check-efficiency
+        -h`) and store them in the database, before quantifying any samples.
+        This option can be given more than once.  Layouts that haven't
+        changed since they were stored aren't fit again.  Standard curves
+        that were already in the database are also used, so there's no need
+        to specify the same standards every time.
+
+    -d --db <path>              [default: qpcr.db]
+        The SQLite database where the standard curves are stored (see `qpcr-db
+        -h`).  It will be created if it doesn't already exist.
+
+    -g --group-by <cols>
+        Average the Cq values of the wells that have the same values in the
+        given columns (separated by commas, e.g. 'label'), and quantify each
+        group rather than each well.  This reduces the uncertainty for
+        technical replicates.
+
+    -e --export <dir>
+        Save the results as Parquet files in the given directory.  The files
+        are partitioned by layout and (for per-well results) plate.
+
+The concentrations are in the same units as the `template_conc` values used to
+make the standard curves.  The uncertainty in each concentration is the
+standard error of the value read back from the standard curve, and accounts
+for the scatter of the standards, the uncertainty in the fit, and the number
+of wells averaged.  Wells without a Cq value, or without a matching standard
+curve, are reported without a concentration.
+"""
+
+import sys, wellmap, docopt
+import pandas as pd
+
+from wellmap_qpcr import load_cq
+from wellmap_qpcr.db import ResultsDb, get_dates
+from wellmap_qpcr.compute import absolute_quant
+from wellmap_qpcr.export import export_parquet
+from pathlib import Path
+
+def main():
+    args = docopt.docopt(__doc__)
+    layout_paths = [Path(x) for x in args['<toml>']]
+    by = args['--group-by'] and args['--group-by'].split(',')
+
+    with ResultsDb(args['--db']) as db:
+        for toml in args['--standards']:
+            db.ingest(Path(toml), if_changed=True)
+        curves = db.query_efficiency()
+
+    df = load_samples(layout_paths)
+    if by:
+        by = ['layout', *by]
+
+    quant = absolute_quant(df, curves, by)
+
+    if args['--export']:
+        for layout, g in quant.groupby('layout', sort=False):
+            export_parquet(
+                    args['--export'], layout, 'absolute_quant',
+                    g.drop(columns='layout'),
+            )
+
+    cols = [
+            *(by or ['layout', 'well', 'primers']),
+            'cq', 'standard', 'curve_date', 'conc', 'conc_lo', 'conc_hi',
+    ]
+    if len(layout_paths) == 1:
+        cols.remove('layout')
+
+    pd.options.display.width = sys.maxsize
+    pd.options.display.max_rows = sys.maxsize
+    print(quant[cols].to_string(index=False))
+
+def load_samples(layout_paths):
+    """
+    Load the Cq value of every well in the given layouts, with each well
+    dated as described in `qpcr-absolute-quant -h`.
+    """
+    dfs = []
+
+    for layout_path in layout_paths:
+        df = wellmap.load(
+                layout_path,
+                data_loader=load_cq,
+                merge_cols=True,
+                path_guess='{0.stem}',
+        )
+        if 'primers' not in df:
+            raise ValueError(f"{layout_path}: no primers specified")
+
+        df = df.assign(date=get_dates(df))
+        df.insert(0, 'layout', str(layout_path))
+        dfs.append(df)
+
+    return pd.concat(dfs, ignore_index=True)
@@ -7,8 +7,9 @@ import matplotlib.pyplot as plt
 import autoprop
 
 from color_me import ucsf
-from scipy.stats import linregress
 from wellmap_qpcr import load_cq
+from wellmap_qpcr.compute import standard_curves, fill_defaults
+from wellmap_qpcr.export import export_parquet
 from matplotlib.lines import Line2D
 from dataclasses import dataclass, fields
 from more_itertools import mark_ends
@@ -22,7 +23,7 @@ class CheckEfficiency(App):
 Plot and analyze qPCR standard curves.
 
 Usage:
-    qpcr-check-efficiency <toml> [-o <path>]
+    qpcr-check-efficiency <toml> [-o <path>] [-e <dir>] [--if-changed]
 
 Arguments:
     <toml>
@@ -63,6 +64,17 @@ Options:
         If the path contains a dollar sign (e.g. '$.svg'), it will be replaced 
         with the base name of the <toml> path.
 
+    -e --export <dir>
+        Save the per-well Cq values and the standard curve fits as Parquet 
+        files in the given directory.  The files are partitioned by layout and 
+        (for the per-well values) plate.
+
+    --if-changed
+        Don't do anything if the output image is newer than the layout and 
+        every data file it references, and none of them (nor any of the 
+        command-line options) have changed since the image was made.  Has no 
+        effect if the plot isn't being saved.
+
 Performing a standard curve is one step in the process of validating a new pair 
 of qPCR primers.  The rule of thumb is to find primers that have R²>0.99 and 
 95–105% efficiency.  That said, it can be possible to account for poor primer 
@@ -72,10 +84,15 @@ efficiency in downstream analysis steps.
     def __bareinit__(self):
         self._df = None
         self._extras = None
+        self._fits = None
 
     def plot(self, fig_factory=plt.subplots):
         df, extras = self.df, self.extras
         expts = ['template', 'primers', 'date']
+        fits = {
+                ExptKey(*fit[expts]): fit
+                for _, fit in self.fits.iterrows()
+        }
         expt_groups = [
                 (ExptKey(*expt), g)
                 for expt, g in df.groupby(expts, dropna=False)
@@ -108,24 +125,26 @@ efficiency in downstream analysis steps.
         # Plot the standard curves:
 
         for expt, g in expt_groups:
+            legend_artists[expt] = []
+
+            # Groups with nothing to fit (e.g. only controls) won't have a 
+            # standard curve.
+            if expt not in fits:
+                continue
+
             i = ~g['is_control']
-            x, y = g['template_conc'][i], g['cq'][i]; j = x > 0
-            m, b, r, p, err = linregress(log10(x[j]), y[j])
+            x, y = g['template_conc'][i], g['cq'][i]
+            fit = fits[expt]
 
             x_fit = np.logspace(log10(x_lim.min), log10(2*x_lim.max))
-            y_fit = np.polyval((m, b), log10(x_fit))
-
-            # The efficiency calculation will be a little different if the y 
-            # values are dilutions instead of concentrations.  Consult the 
-            # derivation in `docs/efficiency.lyx`.
-            eff = 100 * (10**(-1/m) - 1)
+            y_fit = np.polyval((fit['slope'], fit['intercept']), log10(x_fit))
 
             color = expt_colors[expt]
             marker = (4, 2, 0)
             label = '\n'.join([
                 *expt.labels,
-                f'R²={r**2:.5f}',
-                f'eff={eff:.2f}%',
+                f'R²={fit["r2"]:.5f}',
+                f'eff={fit["efficiency"]:.2f}%',
             ])
 
             ax.plot(
@@ -139,7 +158,7 @@ efficiency in downstream analysis steps.
                     color=color,
             )
 
-            legend_artists[expt] = [
+            legend_artists[expt] += [
                     Line2D(
                         [], [],
                         color=color,
@@ -194,6 +213,10 @@ efficiency in downstream analysis steps.
 
         return fig
 
+    def export(self, export_dir):
+        export_parquet(export_dir, self.layout_toml, 'wells', self.df)
+        export_parquet(export_dir, self.layout_toml, 'standard_curves', self.fits)
+
     def get_df(self):
         if self._df is None:
             self._load()
@@ -201,6 +224,7 @@ efficiency in downstream analysis steps.
 
     def set_df(self, df):
         self._df = df
+        self._fits = None
 
     def get_extras(self):
         if self._extras is None:
@@ -210,6 +234,11 @@ efficiency in downstream analysis steps.
     def set_extras(self, extras):
         self._extras = extras
 
+    def get_fits(self):
+        if self._fits is None:
+            self._fits = standard_curves(self.df)
+        return self._fits
+
     def _load(self):
         df, extras = wellmap.load(
                 self.layout_toml,
@@ -219,20 +248,9 @@ efficiency in downstream analysis steps.
                 extras=['qpcr'],
         )
 
-        def fill_default(k, default=pd.NA):
-            df[k] = df[k].fillna(pd.NA) if k in df else default
-
-        fill_default('control')
-        fill_default('template')
-        fill_default('primers')
-        fill_default('date')
-
-        df['is_control'] = df['control'].fillna(False).astype(bool)
-
-        self._df = df
+        self._df = fill_defaults(df)
         self._extras = extras
-
-
+        self._fits = None
 
 @dataclass(eq=True, frozen=True)
 class ExptKey:
@@ -259,160 +277,3 @@ class ExptKey:
 class Limits:
     min: float
     max: float
-
-### TODO: convert this script to a functional style.
-
-def main():
-    args = docopt.docopt(__doc__)
-    layout_path = Path(args['<toml>'])
-    img_path = resolve_img_path(
-            args['--output'],
-            '%.svg',
-            args['--output-default'],
-            layout_path,
-    )
-
-    df, style = load(layout_path)
-    style.finalize(df)
-
-    with plot_or_save(layout_path, img_path):
-        plot_efficiency(df, style)
-
-def load(layout_path):
-    df, extras = wellmap.load(
-            layout_path,
-            data_loader=load_cq,
-            merge_cols=True,
-            path_guess='{0.stem}',
-            extras=True,
-    )
-
-    # Should group by label instead of template/primers/date/etc.
-
-    def fill_default(k, default=pd.NA):
-        df[k] = df[k].fillna(pd.NA) if k in df else default
-
-    fill_default('control')
-    fill_default('template')
-    fill_default('primers')
-    fill_default('date')
-
-    df['is_control'] = df['control'].fillna(False).astype(bool)
-
-    return df, init_style(extra)
-
-def plot_efficiency(df, style):
-    expt_groups = df.groupby('label', dropna=False)
-    expt_colors = {
-            expt: color[0]
-            for color, (expt, g) in ucsf.iter_colors(expt_groups)
-    }
-
-    control_df = df[df['is_control']]
-    control_groups = [
-            (control, label, g)
-            for (control, *expt), g in control_df.groupby(
-                ['control', *expts],
-                dropna=False,
-            )
-    ]
-    control_markers = {
-            k: (3 if i == 0 else i+4, 2, 0)
-            for i, (k, g) in enumerate(control_df.groupby(['control']))
-    }
-
-    fig, ax = plt.subplots()
-    legend_artists = {}
-
-    x = df['template_conc']
-    x_lim = Limits(min(x[x > 0]), max(x))
-
-    # Plot the standard curves:
-
-    for expt, g in expt_groups:
-        i = ~g['is_control']
-        x, y = g['template_conc'][i], g['cq'][i]; j = x > 0
-        m, b, r, p, err = linregress(log10(x[j]), y[j])
-
-        x_fit = np.logspace(log10(x_lim.min), log10(2*x_lim.max))
-        y_fit = np.polyval((m, b), log10(x_fit))
-
-        # The efficiency calculation will be a little different if the y 
-        # values are dilutions instead of concentrations.  Consult the 
-        # derivation in `docs/efficiency.lyx`.
-        eff = 100 * (10**(-1/m) - 1)
-
-        color = expt_colors[expt]
-        marker = (4, 2, 0)
-        label = '\n'.join([
-            *expt.labels,
-            f'R²={r**2:.5f}',
-            f'eff={eff:.2f}%',
-        ])
-
-        ax.plot(
-                x, y,
-                color=color,
-                marker=marker,
-                linestyle='none',
-        )
-        ax.plot(
-                x_fit, y_fit, '--',
-                color=color,
-        )
-
-        legend_artists[expt] = [
-                Line2D(
-                    [], [],
-                    color=color,
-                    marker=marker,
-                    linestyle='--',
-                    label=label,
-                ),
-        ]
-
-    # Plot the controls:
-
-    for control, expt, g in control_groups:
-        artist, = ax.plot(
-                g['template_conc'],
-                g['cq'],
-                color=expt_colors[expt],
-                marker=control_markers[control],
-                linestyle='none',
-                label=control,
-        )
-        legend_artists[expt].append(artist)
-
-    x_label = '[template]'
-    if 'conc_unit' in extras:
-        x_label += f' ({extras["conc_unit"]})'
-
-    ax.set_xscale(
-            'symlog',
-            linthresh=x_lim.min,
-            subs=range(2, 10),
-    )
-    ax.set_xlim(-x_lim.min / 5, 2 * x_lim.max)
-    ax.set_ylim(0, 40)
-    ax.set_xlabel(x_label)
-    ax.set_ylabel('$C_q$', rotation='horizontal', ha='right')
-
-    handles = []
-    for _, is_last, artists in mark_ends(legend_artists.values()):
-        handles += artists
-
-        # Add some blank space between labels.
-        if not is_last:
-            handles.append(Line2D([], [], linestyle='none'))
-
-    legend = ax.legend(
-            handles=handles,
-            bbox_to_anchor=(1.04, 1.00),
-            loc='upper left',
-            borderaxespad=0,
-    )
-    fig.tight_layout()
-
-    return fig
-
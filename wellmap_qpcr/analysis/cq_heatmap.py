@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 
 import wellmap
-import matplotlib.pyplot as plt
+import byoc
+import numpy as np
+import pandas as pd
 import autoprop
 
 from .main import App
 from ..load import load_cq
-from wellmap import row_from_i, col_from_j, inclusive_range
+from ..export import export_parquet
+from .. import figures
+from ..compute import cq_grid, polish_plates, plate_effects
+from ..wells import PLATE_FORMATS, get_plate_format
+from wellmap import row_from_i, col_from_j
 
 @autoprop
 class CqHeatmap(App):
@@ -14,7 +20,8 @@ class CqHeatmap(App):
 Plot the Cq value of each reaction in the given experiment.
 
 Usage:
-    qpcr-cq-heatmap <toml> [-o <path>]
+    qpcr-cq-heatmap <toml> [-o <path>] [-e <dir>] [-q [-b <cols>] [-t <cq>]]
+        [--if-changed]
 
 Arguments:
     <toml>
@@ -26,36 +33,93 @@ Options:
         interactive GUI.  The file type is inferred from the file extension.  
         If the path contains a dollar sign (e.g. '$.svg'), it will be replaced 
         with the base name of the <toml> path.
+
+    -e --export <dir>
+        Save the data underlying the plot as Parquet files in the given 
+        directory.  The files are partitioned by layout and plate.
+
+    -q --qc
+        Instead of the Cq values, plot the spatial effects on each plate, 
+        e.g. the gradients and edge effects caused by a block heater that 
+        isn't heating evenly.  The effects are found by median polish, which 
+        decomposes the Cq values on each plate into row and column effects.  
+        A table summarizing the effects on each plate is also printed, with a 
+        flag for each plate where they're large enough to be concerning.
+
+    -b --by <cols>
+        In QC mode, subtract the Cq value expected for each well before 
+        looking for spatial effects.  The expected value is the median of 
+        every well, on any plate, with the same values in the given columns 
+        (separated by commas).  For example, `well` compares each plate to the 
+        consensus of every plate (assuming they have the same layout), and 
+        `primers,template_conc` compares replicates to each other.  Without 
+        this option, differences between the samples in each well would look 
+        like spatial effects.
+
+    -t --threshold <cq>         [default: 0.5]
+        In QC mode, how large (in cycles) a gradient across the plate or a 
+        difference between the edge and the interior of the plate must be for 
+        the plate to be flagged.
+
+    --if-changed
+        Don't do anything if the output image is newer than the layout and 
+        every data file it references, and none of them (nor any of the 
+        command-line options) have changed since the image was made.  Has no 
+        effect if the plot isn't being saved.
 """
 
+    qc = byoc.param('--qc', default=False)
+    by = byoc.param('--by', cast=lambda x: x.split(','), default=None)
+    threshold = byoc.param('--threshold', cast=float, default=0.5)
+
     def __bareinit__(self):
         self._df = None
+        self._effects = None
 
-    def plot(self, fig_factory=plt.subplots):
-        df = self.df
-        fig, ax = fig_factory()
-        img = df.pivot(index='row', columns='col', values='cq')
+    def run(self):
+        if self.qc:
+            print(self.effects.to_string(index=False))
+        super().run()
 
-        artist = ax.imshow(img.values)
-        plt.colorbar(artist, ax=ax, label='Cq')
+    def plot(self, fig_factory=None):
+        if self.qc:
+            img = self.spatial_grid
+            lim = np.nanmax(np.abs(img.values), initial=0) or 1
+            imshow_kwargs = dict(cmap='coolwarm', vmin=-lim, vmax=lim)
+            label = 'spatial effect (ΔCq)'
+        else:
+            img = cq_grid(self.df)
+            imshow_kwargs = {}
+            label = 'Cq'
 
-        row_0 = df['row_i'].min()
-        row_n = df['row_i'].max()
-        num_rows = row_n - row_0 + 1
-        rows = map(row_from_i, inclusive_range(row_0, row_n))
+        if fig_factory:
+            fig, ax = fig_factory()
+        else:
+            fig, ax = figures.subplots(('cq-heatmap', self.qc, img.shape))
 
-        col_0 = df['col_j'].min()
-        col_n = df['col_j'].max()
-        num_cols = col_n - col_0 + 1
-        cols = map(col_from_j, inclusive_range(col_0, col_n))
+        artist = ax.imshow(img.values, **imshow_kwargs)
+        figures.colorbar(artist, ax, label=label)
 
-        ax.set_yticks(range(num_rows), rows)
-        ax.set_xticks(range(num_cols), cols)
+        # If there are multiple plates, they're stacked vertically.
+        rows = map(row_from_i, img.index.get_level_values('row_i'))
+        cols = map(col_from_j, img.columns)
 
-        fig.tight_layout()
+        ax.set_yticks(range(len(img.index)), rows)
+        ax.set_xticks(range(len(img.columns)), cols)
+
+        figures.tight_layout(fig)
 
         return fig
 
+    def export(self, export_dir):
+        export_parquet(export_dir, self.layout_toml, 'wells', self.df)
+
+        if self.qc:
+            export_parquet(
+                    export_dir, self.layout_toml, 'plate_effects',
+                    self.effects,
+            )
+
     def get_df(self):
         if self._df is None:
             self._df = wellmap.load(
@@ -68,4 +132,43 @@ Options:
 
     def set_df(self, df):
         self._df = df
+        self._effects = None
+
+    def get_effects(self):
+        if self._effects is None:
+            self._effects = plate_effects(
+                    self.df, self.by,
+                    shape=self.plate_shape,
+                    threshold=self.threshold,
+            )
+        return self._effects
+
+    def get_spatial_grid(self):
+        """
+        Return the sum of the row and column effects for each well, arranged
+        like `cq_grid()`, with the plates stacked on top of each other.
+        """
+        plates, stack, (overall, rows, cols, resid) = polish_plates(
+                self.df, self.by,
+                shape=self.plate_shape,
+        )
+        n_plates, n_rows, n_cols = stack.shape
+
+        effects = rows[:, :, np.newaxis] + cols[:, np.newaxis, :]
+        effects = np.where(np.isfinite(stack), effects, np.nan)
+
+        index = pd.MultiIndex.from_product(
+                [plates, range(n_rows)],
+                names=['plate', 'row_i'],
+        )
+        columns = pd.RangeIndex(n_cols, name='col_j')
+        return pd.DataFrame(
+                effects.reshape(-1, n_cols),
+                index=index,
+                columns=columns,
+        )
+
+    def get_plate_shape(self):
+        df = self.df
+        return PLATE_FORMATS[get_plate_format(df['row_i'], df['col_j'])]
 
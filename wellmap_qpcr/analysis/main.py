@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 
-import os, sys
 import byoc
 import matplotlib.pyplot as plt
+from wellmap_qpcr.cache import InputManifest
+from wellmap_qpcr.utils import show_in_viewer
 from pathlib import Path
 
 class App(byoc.App):
@@ -11,13 +12,26 @@ class App(byoc.App):
     ]
     layout_toml = byoc.param('<toml>', cast=Path)
     output = byoc.param('--output', default=None)
+    export_dir = byoc.param('--export', default=None, cast=Path)
+    if_changed = byoc.param('--if-changed', default=False)
 
     def main(self):
         byoc.load(self)
 
-        if not self.output:
-            if os.fork() != 0:
-                sys.exit()
+        manifest = InputManifest(
+                self.get_input_tomls(),
+                [self.get_output_path()],
+                enabled=self.if_changed,
+        )
+        if manifest.is_current():
+            return
+
+        self.run()
+        manifest.record()
+
+    def run(self):
+        if self.export_dir:
+            self.export(self.export_dir)
 
         # df, extras = self.load()
         # fig = self.plot(df, extras)
@@ -26,9 +40,24 @@ class App(byoc.App):
         assert fig
 
         if self.output:
-            out = self.output.replace('$', self.layout_toml.stem)
-            plt.savefig(out)
+            plt.savefig(self.get_output_path())
             plt.close()
         else:
-            plt.show()
+            show_in_viewer(self.layout_toml)
+
+    def export(self, export_dir):
+        """
+        Save the results of the analysis as Parquet files in the given
+        directory (see `export_parquet()`).
 
+        Subclasses that offer the `--export` option should override this.  By
+        default, nothing is exported.
+        """
+        pass
+
+    def get_input_tomls(self):
+        return [self.layout_toml]
+
+    def get_output_path(self):
+        if self.output:
+            return Path(self.output.replace('$', self.layout_toml.stem))
@@ -1,23 +1,32 @@
 #!/usr/bin/env python3
 
 import wellmap
+import byoc
+import autoprop
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from color_me.ucsf import iter_colors
 from wellmap_qpcr import load_cq
+from wellmap_qpcr.export import export_parquet
+from wellmap_qpcr.compute import anneal_optimum, fit_anneal_curves
+from pathlib import Path
 from .main import App
 
+@autoprop
 class OptimizeTa(App):
     """\
-Plot amplification for different annealing temperatures.
+Find the best annealing temperature for each pair of primers.
 
 Usage:
-    qpcr-optimize-ta <toml> [-o <path>]
+    qpcr-optimize-ta <toml>... [-o <path>] [-e <dir>] [-t <cq>]
+        [--if-changed]
 
 Arguments:
     <toml>
-        A wellmap file describing the experimental layout.  The layout should 
+        Wellmap files describing the experimental layouts, e.g. one for each 
+        gradient plate.  Wells from every layout are analyzed together, so the 
+        same primers can be tested on multiple plates.  Each layout should 
         contain the following information:
 
         For each well:
@@ -37,40 +46,90 @@ Arguments:
               Typically, you would setup a temperature gradient such that each 
               row or column has a distinct temperature.
 
+          control:
+              The name of the control in this well, e.g. "NTC".  Control wells 
+              are plotted, but aren't used to find the best annealing 
+              temperature.  Template/primer pairs also need Cq values at 3 or 
+              more temperatures to be analyzed.
+
 Options:
     -o --output <path>
         Output an image of the plot to the given path, instead of launching the 
         interactive GUI.  The file type is inferred from the file extension.  
         If the path contains a dollar sign (e.g. '$.svg'), it will be replaced 
-        with the base name of the <toml> path.
+        with the base name of the first <toml> path.
+
+    -e --export <dir>
+        Save the per-well Cq values and the best annealing temperature for 
+        each template/primer pair as Parquet files in the given directory.  
+        The files are partitioned by layout and (for the per-well values) 
+        plate.  Each layout gets the results for the template/primer pairs 
+        that it contains, fit using every given layout.
+
+    -t --tolerance <cq>         [default: 0.5]
+        How much higher than the optimum the Cq value can be (according to the 
+        model) for an annealing temperature to be considered usable.
+
+    --if-changed
+        Don't do anything if the output image is newer than the layouts and 
+        every data file they reference, and none of them (nor any of the 
+        command-line options) have changed since the image was made.  Has no 
+        effect if the plot isn't being saved.
+
+For each pair of template and primers, a quadratic model of Cq as a function 
+of annealing temperature is fit to every well.  The recommended annealing 
+temperature is the one that minimizes the model, within the range of 
+temperatures that were tested.  A table with the recommended temperature and 
+the usable window for each pair is printed, and the model is plotted.  It's 
+often a good idea to choose the highest temperature in the usable window, 
+because higher temperatures tend to improve specificity.
 """
 
-    def __init__(self, layout_toml):
-        self.layout_toml = layout_toml
+    # The first layout is used to name the output files.
+    layout_toml = byoc.param('<toml>', cast=lambda x: Path(x[0]))
+    layout_tomls = byoc.param('<toml>', cast=lambda x: [Path(p) for p in x])
+    tolerance = byoc.param('--tolerance', cast=float, default=0.5)
+
+    def __bareinit__(self):
+        self._df = None
+        self._optima = None
 
-    def load(self):
-        df = wellmap.load(
-                self.layout_toml,
-                data_loader=load_cq,
-                merge_cols=True,
-                path_guess='{0.stem}',
-        )
+    def run(self):
+        print(self.optima.to_string(index=False))
+        super().run()
 
-        # Fill in optional columns:
-        if 'template' not in df:
-            df['template'] = np.nan
-        if 'primers' not in df:
-            df['primers'] = np.nan
+    def get_input_tomls(self):
+        return self.layout_tomls
 
-        return df, {}
+    def export(self, export_dir):
+        df, optima = self.df, self.optima
+
+        for layout_toml, g in df.groupby('layout', sort=False):
+            export_parquet(export_dir, layout_toml, 'wells', g)
+            export_parquet(
+                    export_dir, layout_toml, 'anneal_optimum',
+                    _select_groups(optima, g),
+            )
 
-    def plot(self, df):
-        fig, ax = plt.subplots()
-        groups = df.groupby(['template', 'primers'], dropna=False)
+    def plot(self, fig_factory=plt.subplots):
+        df = self.df
+        keys = ['template', 'primers']
+        fits = {
+                _group_key(k): fit
+                for k, fit in fit_anneal_curves(df).iterrows()
+        }
+        optima = {
+                _group_key(best[keys]): best
+                for _, best in self.optima.iterrows()
+        }
+
+        fig, ax = fig_factory()
+        groups = df.groupby(keys, dropna=False)
         have_labels = False
 
         for color, (key, g) in iter_colors(groups):
-            label = ', '.join((x for x in key if not np.isnan(x)))
+            color = color[0]
+            label = ', '.join(str(x) for x in key if not pd.isna(x))
             have_labels = have_labels or bool(label)
 
             ax.plot(
@@ -81,6 +140,30 @@ Options:
                     color=color,
                     label=label,
             )
+
+            key = _group_key(key)
+            if key not in fits:
+                continue
+
+            fit = fits[key]
+            x_fit = np.linspace(fit['ta_min'], fit['ta_max'])
+            y_fit = np.polyval((fit['a'], fit['b'], fit['c']), x_fit)
+            ax.plot(x_fit, y_fit, '--', color=color)
+
+            best = optima[key]
+            ax.axvspan(
+                    best['window_min_C'],
+                    best['window_max_C'],
+                    color=color,
+                    alpha=0.1,
+                    linewidth=0,
+            )
+            ax.plot(
+                    [best['anneal_temp_C']], [best['cq_fit']],
+                    marker='o',
+                    markerfacecolor='none',
+                    color=color,
+            )
         
         if have_labels:
             ax.legend()
@@ -91,3 +174,46 @@ Options:
         fig.tight_layout()
 
         return fig
+
+    def get_df(self):
+        if self._df is None:
+            self._df = pd.concat(
+                    map(load_layout, self.layout_tomls),
+                    ignore_index=True,
+            )
+        return self._df
+
+    def set_df(self, df):
+        self._df = df
+        self._optima = None
+
+    def get_optima(self):
+        if self._optima is None:
+            self._optima = anneal_optimum(self.df, self.tolerance)
+        return self._optima
+
+def load_layout(layout_toml):
+    df = wellmap.load(
+            layout_toml,
+            data_loader=load_cq,
+            merge_cols=True,
+            path_guess='{0.stem}',
+    )
+    df['layout'] = layout_toml
+
+    # Fill in optional columns:
+    if 'template' not in df:
+        df['template'] = np.nan
+    if 'primers' not in df:
+        df['primers'] = np.nan
+
+    return df
+
+def _group_key(key):
+    # Replace missing values with None, so that keys can be compared.
+    return tuple(None if pd.isna(x) else x for x in key)
+
+def _select_groups(optima, df):
+    keys = ['template', 'primers']
+    present = df[keys].drop_duplicates()
+    return optima.merge(present, on=keys)
@@ -4,3 +4,4 @@ from .expression import main
 from . import expression
 from . import amplification
 from . import melt
+from .experiment import Experiment
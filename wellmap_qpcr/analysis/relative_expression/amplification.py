@@ -5,10 +5,14 @@ Plot raw amplification curves for each experimental condition.
 
 This can reveal information that would be abstracted away in the relative 
 expression bar plot, e.g. whether the amplification was clean, whether certain 
-conditions have abnormally high/low Cq values, etc.
+conditions have abnormally high/low Cq values, etc.  The Cq value of each well 
+is marked on its curve.  If outlier detection is enabled (see 
+`qpcr.outliers` in `qpcr-relative-expression -h`), the wells that were 
+excluded from the calculation are also marked with an 'x'.
 
 Usage:
     qpcr-relative-expression (amp|amplification) <toml> [-o <path> | -O] [-l]
+        [-b] [-n] [-m <MB>] [--if-changed]
 
 Arguments:
     <toml>
@@ -28,19 +32,40 @@ Options:
 
     -l --log-rfu
         Plot the relative fluorescence unit (RFU) axis on a log scale.
+
+    -b --baseline
+        Subtract the background fluorescence from each curve, so that curves 
+        from different wells can be compared more easily.  The background is 
+        estimated from the cycles given by the `qpcr.baseline.cycles` metadata 
+        (default: [3, 15]), which should come before any amplification.  If 
+        `qpcr.baseline.drift` is true, a line is fit to those cycles (rather 
+        than just taking the average), to account for fluorescence that 
+        drifts over the course of the run.
+
+    -n --normalize
+        Scale each curve so that its maximum fluorescence is 1.
+
+    -m --max-memory <MB>
+        Load and plot the curves a few plates at a time, keeping no more than 
+        (roughly) the given number of megabytes of curves in memory at once.  
+        This is only necessary for layouts that reference so many plates that 
+        their curves don't all fit in memory.
+
+    --if-changed
+        Don't do anything if the output image is up-to-date.  See 
+        `qpcr-relative-expression -h` for more information.
 """
 
-import wellmap
 import docopt
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from .layout import add_labels, add_ΔΔcq_flags, init_style
-from wellmap_qpcr.load import load_trace, load_cq
+from .experiment import Experiment
+from wellmap_qpcr.compute import preprocess_traces, get_baseline_options
+from wellmap_qpcr.cache import InputManifest
+from wellmap_qpcr import figures
 from wellmap_qpcr.utils import plot_or_save, resolve_img_path
 from color_me import ucsf
-from more_itertools import flatten
 from pathlib import Path
 
 def main():
@@ -53,47 +78,68 @@ def main():
             layout_path,
     )
 
-    df_cq, df_trace, style = load(layout_path)
+    manifest = InputManifest(
+            [layout_path], [img_path],
+            enabled=args['--if-changed'],
+    )
+    if manifest.is_current():
+        return
+
+    df_cq, df_trace, style = load(
+            layout_path,
+            baseline=args['--baseline'],
+            normalize=args['--normalize'],
+            max_bytes=get_max_bytes(args['--max-memory']),
+    )
     style.finalize(df_cq)
     
     with plot_or_save(layout_path, img_path):
-        plot_trace_groups(df_cq, df_trace, style, args['--log-rfu'])
+        plot_trace_groups(
+                df_cq, df_trace, style, args['--log-rfu'],
+                ylabel=get_rfu_label(args['--normalize']),
+        )
 
-def load(layout_path):
-    layout, extra = wellmap.load(
-            layout_path,
-            path_guess='{0.stem}',
-            path_required=True,
-            extras=True,
-    )
+    manifest.record()
+
+def load(layout_path, baseline=False, normalize=False, max_bytes=None):
+    expt = Experiment(layout_path, max_bytes=max_bytes)
+    df_trace = iter_experiment_traces(expt, baseline, normalize)
+    return expt.cq, df_trace, expt.style
 
-    add_labels(layout, extra)
-    add_ΔΔcq_flags(layout, extra)
+def iter_experiment_traces(expt, baseline=False, normalize=False):
+    # The curves are preprocessed one well at a time, so it doesn't matter 
+    # how they're chunked.
+    for df in expt.iter_trace():
+        yield preprocess_trace_chunk(expt, df, baseline, normalize)
 
-    # The `load_data()` function should probably be provided by wellmap...
-    cq = load_data(layout, load_cq)
-    trace = load_data(layout, load_trace)
+def preprocess_trace_chunk(expt, df, baseline=False, normalize=False):
+    if not baseline and not normalize:
+        return df
 
-    # Wellmap should probably also provided a function that does the merge with 
-    # the same API/semantics as `wellmap.load()`...
-    df_cq = pd.merge(layout, cq, on=['well0'])
-    df_trace = pd.merge(layout, trace, on=['well'])
+    options = get_baseline_options(expt.extra)
+    if not baseline:
+        options['baseline'] = None
 
-    return df_cq, df_trace, init_style(extra)
+    return preprocess_traces(df, normalize=normalize, **options)
 
-def load_data(layout, data_loader):
-    chunks = []
+def get_max_bytes(max_memory_mb):
+    if max_memory_mb is None:
+        return None
+    return int(float(max_memory_mb) * 2**20)
 
-    for path in layout['path'].unique():
-        df = data_loader(path)
-        df['path'] = path
-        chunks.append(df)
+def get_rfu_label(normalize=False):
+    return 'normalized RFU' if normalize else 'RFU'
 
-    return pd.concat(chunks, sort=False)
+def plot_trace_groups(df_cq, df_trace, style, log_rfu=False, ylabel='RFU'):
+    # The curves can be given either as a single data frame, or as an 
+    # iterable of data frames (e.g. one per plate) that will only be loaded 
+    # one at a time.
+    if isinstance(df_trace, pd.DataFrame):
+        df_trace = [df_trace]
 
-def plot_trace_groups(df_cq, df_trace, style, log_rfu=False):
     n_rows, n_cols = style.shape
-    fig, axes = plt.subplots(
+    fig, axes = figures.subplots(
+            ('amplification', log_rfu, ylabel),
             n_rows, n_cols,
             squeeze=False,
             sharex=True,
@@ -101,16 +147,19 @@ def plot_trace_groups(df_cq, df_trace, style, log_rfu=False):
             figsize=(n_cols*2 + 2, n_rows*2),
     )
 
-    for label, g in df_trace.groupby('label'):
-        ij = style.indices[label]
-        labels = plot_trace_group(
-                axes[ij], label,
-                df_cq.query('label==@label'), g, 
-                style,
-        )
+    labels = {}
+
+    for chunk in df_trace:
+        for label, g in chunk.groupby('label'):
+            ij = style.indices[label]
+            labels.update(plot_trace_group(
+                    axes[ij], label,
+                    df_cq.query('label==@label'), g, 
+                    style,
+            ))
 
     for ax in axes[:,0]:
-        ax.set_ylabel('RFU')
+        ax.set_ylabel(ylabel)
     for ax in axes[-1,:]:
         ax.set_xlabel('cycles')
 
@@ -123,20 +172,25 @@ def plot_trace_groups(df_cq, df_trace, style, log_rfu=False):
             loc='upper left',
     )
 
-    fig.tight_layout()
+    figures.tight_layout(fig)
+
+    return fig
 
 def plot_trace_group(ax, label, df_cq, df_trace, style):
     ax.set_title(label)
 
-    cols = ['well', 'sublabel', 'housekeeping', 'treatment']
-    df_cq = df_cq.set_index('well')
+    # Wells are identified by plate and name, since a layout can describe
+    # more than one plate.
+    cols = ['path', 'well', 'sublabel', 'housekeeping', 'treatment']
+    df_cq = df_cq.set_index(['path', 'well'])
 
     if 'treatment' not in df_trace:
         df_trace['treatment'] = True
 
     labels = {}
 
-    for (well, sublabel, housekeeping, treatment), g in df_trace.groupby(cols):
+    for key, g in df_trace.groupby(cols):
+        path, well, sublabel, housekeeping, treatment = key
         color = style.color.get(sublabel, ucsf.blue[0]) \
                 if treatment else ucsf.dark_grey[0]
         linestyle = '--' if housekeeping else '-'
@@ -151,7 +205,7 @@ def plot_trace_group(ax, label, df_cq, df_trace, style):
         )
         labels[sublabel] = artists[0]
 
-        cq = df_cq.loc[well,'cq']
+        cq = df_cq.loc[(path, well),'cq']
         rfu = np.interp(cq, g['cycle'], g['rfu'])
         ax.plot(
                 [cq], [rfu], 
@@ -161,5 +215,14 @@ def plot_trace_group(ax, label, df_cq, df_trace, style):
                 zorder=treatment+2,
         )
 
+        if 'outlier' in df_cq and df_cq.loc[(path, well),'outlier']:
+            ax.plot(
+                    [cq], [rfu],
+                    marker='x',
+                    markersize=10,
+                    markeredgecolor=color,
+                    zorder=treatment+3,
+            )
+
     return labels
 
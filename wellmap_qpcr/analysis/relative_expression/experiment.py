@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+
+"""\
+Make the relative expression, amplification, and melt curve plots at once.
+
+This is faster than running each subcommand separately, because the layout and
+the data files are only loaded once.
+
+Usage:
+    qpcr-relative-expression all <toml> [-o <path> | -O] [-c <dir>] [-l] [-b]
+        [-n] [-m <MB>] [--if-changed]
+
+Arguments:
+    <toml>
+        A wellmap file describing the experimental layout.  Refer to
+        `qpcr-relative-expression -h` for a detailed description of this file.
+
+Options:
+    -o --output <path>
+        Output images of the plots to the given path, instead of launching the
+        interactive GUI.  The file type is inferred from the file extension.
+        If the path contains a percent sign (e.g. '%.svg'), it will be replaced
+        with the base name of the <toml> path.  The amplification and melt
+        curve plots will have '_amp' and '_melt' added to the end of the file
+        name, respectively.
+
+    -O --output-default
+        Output images of the plots to the default paths.  This is equivalent
+        to specifying `--output %.svg`.
+
+    -c --cache <dir>
+        Cache the results of each step of the calculation in the given
+        directory.  See `qpcr-relative-expression -h` for more information.
+
+    -l --log-rfu
+        Plot the relative fluorescence unit (RFU) axis of the amplification
+        curves on a log scale.
+
+    -b --baseline
+        Subtract the background fluorescence from each amplification curve.  
+        See `qpcr-relative-expression amp -h` for more information.
+
+    -n --normalize
+        Scale each amplification curve so that its maximum fluorescence is 1.
+
+    -m --max-memory <MB>
+        Load and plot the curves a few plates at a time, keeping no more than
+        (roughly) the given number of megabytes of curves in memory at once. 
+        See `qpcr-relative-expression amp -h` for more information.
+
+    --if-changed
+        Don't do anything if the output images are up-to-date.  See
+        `qpcr-relative-expression -h` for more information.
+"""
+
+import wellmap
+import docopt
+import autoprop
+import pandas as pd
+
+from .layout import init_style, get_calc_extras
+from wellmap_qpcr.compute import (
+        calc_expression_steps, add_labels, add_ΔΔcq_flags, add_outlier_flags,
+        well_efficiencies, get_efficiency_mode,
+        fit_sigmoids, add_model_cq, get_cq_model,
+)
+from wellmap_qpcr.load import load_cq, load_trace, load_melt
+from wellmap_qpcr.cache import StageCache, InputManifest, fingerprint_path
+from wellmap_qpcr.wells import WellIndex
+from wellmap_qpcr.utils import plot_or_save, resolve_img_path
+from pathlib import Path
+
+def main():
+    from .expression import plot_expression
+    from .amplification import (
+            plot_trace_groups, iter_experiment_traces, get_rfu_label,
+            get_max_bytes,
+    )
+    from .melt import plot_melt_groups
+
+    args = docopt.docopt(__doc__)
+    layout_path = Path(args['<toml>'])
+    img_path = resolve_img_path(
+            args['--output'],
+            '%.svg',
+            args['--output-default'],
+            layout_path,
+    )
+
+    img_paths = {
+            suffix: img_path.with_name(img_path.stem + suffix + img_path.suffix)
+            for suffix in ['', '_amp', '_melt']
+    } if img_path else {}
+
+    manifest = InputManifest(
+            [layout_path], img_paths.values(),
+            enabled=args['--if-changed'],
+    )
+    if manifest.is_current():
+        return
+
+    expt = Experiment(
+            layout_path,
+            cache_dir=args['--cache'],
+            max_bytes=get_max_bytes(args['--max-memory']),
+    )
+    style = expt.style
+
+    plots = {
+            '': lambda: plot_expression(expt.expression, style),
+            '_amp': lambda: plot_trace_groups(
+                expt.cq,
+                iter_experiment_traces(
+                    expt, args['--baseline'], args['--normalize']),
+                style,
+                args['--log-rfu'],
+                ylabel=get_rfu_label(args['--normalize']),
+            ),
+            '_melt': lambda: plot_melt_groups(expt.iter_melt(), style),
+    }
+
+    if img_path:
+        for suffix, plot in plots.items():
+            with plot_or_save(layout_path, img_paths[suffix]):
+                plot()
+
+        manifest.record()
+
+    else:
+        with plot_or_save(layout_path, None):
+            for plot in plots.values():
+                plot()
+
+@autoprop
+class Experiment:
+    """
+    The data from a relative expression experiment.
+
+    The layout, and each kind of data (Cq values, amplification curves, melt
+    curves), is loaded the first time it's needed and then reused, so that
+    all the relative expression analyses can be performed on the same layout
+    without parsing any file more than once.  If a *cache_dir* is given, the
+    data and the results of each step of the ΔΔCq calculation are also cached
+    on disk (see `StageCache`).
+
+    If *max_bytes* is given, the curves can also be processed in chunks of
+    roughly that size (see `iter_trace()` and `iter_melt()`), so that the
+    memory needed doesn't grow with the number of plates.  The per-well
+    quantities derived from the curves (e.g. efficiencies) are then
+    calculated one chunk at a time, too.
+    """
+
+    def __init__(self, layout_path, *, cache_dir=None, max_bytes=None):
+        self.layout_path = Path(layout_path)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+        self._layout = None
+        self._extra = None
+        self._style = None
+        self._cache = None
+        self._well_index = None
+        self._cq = None
+        self._trace = None
+        self._melt = None
+        self._efficiency = None
+        self._sigmoid_fits = None
+        self._expression_steps = None
+
+    def get_layout(self):
+        if self._layout is None:
+            self._load_layout()
+        return self._layout
+
+    def get_extra(self):
+        if self._extra is None:
+            self._load_layout()
+        return self._extra
+
+    def get_style(self):
+        if self._style is None:
+            self._style = init_style(self.extra)
+            self._style.finalize(self.layout)
+        return self._style
+
+    def get_well_index(self):
+        if self._well_index is None:
+            self._well_index = WellIndex(self.layout)
+        return self._well_index
+
+    def get_cq(self):
+        if self._cq is None:
+            cq = self.cache('wells', lambda: self._load_data(load_cq))
+
+            if get_efficiency_mode(self.extra) == 'per-well':
+                cq = cq.join(self.efficiency, on=self.efficiency.index.names)
+            if get_cq_model(self.extra) != 'instrument':
+                cq = add_model_cq(cq, self.sigmoid_fits)
+
+            add_outlier_flags(cq, self.extra)
+            self._cq = cq
+
+        return self._cq
+
+    def get_trace(self):
+        if self._trace is None:
+            self._trace = self.cache(
+                    'trace', lambda: self._load_data(load_trace))
+        return self._trace
+
+    def get_melt(self):
+        if self._melt is None:
+            self._melt = self.cache('melt', lambda: self._load_data(load_melt))
+        return self._melt
+
+    def iter_trace(self):
+        """
+        Yield the amplification curves in chunks of no more than (roughly)
+        *max_bytes* each, or all at once if there's no limit.
+        """
+        yield from self._iter_data('trace', load_trace)
+
+    def iter_melt(self):
+        """
+        Yield the melt curves in chunks of no more than (roughly) *max_bytes*
+        each, or all at once if there's no limit.
+        """
+        yield from self._iter_data('melt', load_melt)
+
+    def get_efficiency(self):
+        if self._efficiency is None:
+            self._efficiency = self.cache(
+                    'efficiency', lambda: pd.concat(
+                        map(well_efficiencies, self.iter_trace())))
+        return self._efficiency
+
+    def get_sigmoid_fits(self):
+        if self._sigmoid_fits is None:
+            model = get_cq_model(self.extra)
+            if model == 'instrument':
+                model = 'l4'
+
+            self._sigmoid_fits = self.cache(
+                    f'sigmoid_{model}',
+                    lambda: pd.concat(
+                        fit_sigmoids(df, model) for df in self.iter_trace()),
+            )
+        return self._sigmoid_fits
+
+    def get_expression_steps(self):
+        if self._expression_steps is None:
+            self._expression_steps = calc_expression_steps(
+                    self.cq, self.cache)
+        return self._expression_steps
+
+    def get_expression(self):
+        return list(self.expression_steps.values())[-1]
+
+    def get_cache(self):
+        if self._cache is None:
+            self._cache = StageCache(self.cache_dir, [
+                    self.layout,
+                    get_calc_extras(self.extra),
+                    *map(fingerprint_path, self.layout['path'].unique()),
+            ])
+        return self._cache
+
+    def _load_layout(self):
+        self._layout, self._extra = wellmap.load(
+                self.layout_path,
+                path_guess='{0.stem}',
+                path_required=True,
+                extras=True,
+        )
+        add_labels(self._layout, self._extra)
+        add_ΔΔcq_flags(self._layout, self._extra)
+
+    def _load_data(self, data_loader):
+        return load_data(self.layout, self.well_index, data_loader)
+
+    def _iter_data(self, attr, data_loader):
+        # Use (and keep) the whole data frame unless there's a memory limit,
+        # or unless it's already been loaded anyways.
+        if self.max_bytes is None or getattr(self, f'_{attr}') is not None:
+            yield getattr(self, attr)
+        else:
+            yield from iter_data(
+                    self.layout, self.well_index, data_loader, self.max_bytes)
+
+def load_data(layout, well_index, data_loader):
+    """
+    Load the data for every plate in the given layout, and join it with the
+    layout.
+
+    Each row of data is matched to the layout row for the same well on the
+    same plate, using the given `WellIndex`.  The data can name wells either
+    with or without zero-padding (i.e. with a *well* or *well0* column).
+    Wells that aren't in the layout are dropped, as are names that aren't
+    wells at all (e.g. the unnamed first column of some exports, which ends
+    up among the wells when the curves are melted).  Columns that are also in
+    the layout (e.g. the well names) are taken from the layout.
+    """
+    return pd.concat([
+        load_plate_data(layout, well_index, data_loader, path)
+        for path in well_index.plates
+    ], ignore_index=True, sort=False)
+
+def iter_data(layout, well_index, data_loader, max_bytes):
+    """
+    Like `load_data()`, but yield the data in chunks of whole plates, each
+    using no more than (roughly) *max_bytes* of memory.
+
+    Plates are loaded one at a time, and added to the current chunk until it
+    reaches the limit.  Only one chunk is in memory at a time (as long as the
+    caller doesn't keep them), so a single plate bigger than the limit is the
+    most that can be loaded at once.
+    """
+    chunk, chunk_bytes = [], 0
+
+    for path in well_index.plates:
+        df = load_plate_data(layout, well_index, data_loader, path)
+        df_bytes = df.memory_usage(deep=True).sum()
+
+        if chunk and chunk_bytes + df_bytes > max_bytes:
+            yield pd.concat(chunk, ignore_index=True, sort=False)
+            chunk, chunk_bytes = [], 0
+
+        chunk.append(df)
+        chunk_bytes += df_bytes
+
+    if chunk:
+        yield pd.concat(chunk, ignore_index=True, sort=False)
+
+def load_plate_data(layout, well_index, data_loader, path):
+    """
+    Load the data for one plate, and join it with the layout.  See
+    `load_data()`.
+    """
+    df = data_loader(Path(path))
+    well_col = 'well' if 'well' in df else 'well0'
+
+    i = well_index.locate(path, df[well_col])
+    found = i >= 0
+
+    data = df.loc[found, [x for x in df if x not in layout]]
+
+    return pd.concat([
+        layout.take(i[found]).reset_index(drop=True),
+        data.reset_index(drop=True),
+    ], axis=1)
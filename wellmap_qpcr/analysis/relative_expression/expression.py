@@ -4,9 +4,11 @@
 Compare relative gene expression using the ΔΔCq equation.
 
 Usage:
-    qpcr-relative-expression <toml> [-o <path> | -O] [-v]
+    qpcr-relative-expression <toml> [-o <path> | -O] [-e <dir>] [-c <dir>] [-v]
+        [--if-changed]
     qpcr-relative-expression (amp|amplification) [...]
     qpcr-relative-expression melt [...]
+    qpcr-relative-expression all [...]
 
 Subcommands:
     If no subcommands are specified, a bar chart comparing the relative 
@@ -35,9 +37,29 @@ Options:
         Output an image of the plot to the default path.  This is equivalent to 
         specifying `--output %.svg`.
 
+    -e --export <dir>
+        Save the numbers from each step of the calculation as Parquet files in 
+        the given directory.  There will be one dataset for each step (the 
+        per-well Cq values, the aggregated Cq values, the ΔCq values, and the 
+        ΔΔCq values if applicable), each partitioned by layout and plate.
+
+    -c --cache <dir>
+        Cache the results of each step of the calculation in the given 
+        directory.  The results are reused for as long as the layout, the 
+        data files, and the `qpcr.*` metadata that affect the calculation stay 
+        the same.  Metadata that only affects the plot (e.g. `qpcr.color`, 
+        `qpcr.order`) can be changed without invalidating the cache.
+
     -v --verbose
         Print the raw numbers for each step of the calculation.
 
+    --if-changed
+        Don't do anything if the output image is newer than the layout and 
+        every data file it references, and none of them (nor any of the 
+        command-line options) have changed since the image was made.  This 
+        makes it cheap to regenerate plots for many layouts when only a few of 
+        them have changed.  Has no effect if the plot isn't being saved.
+
 Layout:
     The layout of the plate should be described using the wellmap file format.  
     For a general description of this format, refer to:
@@ -121,16 +143,52 @@ Layout:
                 5. purple    6. navy    7. teal
 
             By default, all plots will be blue.
+
+        qpcr.cq_model
+            Where the Cq value of each well should come from.  The default, 
+            'instrument', uses the values calculated by the qPCR instrument.  
+            If 'l4' or 'l5', a 4- or 5-parameter logistic model is fit to the 
+            amplification curve of each well (in parallel), and the Cq value is 
+            taken to be the maximum of the second derivative of the model.  
+            The original Cq values, and the plateau and maximum slope of each 
+            fit, are also included in the verbose output and the exported 
+            per-well values.
+
+        qpcr.efficiency
+            How to account for the amplification efficiency of each well.  The 
+            default, 'ideal', assumes that every well has perfect (100%) 
+            efficiency.  If 'per-well', the efficiency of each well is 
+            estimated from the shape of its amplification curve (in the style 
+            of LinRegPCR).  These estimates are averaged over the wells with 
+            the same `primers` (or, if that attribute isn't given, over the 
+            target and reference gene wells of each label), and the averages 
+            are used to weight the Cq values.  Wells in a group where no 
+            efficiency could be estimated are excluded, with a warning.  The 
+            per-well efficiencies are also included in the verbose output and 
+            the exported per-well values, which is useful for quality control.
+
+        qpcr.outliers.method
+        qpcr.outliers.threshold
+        qpcr.outliers.min_mad
+            If the `qpcr.outliers` table is given, replicate wells with 
+            outlying Cq values will be excluded from the calculation.  The only 
+            method currently supported is 'mad', which rejects wells with a 
+            modified z-score (based on the median absolute deviation of each 
+            group of replicates) greater than the threshold (default: 3.5).  
+            The median absolute deviation is taken to be at least `min_mad` 
+            cycles (default: 0.05), so that very tight replicates don't lose 
+            wells over tiny differences.  
+            Rejected wells are marked in the verbose output, the exported 
+            per-well values, and the amplification plots.
 """
 
-import wellmap
 import sys, docopt
-import matplotlib.pyplot as plt
 import pandas as pd
 
-from .calc import agg_cq, calc_Δcq, calc_ΔΔcq
-from .layout import add_labels, add_ΔΔcq_flags, init_style
-from wellmap_qpcr.load import load_cq
+from .experiment import Experiment
+from wellmap_qpcr.export import export_parquet
+from wellmap_qpcr.cache import InputManifest
+from wellmap_qpcr import figures
 from wellmap_qpcr.utils import plot_or_save, resolve_img_path
 from color_me import ucsf
 from pathlib import Path
@@ -154,6 +212,10 @@ def main():
         from .melt import main
         return main()
 
+    if analysis == 'all':
+        from .experiment import main
+        return main()
+
     args = docopt.docopt(__doc__)
     analysis = args.get('<analysis>')
     layout_path = Path(args['<toml>'])
@@ -164,71 +226,51 @@ def main():
             layout_path,
     )
 
-    df, layout, style = load(layout_path, verbose=args['--verbose'])
-    style.finalize(layout)
-
-    with plot_or_save(layout_path, img_path):
-        plot_expression(df, style)
-
-def load(layout_path, verbose=False):
-    df, extra = wellmap.load(
-            layout_path,
-            data_loader=load_cq,
-            merge_cols=True,
-            path_guess='{0.stem}',
-            extras=True,
+    manifest = InputManifest(
+            [layout_path], [img_path],
+            enabled=args['--if-changed'],
     )
+    if manifest.is_current():
+        return
 
-    add_labels(df, extra)
-    add_ΔΔcq_flags(df, extra)
-
-    def cols(*cols):
-        cols = list(cols)
-        if 'treatment' not in df:
-            cols.remove('treatment')
-        return cols
-
-    if verbose:
-        print(df[cols('well', 'housekeeping', 'treatment', 'label', 'cq')])
-        print()
-
-    layout = df
-
-    df = df\
-            .groupby(cols('housekeeping', 'treatment', 'label'))\
-            .apply(agg_cq)
-
-    if verbose:
-        print(df)
-        print()
-
-    df = calc_Δcq(
-            df_expt=df.loc[0],
-            df_ref=df.loc[1],
+    df, layout, style = load(
+            layout_path,
+            verbose=args['--verbose'],
+            export_dir=args['--export'],
+            cache_dir=args['--cache'],
     )
+    style.finalize(layout)
 
-    if verbose:
-        print(df)
-        print()
+    with plot_or_save(layout_path, img_path):
+        plot_expression(df, style)
 
-    # If the user didn't specify experimental/control treatment conditions, 
-    # stop here and just report ΔCq instead of ΔΔCq.
+    manifest.record()
 
-    if 'treatment' in df.index.names:
-        df = calc_ΔΔcq(
-                df_expt=df.loc[1],
-                df_ref=df.loc[0],
-        )
+def load(layout_path, verbose=False, export_dir=None, cache_dir=None):
+    expt = Experiment(layout_path, cache_dir=cache_dir)
 
+    for step, df in expt.expression_steps.items():
         if verbose:
-            print(df)
+            if step == 'wells':
+                cols = [
+                        'well', 'housekeeping', 'treatment', 'label', 'cq',
+                        'cq_instrument', 'efficiency', 'outlier',
+                ]
+                print(df[[x for x in cols if x in df]])
+            else:
+                print(df)
+            print()
+
+        if export_dir:
+            export_parquet(export_dir, layout_path, step, df)
 
-    return df, layout, init_style(extra)
+    return expt.expression, expt.cq, expt.style
 
 def plot_expression(df, style):
     n_cols, n_bars = style.shape
 
-    fig, axes = plt.subplots(
+    fig, axes = figures.subplots(
+            'expression',
             1, n_cols,
             squeeze=False,
             sharey=True,
@@ -270,7 +312,9 @@ def plot_expression(df, style):
 
     axes[0].set_ylabel('gene expression')
 
-    fig.tight_layout()
+    figures.tight_layout(fig)
+
+    return fig
 
 
 
@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 
-import numpy as np
-
 from pydantic import BaseModel, validator
 from typing import Optional, Dict, Tuple
 from more_itertools import unique_everseen as unique
@@ -33,39 +31,20 @@ class Style(BaseModel):
         else:
             self.shape, self.indices = infer_shape_from_order_tuples(self.order)
 
-def add_labels(df, extra):
-    # - "label" is used to identify a group of wells that can be collectively 
-    #   used to calculate a ΔΔCq value, i.e. relative gene expression.  Each 
-    #   group of wells with the same label must have at least 4 conditions: 
-    #   experimental/ref gene/treatment.
-    # - "sublabel" is used to identify the wells within a "label" group, for 
-    #   cases where the "label" group is clear from context (e.g. each group is 
-    #   split into its own plot).
-
-    format_cols = ['label', 'sublabel']
-
-    def format_cell(row, col):
-        return row[col].format_map(row)
-    
-    for col in format_cols:
-        df[col] = df.apply(format_cell, args=(col,), axis=1)
-
-def add_ΔΔcq_flags(df, extra):
-    for col in ['housekeeping', 'treatment']:
-        if col in df.columns:
-            continue
-
-        if col in extra.get('qpcr', {}):
-            i = df.eval(extra['qpcr'][col]['true'])
-            j = df.eval(extra['qpcr'][col]['false'])
-
-            df[col] = np.nan
-            df.loc[i,col] = True
-            df.loc[j,col] = False
-
 def init_style(extra):
     return Style.parse_obj(extra.get('qpcr', {}))
 
+def get_calc_extras(extra):
+    """
+    Return the `qpcr.*` metadata that affect the calculation, as opposed to 
+    just the appearance of the plots.
+    """
+    return {
+            k: v
+            for k, v in extra.get('qpcr', {}).items()
+            if k not in Style.__fields__
+    }
+
 def infer_order_from_layout(df):
     order = {}
     if 'row_i' in df and 'col_j' in df:
@@ -7,7 +7,8 @@ This is a simple (although not fool-proof) way to confirm that the PCR
 reactions amplified only a single, homogeneous product.
 
 Usage:
-    qpcr-relative-expression melt <toml> [-o <path> | -O]
+    qpcr-relative-expression melt <toml> [-o <path> | -O] [-m <MB>]
+        [--if-changed]
 
 Arguments:
     <toml>
@@ -25,21 +26,28 @@ Options:
         Output an image of the plot to the default path.  This is equivalent to 
         specifying `--output %_melt.svg`.
 
+    -m --max-memory <MB>
+        Load and plot the curves a few plates at a time, keeping no more than 
+        (roughly) the given number of megabytes of curves in memory at once.  
+        See `qpcr-relative-expression amp -h` for more information.
+
+    --if-changed
+        Don't do anything if the output image is up-to-date.  See 
+        `qpcr-relative-expression -h` for more information.
+
 Looking at the melt curves is a useful (but not foolproof) way to confirm that 
 the PCR reactions worked cleanly.
 """
 
-import wellmap
 import docopt
-import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from .layout import add_labels, add_ΔΔcq_flags, init_style
-from wellmap_qpcr.load import load_melt
+from .experiment import Experiment
+from .amplification import get_max_bytes
+from wellmap_qpcr.cache import InputManifest
+from wellmap_qpcr import figures
 from wellmap_qpcr.utils import plot_or_save, resolve_img_path
 from color_me import ucsf
-from more_itertools import flatten
 from pathlib import Path
 
 def main():
@@ -52,28 +60,36 @@ def main():
             layout_path,
     )
 
-    df, style = load(layout_path)
-    style.finalize(df)
+    manifest = InputManifest(
+            [layout_path], [img_path],
+            enabled=args['--if-changed'],
+    )
+    if manifest.is_current():
+        return
+
+    df, style = load(
+            layout_path,
+            max_bytes=get_max_bytes(args['--max-memory']),
+    )
 
     with plot_or_save(layout_path, img_path):
         plot_melt_groups(df, style)
 
-def load(layout_path):
-    df, extra = wellmap.load(
-            layout_path,
-            data_loader=load_melt,
-            merge_cols=True,
-            path_guess='{0.stem}',
-            extras=True,
-    )
-    add_labels(df, extra)
-    add_ΔΔcq_flags(df, extra)
+    manifest.record()
 
-    return df, init_style(extra)
+def load(layout_path, max_bytes=None):
+    expt = Experiment(layout_path, max_bytes=max_bytes)
+    return expt.iter_melt(), expt.style
 
 def plot_melt_groups(df, style):
+    # Like `plot_trace_groups()`, accept either a data frame or an iterable 
+    # of data frames.
+    if isinstance(df, pd.DataFrame):
+        df = [df]
+
     n_rows, n_cols = style.shape
-    fig, axes = plt.subplots(
+    fig, axes = figures.subplots(
+            'melt',
             n_rows, n_cols,
             squeeze=False,
             sharex=True,
@@ -81,9 +97,12 @@ def plot_melt_groups(df, style):
             figsize=(n_cols*2 + 2, n_rows*2),
     )
 
-    for label, g in df.groupby('label'):
-        ij = style.indices[label]
-        labels = plot_melt_curves(axes[ij], label, g, style)
+    labels = {}
+
+    for chunk in df:
+        for label, g in chunk.groupby('label'):
+            ij = style.indices[label]
+            labels.update(plot_melt_curves(axes[ij], label, g, style))
 
     for ax in axes[:,0]:
         ax.set_ylabel('dRFU/dT')
@@ -96,18 +115,20 @@ def plot_melt_groups(df, style):
             loc='upper left',
     )
 
-    fig.tight_layout()
+    figures.tight_layout(fig)
+
+    return fig
 
 def plot_melt_curves(ax, label, df, style):
     ax.set_title(label)
 
     labels = {}
-    cols = ['well', 'sublabel', 'housekeeping', 'treatment']
+    cols = ['path', 'well', 'sublabel', 'housekeeping', 'treatment']
 
     if 'treatment' not in df:
         df['treatment'] = True
 
-    for (well, sublabel, housekeeping, treatment), g in df.groupby(cols):
+    for (path, well, sublabel, housekeeping, treatment), g in df.groupby(cols):
         color = style.color.get(sublabel, ucsf.blue[0]) \
                 if treatment else ucsf.dark_grey[0]
         linestyle = '-' if housekeeping else '--'
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""\
+Make a multi-page PDF with every plot relevant to the given experiment.
+
+Usage:
+    qpcr-report <toml> [-o <path>] [-c <dir>] [-l] [--if-changed]
+
+Arguments:
+    <toml>
+        A wellmap file describing the experimental layout.  The pages included
+        in the report depend on the information in the layout:
+
+        - If the wells have labels (see `qpcr-relative-expression -h`), the
+          relative expression, amplification, and melt curve plots are
+          included.
+
+        - The Cq heatmap (see `qpcr-cq-heatmap -h`) is always included.
+
+        - If the wells have template concentrations (see
+          `qpcr-check-efficiency -h`), the standard curves are included.
+
+Options:
+    -o --output <path>              [default: %_report.pdf]
+        The path where the report should be written.  If the path contains a
+        percent sign, it will be replaced with the base name of the <toml>
+        path.
+
+    -c --cache <dir>
+        Cache the results of each step of the relative expression calculation
+        in the given directory.  See `qpcr-relative-expression -h` for more
+        information.
+
+    -l --log-rfu
+        Plot the relative fluorescence unit (RFU) axis of the amplification
+        curves on a log scale.
+
+    --if-changed
+        Don't do anything if the report is newer than the layout and every
+        data file it references, and none of them (nor any of the command-line
+        options) have changed since the report was made.
+"""
+
+import docopt
+import matplotlib.pyplot as plt
+
+from .relative_expression.experiment import Experiment
+from .relative_expression.expression import plot_expression
+from .relative_expression.amplification import plot_trace_groups
+from .relative_expression.melt import plot_melt_groups
+from .cq_heatmap import CqHeatmap
+from .check_efficiency import CheckEfficiency
+from wellmap_qpcr.compute import fill_defaults
+from wellmap_qpcr.cache import InputManifest
+from matplotlib.backends.backend_pdf import PdfPages
+from pathlib import Path
+
+def main():
+    args = docopt.docopt(__doc__)
+    layout_path = Path(args['<toml>'])
+    pdf_path = Path(args['--output'].replace('%', layout_path.stem))
+
+    manifest = InputManifest(
+            [layout_path], [pdf_path],
+            enabled=args['--if-changed'],
+    )
+    if manifest.is_current():
+        return
+
+    # Every page is rendered by the same non-interactive backend, so there's
+    # no reason to ever start a GUI.
+    plt.switch_backend('pdf')
+
+    expt = Experiment(layout_path, cache_dir=args['--cache'])
+    write_report(expt, pdf_path, log_rfu=args['--log-rfu'])
+    manifest.record()
+
+def write_report(expt, pdf_path, log_rfu=False):
+    """
+    Write a PDF with every plot relevant to the given `Experiment`.
+
+    All of the plots are made from the data already loaded by the experiment,
+    so no file is parsed more than once.
+    """
+    with PdfPages(pdf_path, metadata={'Title': expt.layout_path.stem}) as pdf:
+        for plot in iter_report_pages(expt, log_rfu):
+            fig = plot()
+            pdf.savefig(fig)
+            plt.close(fig)
+
+def iter_report_pages(expt, log_rfu=False):
+    layout = expt.layout
+
+    if 'label' in layout:
+        yield lambda: plot_expression(expt.expression, expt.style)
+        yield lambda: plot_trace_groups(
+                expt.cq, expt.trace, expt.style, log_rfu)
+        yield lambda: plot_melt_groups(expt.melt, expt.style)
+
+    heatmap = CqHeatmap.from_bare()
+    heatmap.layout_toml = expt.layout_path
+    heatmap.df = expt.cq
+    yield heatmap.plot
+
+    if 'template_conc' in layout:
+        efficiency = CheckEfficiency.from_bare()
+        efficiency.layout_toml = expt.layout_path
+        efficiency.df = fill_defaults(expt.cq.copy())
+        efficiency.extras = expt.extra
+        yield efficiency.plot
+
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+
+"""\
+Run a local server that performs analyses on demand.
+
+Every command-line analysis has to import pandas, matplotlib, scipy, etc.
+before it can do anything, and that often takes longer than the analysis
+itself.  This server keeps a pool of worker processes with everything already
+imported, so each request only pays for the analysis.
+
+Usage:
+    qpcr-serve [-H <host>] [-p <port> | -s <path>] [-j <workers>] [-c <dir>]
+
+Options:
+    -H --host <host>            [default: 127.0.0.1]
+        The address to listen on.  Note that the server will read any layout
+        it's asked to, so think carefully before making it reachable from
+        other machines.
+
+    -p --port <port>            [default: 8000]
+        The port to listen on.
+
+    -s --socket <path>
+        Listen on the given Unix socket, instead of a TCP port.
+
+    -j --workers <n>            [default: 4]
+        The number of worker processes.  Each can perform one analysis at a
+        time.
+
+    -c --cache <dir>
+        Cache the results of each step of the relative expression calculation
+        in the given directory.  See `qpcr-relative-expression -h` for more
+        information.
+
+API:
+    GET /<analysis>?toml=<path>[&format=<format>][&log_rfu=1]
+
+    <analysis> can be any of the following:
+
+        expression      See `qpcr-relative-expression -h`
+        amplification   See `qpcr-relative-expression amp -h`
+        melt            See `qpcr-relative-expression melt -h`
+        efficiency      See `qpcr-check-efficiency -h`
+        optimize-ta     See `qpcr-optimize-ta -h`
+        cq-heatmap      See `qpcr-cq-heatmap -h`
+
+    <path> is the path to the layout, as seen by the server.  <format> can be
+    'json' (the default), or any image format supported by matplotlib (e.g.
+    'svg', 'png', 'pdf').  JSON responses map the name of each table (e.g.
+    'wells', 'cq', 'delta_cq') to a list of records.  Errors are reported as
+    JSON objects with an 'error' key.
+"""
+
+import os, socket, socketserver
+import json, docopt
+import matplotlib
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from io import BytesIO
+from pathlib import Path
+
+def main():
+    args = docopt.docopt(__doc__)
+    n_workers = int(args['--workers'])
+
+    if args['--socket']:
+        server = UnixHTTPServer(args['--socket'], AnalysisHandler)
+    else:
+        server = ThreadingHTTPServer(
+                (args['--host'], int(args['--port'])),
+                AnalysisHandler,
+        )
+
+    server.pool = ProcessPoolExecutor(n_workers, initializer=warm_up)
+    server.cache_dir = args['--cache']
+
+    # Start all the workers now, so that the first requests don't have to
+    # wait for them.
+    for future in [server.pool.submit(warm_up) for i in range(n_workers)]:
+        future.result()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+
+        if args['--socket']:
+            os.unlink(args['--socket'])
+
+def warm_up():
+    """
+    Import everything that the analyses will need, and start reusing figures
+    between requests.
+    """
+    matplotlib.use('agg')
+
+    from .relative_expression import expression
+    from . import check_efficiency, optimize_ta, cq_heatmap
+    from wellmap_qpcr import figures
+
+    figures.enable_templates()
+
+def run_analysis(analysis, layout_path, format='json', log_rfu=False, cache_dir=None):
+    """
+    Perform the given analysis, and return the content type and body of the
+    response.
+
+    This is meant to be called in a worker process.
+    """
+    import matplotlib.pyplot as plt
+
+    tables, plot = ANALYSES[analysis](Path(layout_path), log_rfu, cache_dir)
+
+    if format == 'json':
+        body = {
+                k: json.loads(_reset_index(df).to_json(
+                    orient='records',
+                    date_format='iso',
+                    default_handler=str,
+                ))
+                for k, df in tables.items()
+        }
+        return 'application/json', json.dumps(body).encode()
+
+    else:
+        fig = plot()
+        buf = BytesIO()
+        fig.savefig(buf, format=format)
+        plt.close(fig)
+
+        content_type = IMAGE_TYPES.get(format, f'image/{format}')
+        return content_type, buf.getvalue()
+
+def _expression(layout_path, log_rfu, cache_dir):
+    from .relative_expression.experiment import Experiment
+    from .relative_expression.expression import plot_expression
+
+    expt = Experiment(layout_path, cache_dir=cache_dir)
+    return (
+            expt.expression_steps,
+            lambda: plot_expression(expt.expression, expt.style),
+    )
+
+def _amplification(layout_path, log_rfu, cache_dir):
+    from .relative_expression.experiment import Experiment
+    from .relative_expression.amplification import plot_trace_groups
+
+    expt = Experiment(layout_path, cache_dir=cache_dir)
+    return (
+            {'wells': expt.cq, 'trace': expt.trace},
+            lambda: plot_trace_groups(expt.cq, expt.trace, expt.style, log_rfu),
+    )
+
+def _melt(layout_path, log_rfu, cache_dir):
+    from .relative_expression.experiment import Experiment
+    from .relative_expression.melt import plot_melt_groups
+
+    expt = Experiment(layout_path, cache_dir=cache_dir)
+    return (
+            {'melt': expt.melt},
+            lambda: plot_melt_groups(expt.melt, expt.style),
+    )
+
+def _efficiency(layout_path, log_rfu, cache_dir):
+    from .check_efficiency import CheckEfficiency
+
+    app = CheckEfficiency.from_bare()
+    app.layout_toml = layout_path
+    return {'wells': app.df, 'standard_curves': app.fits}, app.plot
+
+def _optimize_ta(layout_path, log_rfu, cache_dir):
+    from .optimize_ta import OptimizeTa
+
+    app = OptimizeTa.from_bare()
+    app.layout_toml = layout_path
+    app.layout_tomls = [layout_path]
+    return {'wells': app.df, 'anneal_optimum': app.optima}, app.plot
+
+def _cq_heatmap(layout_path, log_rfu, cache_dir):
+    from .cq_heatmap import CqHeatmap
+    from wellmap_qpcr.compute import cq_grid
+
+    app = CqHeatmap.from_bare()
+    app.layout_toml = layout_path
+    return {'wells': app.df, 'grid': cq_grid(app.df)}, app.plot
+
+ANALYSES = {
+        'expression': _expression,
+        'amplification': _amplification,
+        'melt': _melt,
+        'efficiency': _efficiency,
+        'optimize-ta': _optimize_ta,
+        'cq-heatmap': _cq_heatmap,
+}
+IMAGE_TYPES = {
+        'svg': 'image/svg+xml',
+        'pdf': 'application/pdf',
+        'jpg': 'image/jpeg',
+}
+
+class AnalysisHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        analysis = url.path.strip('/')
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+
+        if analysis not in ANALYSES:
+            return self._send_error(404, f"unknown analysis: {analysis!r}")
+        if 'toml' not in query:
+            return self._send_error(400, "missing required parameter: 'toml'")
+
+        future = self.server.pool.submit(
+                run_analysis,
+                analysis,
+                query['toml'],
+                format=query.get('format', 'json'),
+                log_rfu=query.get('log_rfu', '0') not in ('', '0', 'false'),
+                cache_dir=self.server.cache_dir,
+        )
+
+        try:
+            content_type, body = future.result()
+        except Exception as err:
+            return self._send_error(500, f'{type(err).__name__}: {err}')
+
+        self._send(200, content_type, body)
+
+    def address_string(self):
+        # Clients connected via Unix sockets don't have addresses.
+        return self.client_address[0] if self.client_address else 'local'
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        body = json.dumps({'error': message}).encode()
+        self._send(status, 'application/json', body)
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # `HTTPServer.server_bind()` assumes a (host, port) address.
+        socketserver.TCPServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+def _reset_index(df):
+    if any(x is not None for x in df.index.names):
+        return df.reset_index()
+    return df
+
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import os, sys
+import pickle
+import hashlib
+import wellmap_qpcr
+
+from wellmap_qpcr.load.store import STORE_DIR
+from pathlib import Path
+
+class StageCache:
+    """
+    Memoize the steps of a calculation on disk.
+
+    Every step is keyed by a hash of the inputs to the calculation as a whole
+    (e.g. the layout, the relevant metadata, and fingerprints of the data
+    files) along with the name of the step itself.  If *cache_dir* is None,
+    nothing is cached and every step is simply computed.
+    """
+
+    def __init__(self, cache_dir, inputs):
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.key = hash_inputs(inputs) if cache_dir else None
+
+    def __call__(self, stage, compute):
+        if not self.cache_dir:
+            return compute()
+
+        path = self.cache_dir / stage / f'{self.key}.pkl'
+
+        try:
+            with path.open('rb') as f:
+                return pickle.load(f)
+
+        # Treat corrupt cache files (e.g. left over from an interrupted write
+        # on a filesystem without atomic renames) as cache misses.
+        except FileNotFoundError:
+            pass
+        except (pickle.UnpicklingError, EOFError):
+            pass
+
+        result = compute()
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump(result, f)
+        os.replace(tmp_path, path)
+
+        return result
+
+def hash_inputs(inputs):
+    """
+    Return a hash of the given (picklable) objects.
+
+    The version of this package is included in the hash, so that results
+    cached by older versions of the code won't be reused.
+    """
+    h = hashlib.sha256()
+    h.update(wellmap_qpcr.__version__.encode())
+    h.update(pickle.dumps(inputs, protocol=4))
+    return h.hexdigest()
+
+def fingerprint_path(path):
+    """
+    Return a cheap fingerprint of the given file or directory.
+
+    The fingerprint consists of the name, size, and modification time of each
+    file, so it changes whenever the data is re-exported without having to
+    read the data itself.  Binary stores (see `qpcr-store`) are left out,
+    because they only duplicate the exported data.
+    """
+    path = Path(path)
+    paths = sorted(
+            p for p in path.rglob('*')
+            if STORE_DIR not in p.relative_to(path).parts
+    ) if path.is_dir() else [path]
+
+    return str(path), [
+            (str(p.relative_to(path)) if p != path else p.name,
+                p.stat().st_size, p.stat().st_mtime_ns)
+            for p in paths
+            if p.is_file()
+    ]
+
+class InputManifest:
+    """
+    Decide whether the outputs of a command need to be regenerated, like
+    `make` does.
+
+    The inputs are the given layouts, any files they include, and every data
+    directory they reference, along with the command-line options (other than
+    `--if-changed` itself).  The outputs are up-to-date if each one is newer
+    than every input, and if the fingerprints of the inputs (see
+    `fingerprint_path()`) match the ones recorded when the output was last
+    written.  The fingerprints catch changes that modification times alone
+    would miss, e.g. files replaced by older copies or different options.
+
+    The fingerprints are recorded in a hidden file next to each output.  If
+    *enabled* is false, or if there aren't any outputs (e.g. the plots are
+    being shown interactively), the outputs are never up-to-date and nothing
+    is recorded.
+    """
+
+    def __init__(self, layout_paths, output_paths, *, options=None,
+            enabled=True):
+
+        self.layout_paths = [Path(x) for x in layout_paths]
+        self.output_paths = [Path(x) for x in output_paths if x]
+        self.options = options if options is not None else [
+                x for x in sys.argv[1:] if x != '--if-changed'
+        ]
+        self.enabled = enabled and bool(self.output_paths)
+        self._fingerprints = None
+
+    def is_current(self):
+        if not self.enabled:
+            return False
+
+        key = self.get_key()
+        newest = self.get_newest_input_mtime()
+
+        for path in self.output_paths:
+            try:
+                if path.stat().st_mtime_ns < newest:
+                    return False
+                if _manifest_path(path).read_text() != key:
+                    return False
+            except FileNotFoundError:
+                return False
+
+        return True
+
+    def record(self):
+        if not self.enabled:
+            return
+
+        key = self.get_key()
+        for path in self.output_paths:
+            _manifest_path(path).write_text(key)
+
+    def get_fingerprints(self):
+        if self._fingerprints is None:
+            self._fingerprints = fingerprint_layouts(self.layout_paths)
+        return self._fingerprints
+
+    def get_key(self):
+        return hash_inputs([self.options, self.get_fingerprints()])
+
+    def get_newest_input_mtime(self):
+        return max(
+                (mtime for _, files in self.get_fingerprints()
+                    for _, _, mtime in files),
+                default=0,
+        )
+
+def fingerprint_layouts(layout_paths):
+    """
+    Return the fingerprints of every input to the given layouts (see
+    `find_layout_inputs()` and `fingerprint_path()`).
+    """
+    return [fingerprint_path(x) for x in find_layout_inputs(layout_paths)]
+
+def find_layout_inputs(layout_paths):
+    """
+    Return every file that the given layouts depend on: the layouts
+    themselves, any layouts they include, and the data directories that they
+    reference.
+    """
+    import wellmap
+
+    inputs = []
+
+    for layout_path in layout_paths:
+        df, meta = wellmap.load(layout_path, path_guess='{0.stem}', meta=True)
+        inputs += [layout_path, *sorted(meta.dependencies)]
+
+        if 'path' in df:
+            inputs += sorted(set(map(Path, df['path'].unique())))
+
+    return list(dict.fromkeys(Path(x).resolve() for x in inputs))
+
+def _manifest_path(output_path):
+    return output_path.parent / f'.{output_path.name}.inputs'
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+"""
+The numerical analyses behind the plots, with no plotting attached.
+
+Every function in this package takes and returns data frames, and this
+package only imports numpy and pandas.  That makes it suitable for worker
+processes and pipelines that shouldn't have to pay for importing matplotlib
+(which `wellmap` and all of the `qpcr-*` scripts do).
+"""
+
+from .expression import (
+        relative_expression, calc_expression_steps,
+        agg_cq, calc_Δcq, calc_ΔΔcq,
+)
+from .layout import add_labels, add_ΔΔcq_flags
+from .query import compile_query, QueryPredicate
+from .outliers import add_outlier_flags, flag_outliers
+from .efficiency import (
+        standard_curves, well_efficiencies, amplicon_efficiencies,
+        get_efficiency_mode, fill_defaults,
+)
+from .quant import absolute_quant, match_standard_curves
+from .anneal import anneal_optimum, fit_anneal_curves
+from .plate import (
+        cq_grid, cq_stack, median_polish, polish_plates, plate_effects,
+)
+from .streaming import CqStats, agg_cq_chunks
+from .traces import preprocess_traces, get_baseline_options
+from .sigmoid import fit_sigmoids, add_model_cq, get_cq_model
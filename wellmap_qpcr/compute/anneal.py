@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+def anneal_optimum(df, tolerance=0.5):
+    """
+    Find the best annealing temperature for each pair of template and primers.
+
+    The data frame must have *anneal_temp_C* and *cq* columns, and may have
+    *template*, *primers*, and *control* columns (see `qpcr-optimize-ta -h`).
+    It can include any number of gradient plates.  A quadratic model of Cq as a
+    function of annealing temperature is fit to each template/primer pair (all
+    at once, see `fit_anneal_curves()`), and the recommended annealing
+    temperature is the one that minimizes the model, within the range of
+    temperatures that were actually tested.  The usable window is the range
+    of tested temperatures where the model is within *tolerance* cycles of
+    that minimum.
+
+    The return value has one row per template/primers, with the number of
+    wells (*n*), the recommended temperature (*anneal_temp_C*), the modeled
+    Cq at that temperature (*cq_fit*), the bounds of the usable window
+    (*window_min_C*, *window_max_C*), and the coefficient of determination of
+    the model (*r2*).  Control wells are ignored, and pairs that didn't
+    amplify at 3 or more temperatures are omitted.
+    """
+    fits = fit_anneal_curves(df)
+    a, b, c = fits['a'], fits['b'], fits['c']
+    t_min, t_max = fits['ta_min'], fits['ta_max']
+
+    # The vertex of the parabola, if it opens upward; otherwise whichever end
+    # of the tested range has the lower Cq.
+    def model(t):
+        return a * t**2 + b * t + c
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vertex = -b / (2 * a)
+
+    ends = t_min.where(model(t_min) <= model(t_max), t_max)
+    best = vertex.where(a > 0, ends).clip(t_min, t_max)
+    cq_best = model(best)
+
+    # Solve a·(t - vertex)² + cq(vertex) = cq(best) + tolerance for t.  If
+    # the model doesn't curve upward, the whole tested range is usable.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        half_width = np.sqrt((cq_best + tolerance - model(vertex)) / a)
+
+    lo = (vertex - half_width).where(a > 0, t_min).clip(t_min, t_max)
+    hi = (vertex + half_width).where(a > 0, t_max).clip(t_min, t_max)
+
+    return pd.DataFrame({
+        'n': fits['n'],
+        'anneal_temp_C': best,
+        'cq_fit': cq_best,
+        'window_min_C': lo,
+        'window_max_C': hi,
+        'r2': fits['r2'],
+    }).reset_index()
+
+def fit_anneal_curves(df):
+    """
+    Fit a quadratic model of Cq as a function of annealing temperature to
+    each template/primer pair.
+
+    Every pair is fit at once, by solving the normal equations for all of them
+    as a single stack of 3×3 systems.  The return value is indexed by template
+    and primers, and has the coefficients of the model (*a*, *b*, *c*, such
+    that cq = a·Ta² + b·Ta + c), the number of wells (*n*), the range of
+    temperatures tested (*ta_min*, *ta_max*), and the coefficient of
+    determination (*r2*).
+
+    Control wells (i.e. wells with a *control* column, see
+    `qpcr-check-efficiency -h`) are left out, since their Cq values (if any)
+    don't depend on the primers binding the template.  Pairs with Cq values
+    at fewer than 3 distinct temperatures are also left out, because a
+    quadratic model can't be fit to them.
+    """
+    by = ['template', 'primers']
+    df = df.assign(
+            template=df['template'] if 'template' in df else np.nan,
+            primers=df['primers'] if 'primers' in df else np.nan,
+    )
+    df = df.dropna(subset=['cq', 'anneal_temp_C'])
+
+    if 'control' in df:
+        df = df[~df['control'].fillna(False).astype(bool)]
+
+    n_temps = df\
+            .groupby(by, dropna=False)['anneal_temp_C']\
+            .transform('nunique')
+    df = df[n_temps >= 3]
+
+    # Center the temperatures on each group's mean, to keep the normal
+    # equations well-conditioned.
+    groups = df.groupby(by, dropna=False)
+    t0 = groups['anneal_temp_C'].transform('mean')
+    t = df['anneal_temp_C'] - t0
+    y = df['cq']
+
+    moments = pd.DataFrame({
+        **{f't{k}': t**k for k in range(5)},
+        **{f't{k}y': t**k * y for k in range(3)},
+        'y2': y**2,
+        'center': t0,
+        'ta': df['anneal_temp_C'],
+    })
+    for col in by:
+        moments[col] = df[col]
+
+    g = moments.groupby(by, dropna=False)
+    sums = g.sum(numeric_only=True)
+    t0 = g['center'].first()
+
+    lhs = np.stack([
+        sums[[f't{i+j}' for j in range(3)]].to_numpy()
+        for i in range(3)
+    ], axis=1)
+    rhs = sums[['t0y', 't1y', 't2y']].to_numpy()[:, :, np.newaxis]
+    c_, b_, a_ = (np.linalg.pinv(lhs) @ rhs)[:, :, 0].T
+
+    # Residuals from the normal equations, i.e. without revisiting every well.
+    n = sums['t0']
+    ss_res = sums['y2'] - (c_ * sums['t0y'] + b_ * sums['t1y'] + a_ * sums['t2y'])
+    ss_tot = sums['y2'] - sums['t0y']**2 / n
+
+    # Undo the centering: a(t - t0)² + b(t - t0) + c.
+    return pd.DataFrame({
+        'a': a_,
+        'b': b_ - 2 * a_ * t0,
+        'c': a_ * t0**2 - b_ * t0 + c_,
+        'n': n.astype(int),
+        'ta_min': g['ta'].min(),
+        'ta_max': g['ta'].max(),
+        'r2': 1 - ss_res / ss_tot,
+    })
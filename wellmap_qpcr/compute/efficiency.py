@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+from .traces import trace_matrix, subtract_baseline, DEFAULT_BASELINE_CYCLES
+
+EXPT_COLS = ['template', 'primers', 'date']
+EFFICIENCY_MODES = ['ideal', 'per-well']
+
+def standard_curves(df):
+    """
+    Fit a standard curve to each experiment in the given data frame.
+
+    The data frame must have *template_conc* and *cq* columns, and may have
+    *control*, *template*, *primers*, and *date* columns (see
+    `qpcr-check-efficiency -h`).  Each combination of template, primers, and
+    date is fit separately.  Control wells, wells without a positive
+    concentration, and wells without a Cq value are excluded from the fits.
+
+    The return value has one row per experiment, with the number of wells
+    used in the fit (*n*), the *slope* and *intercept* of the line relating
+    Cq to log10(concentration), the coefficient of determination (*r2*), and
+    the amplification *efficiency* in percent.  It also has the statistics
+    needed to propagate the uncertainty in the fit to concentrations inferred
+    from it (see `absolute_quant()`): the mean of log10(concentration)
+    (*log_conc_mean*), the sum of squared deviations from that mean
+    (*log_conc_ss*), and the standard deviation of the residuals
+    (*residual_std*).
+    """
+    df = fill_defaults(df.copy())
+
+    i = ~df['is_control'] & (df['template_conc'] > 0) & df['cq'].notna()
+    fit = df.loc[i, EXPT_COLS].assign(
+            x=np.log10(df.loc[i, 'template_conc'].astype(float)),
+            y=df.loc[i, 'cq'].astype(float),
+    )
+
+    # Fit every experiment at once, using the closed-form least-squares
+    # solution, rather than calling a fitting function once per group.
+    groups = fit.groupby(EXPT_COLS, dropna=False)
+    fit['dx'] = fit['x'] - groups['x'].transform('mean')
+    fit['dy'] = fit['y'] - groups['y'].transform('mean')
+    fit['sxx'] = fit['dx'] * fit['dx']
+    fit['sxy'] = fit['dx'] * fit['dy']
+    fit['syy'] = fit['dy'] * fit['dy']
+
+    groups = fit.groupby(EXPT_COLS, dropna=False)
+    sums = groups[['sxx', 'sxy', 'syy']].sum()
+    means = groups[['x', 'y']].mean()
+
+    m = sums['sxy'] / sums['sxx']
+    b = means['y'] - m * means['x']
+
+    # The efficiency calculation will be a little different if the y values
+    # are dilutions instead of concentrations.  Consult the derivation in
+    # `docs/efficiency.lyx`.
+    eff = 100 * (10**(-1/m) - 1)
+
+    # Two degrees of freedom are used by the fit itself.
+    n = groups.size()
+    ss_res = (sums['syy'] - sums['sxy']**2 / sums['sxx']).clip(lower=0)
+    residual_std = np.sqrt(ss_res / (n - 2)).where(n > 2)
+
+    return pd.DataFrame({
+        'n': n,
+        'slope': m,
+        'intercept': b,
+        'r2': sums['sxy']**2 / (sums['sxx'] * sums['syy']),
+        'efficiency': eff,
+        'log_conc_mean': means['x'],
+        'log_conc_ss': sums['sxx'],
+        'residual_std': residual_std,
+    }).reset_index()
+
+def well_efficiencies(
+        df_trace, *,
+        baseline=DEFAULT_BASELINE_CYCLES,
+        noise_factor=5,
+        max_fraction=0.5,
+        min_cycles=4,
+):
+    """
+    Estimate the amplification efficiency of each well from the shape of its
+    amplification curve, in the style of LinRegPCR.
+
+    *df_trace* should be in the format returned by `load_trace()`.  After
+    subtracting the baseline (see `subtract_baseline()`, with drift removal),
+    a line is fit to log10(RFU / (plateau - RFU)) over the window of cycles
+    above *noise_factor* times the standard deviation of the baseline and
+    below *max_fraction* of the plateau.  Early in the reaction this is the
+    same as the usual fit to log10(RFU), but it also corrects for the
+    slowdown as the reaction approaches its plateau (exactly, for a logistic
+    curve), so the window can include many more cycles than the few where the
+    curve is purely exponential.  The window is chosen and fit for every well
+    at once, using masked sums rather than a loop over wells.
+
+    The return value is indexed by well (see `trace_matrix()`), and has the
+    *efficiency* in percent (100% meaning that the amount of product doubles
+    every cycle), the number of cycles in the window (*efficiency_n*), and the
+    coefficient of determination of the fit (*efficiency_r2*).  Wells with
+    fewer than *min_cycles* cycles in the window (e.g. wells that didn't
+    amplify) get NaN.
+
+    Estimates for individual wells are noisy, so they should be averaged over
+    wells with the same primers before being used (see
+    `amplicon_efficiencies()`).
+    """
+    rfu = subtract_baseline(trace_matrix(df_trace), baseline, drift=True)
+    x = rfu.columns.to_numpy(dtype=float)
+    y = rfu.to_numpy(dtype=float)
+
+    first, last = baseline
+    i = (x >= first) & (x <= last)
+    noise = np.nanstd(y[:, i], axis=1, ddof=1, keepdims=True)
+    plateau = np.nanmax(y, axis=1, keepdims=True)
+
+    w = (y >= noise_factor * noise) & (y <= max_fraction * plateau)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_y = np.log10(np.where(w, y / (plateau - y), 1))
+
+    n = w.sum(axis=1)
+    sx = (w * x).sum(axis=1)
+    sy = (w * log_y).sum(axis=1)
+    sxx = (w * x**2).sum(axis=1)
+    sxy = (w * x * log_y).sum(axis=1)
+    syy = (w * log_y**2).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = n * sxx - sx**2
+        var_y = n * syy - sy**2
+        cov_xy = n * sxy - sx * sy
+        m = np.where(n >= min_cycles, cov_xy / var_x, np.nan)
+        r2 = np.where(n >= min_cycles, cov_xy**2 / (var_x * var_y), np.nan)
+
+    return pd.DataFrame({
+        'efficiency': 100 * (10**m - 1),
+        'efficiency_n': n,
+        'efficiency_r2': r2,
+    }, index=rfu.index)
+
+def amplicon_efficiencies(df, by=None):
+    """
+    Average the per-well efficiencies over each group of wells that amplify
+    the same product, like LinRegPCR does.
+
+    The data frame must have an *efficiency* column (see
+    `well_efficiencies()`).  By default, wells are grouped by their *primers*
+    column or, if there isn't one, by their *label* and *housekeeping*
+    columns (i.e. the target and reference gene of each label are averaged
+    separately).  Wells without an efficiency are left out of the averages.
+
+    The return value is aligned with the given data frame, and gives the
+    average efficiency of each well's group.  It's NaN only for groups where
+    no well has an efficiency.
+    """
+    if by is None:
+        by = ['primers'] if 'primers' in df else ['label', 'housekeeping']
+
+    return df.groupby(by, dropna=False)['efficiency'].transform('mean')
+
+def get_efficiency_mode(extra):
+    """
+    Return the value of the `qpcr.efficiency` metadata, which determines
+    whether per-well efficiencies are used in the ΔΔCq calculation.
+    """
+    mode = extra.get('qpcr', {}).get('efficiency', 'ideal')
+    if mode not in EFFICIENCY_MODES:
+        raise ValueError(f"unknown efficiency mode: {mode!r}")
+    return mode
+
+def fill_defaults(df):
+    def fill_default(k, default=pd.NA):
+        df[k] = df[k].fillna(pd.NA) if k in df else default
+
+    fill_default('control')
+    fill_default('template')
+    fill_default('primers')
+    fill_default('date')
+
+    df['is_control'] = df['control'].fillna(False).astype(bool)
+
+    return df
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""
+Typical use::
+
+    import wellmap
+    from wellmap_qpcr import load_cq, agg_cq, calc_Δcq
+
+    df, extras = wellmap.load(
+            data_loader=load_cq,
+    )
+    df_cq = df.groupby(['gene', ...]).apply(agg_cq)
+    df_Δcq = calc_Δcq(
+            df_cq.loc['expt'],  # These location refer to the 'gene'
+            df_cq.loc['ref'],   # group, because it's first.
+    )
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+
+from .efficiency import amplicon_efficiencies
+from .layout import add_labels, add_ΔΔcq_flags
+from .outliers import add_outlier_flags
+
+def relative_expression(df, extra=None, *, steps=False, cache=None):
+    """
+    Calculate relative gene expression for the given experiment.
+
+    *df* should be the per-well Cq values merged with the layout, e.g. as 
+    returned by `wellmap.load(..., data_loader=load_cq, merge_cols=True)`, and 
+    *extra* should be the corresponding metadata.  The labels and the 
+    housekeeping/treatment flags are derived as described in 
+    `qpcr-relative-expression -h`, and outliers are excluded if requested by 
+    the `qpcr.outliers` metadata.  The return value is the ΔΔCq (or ΔCq) 
+    value of each label, or, if *steps* is true, the dictionary returned by 
+    `calc_expression_steps()`.
+    """
+    df = df.copy()
+    extra = extra or {}
+
+    add_labels(df, extra)
+    add_ΔΔcq_flags(df, extra)
+    add_outlier_flags(df, extra)
+
+    result = calc_expression_steps(df, cache)
+    return result if steps else list(result.values())[-1]
+
+def calc_expression_steps(df, cache=None):
+    """
+    Calculate relative gene expression from the given per-well Cq values.
+
+    The data frame must have *label*, *housekeeping*, and *cq* columns, and 
+    may have a *treatment* column.  If it doesn't, the calculation stops at 
+    ΔCq.  If it has an *outlier* column (see `add_outlier_flags()`), the 
+    flagged wells are excluded from the calculation.
+
+    If it has an *efficiency* column (see `well_efficiencies()`), the 
+    efficiencies are averaged over the wells with the same primers (see 
+    `amplicon_efficiencies()`), and each Cq value is weighted by log2 of the 
+    corresponding amplification factor, so that the fold changes account for 
+    imperfect amplification.  Wells with a Cq value but no such average are 
+    excluded from the calculation, with a warning.
+
+    The return value is a dictionary with the result of each step of the 
+    calculation, in order: 'wells', 'cq', 'delta_cq', and (if applicable) 
+    'delta_delta_cq'.
+
+    If given, *cache* should be a callable that takes the name of a step and a 
+    zero-argument function computing that step, e.g. a `StageCache`.
+    """
+    if cache is None:
+        cache = lambda step, compute: compute()
+
+    cols = ['housekeeping', 'treatment', 'label']
+    if 'treatment' not in df:
+        cols.remove('treatment')
+
+    steps = {'wells': df}
+    wells = df[~df['outlier']] if 'outlier' in df else df
+
+    # Express each Cq value as the equivalent number of perfect doublings, 
+    # i.e. E^Cq = 2^(Cq·log2(E)).  This is the Pfaffl method, with the 
+    # efficiency of each primer pair estimated from the amplification curves.
+    if 'efficiency' in wells:
+        efficiency = amplicon_efficiencies(wells)
+        unknown = wells['cq'].notna() & efficiency.isna()
+
+        if unknown.any():
+            names = ''
+            if 'well' in wells:
+                names = ': ' + ', '.join(wells.loc[unknown, 'well'])
+
+            warnings.warn(
+                    f"excluding {unknown.sum()} well(s) with no efficiency "
+                    f"estimate for their primers{names}"
+            )
+
+        log2_e = np.log2(1 + efficiency[~unknown] / 100)
+        wells = wells[~unknown]
+        wells = wells.assign(cq=wells['cq'] * log2_e)
+
+    steps['cq'] = cache('cq', lambda: wells\
+            .groupby(cols)\
+            .apply(agg_cq)
+    )
+
+    # Select using `xs()` rather than `loc[0]`/`loc[1]`, because the latter 
+    # doesn't work if the index levels end up with a boolean dtype (which 
+    # happens when every well has a housekeeping/treatment flag).
+    steps['delta_cq'] = cache('delta_cq', lambda: calc_Δcq(
+            df_expt=steps['cq'].xs(False, level='housekeeping'),
+            df_ref=steps['cq'].xs(True, level='housekeeping'),
+    ))
+
+    # If the user didn't specify experimental/control treatment conditions, 
+    # stop here and just report ΔCq instead of ΔΔCq.
+
+    if 'treatment' in steps['delta_cq'].index.names:
+        steps['delta_delta_cq'] = cache('delta_delta_cq', lambda: calc_ΔΔcq(
+                df_expt=steps['delta_cq'].xs(True, level='treatment'),
+                df_ref=steps['delta_cq'].xs(False, level='treatment'),
+        ))
+
+    return steps
+
+def agg_cq(df):
+    row = pd.Series(dtype=float)
+    row['n'] = len(df['cq'])
+    row['n_nan'] = df['cq'].isnull().sum()
+    row['cq_mean'] = df['cq'].mean()
+    row['cq_median'] = df['cq'].median()
+    row['cq_min'] = df['cq'].min()
+    row['cq_max'] = df['cq'].max()
+    row['cq_std'] = df['cq'].std()
+    return row
+
+
+def calc_Δcq(df_expt, df_ref, center='mean'):
+    """
+    The two data frames need to have the same index, so that they can be 
+    subtracted from one another.  There are a few ways to do this:
+
+    If you previously used `groupby()`, then the data frame will have a 
+    hierarchical index and you can use `loc` to select the relevant 
+    experimental/reference values::
+
+        df_cq = df.groupby(['gene', ...]).apply(agg_cq)
+        df_Δcq = calc_Δcq(
+                df_cq.loc['expt'],
+                df_cq.loc['ref'],
+        )
+
+    If the above doesn't apply, you can use `query()`::
+
+        df_Δcq = calc_Δcq(
+                df_cq.query('gene == "expt"'),
+                df_cq.query('gene == "ref"'),
+        )
+
+    If the column you're querying is an index, you need to take some extra 
+    steps.  I think there are two ways to do it::
+
+        df_Δcq = calc_Δcq(
+                df_cq.query('gene == "expt"').droplevel('gene'),
+                df_cq.query('gene == "ref"').droplevel('gene'),
+        )
+    
+    ::
+
+        df_Δcq = calc_Δcq(
+                df_cq.reset_index().query('gene == "expt"'),
+                df_cq.reset_index().query('gene == "ref"'),
+        )
+    """
+    return _calc_delta(
+            df_expt, df_ref,
+            center=center, 
+            prefixes=('cq', 'Δcq'),
+    )
+
+def calc_ΔΔcq(df_expt, df_ref, center='mean'):
+    return _calc_delta(
+            df_expt, df_ref,
+            center=center, 
+            prefixes=('Δcq', 'ΔΔcq'),
+    )
+
+def _calc_delta(df_expt, df_ref, center='mean', *, prefixes):
+    x, x0 = df_expt, df_ref
+    cq, Δcq = prefixes
+
+    df = pd.DataFrame(index=x.index)
+    df[f'{Δcq}_mean'] = x[f'{cq}_mean'] - x0[f'{cq}_mean']
+    df[f'{Δcq}_median'] = x[f'{cq}_median'] - x0[f'{cq}_median']
+    # https://stats.stackexchange.com/questions/112351/standard-deviation-after-subtracting-one-mean-from-another
+    # https://stats.stackexchange.com/questions/25848/how-to-sum-a-standard-deviation
+    df[f'{Δcq}_std'] = np.sqrt(x[f'{cq}_std']**2 + x0[f'{cq}_std']**2)
+
+    # The Cq values are in units of perfect doublings (i.e. an amplification 
+    # factor of 2), either because perfect efficiency is assumed or because 
+    # they were weighted by the measured efficiencies in 
+    # `calc_expression_steps()`.
+    df['fold_change'] = 2**(-df[f'{Δcq}_{center}'])
+    df['fold_change_bound'] = 2**(-df[f'{Δcq}_{center}'] + df[f'{Δcq}_std'])
+    df['fold_change_err'] = df['fold_change_bound'] - df['fold_change']
+
+    return df
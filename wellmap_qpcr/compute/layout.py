@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from .query import compile_query
+
+def add_labels(df, extra):
+    # - "label" is used to identify a group of wells that can be collectively 
+    #   used to calculate a ΔΔCq value, i.e. relative gene expression.  Each 
+    #   group of wells with the same label must have at least 4 conditions: 
+    #   experimental/ref gene/treatment.
+    # - "sublabel" is used to identify the wells within a "label" group, for 
+    #   cases where the "label" group is clear from context (e.g. each group is 
+    #   split into its own plot).
+
+    format_cols = ['label', 'sublabel']
+
+    def format_cell(row, col):
+        return row[col].format_map(row)
+    
+    for col in format_cols:
+        if col not in df:
+            continue
+        df[col] = df.apply(format_cell, args=(col,), axis=1)
+
+def add_ΔΔcq_flags(df, extra):
+    # Parse every query before evaluating any of them, so that mistakes are
+    # reported right away.  Parsed queries are cached (see `compile_query()`),
+    # so layouts that share the same queries don't parse them again.
+    queries = get_ΔΔcq_queries(extra)
+
+    for col, (is_true, is_false) in queries.items():
+        if col in df.columns:
+            continue
+
+        i = is_true(df)
+        j = is_false(df)
+
+        df[col] = np.nan
+        df.loc[i,col] = True
+        df.loc[j,col] = False
+
+def get_ΔΔcq_queries(extra):
+    """
+    Return the parsed `qpcr.housekeeping` and `qpcr.treatment` queries, as
+    (true, false) pairs of `QueryPredicate` objects.
+    """
+    queries = {}
+
+    for col in ['housekeeping', 'treatment']:
+        options = extra.get('qpcr', {}).get(col)
+        if options is None:
+            continue
+
+        try:
+            queries[col] = compile_query(options['true']), \
+                           compile_query(options['false'])
+        except KeyError as err:
+            raise ValueError(f"qpcr.{col} must specify {err}") from None
+        except ValueError as err:
+            raise ValueError(f"qpcr.{col}: {err}") from None
+
+    return queries
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+# The columns that identify a group of replicates, i.e. the wells that are
+# aggregated together by `calc_expression_steps()`.
+REPLICATE_COLS = ['housekeeping', 'treatment', 'label']
+
+def add_outlier_flags(df, extra):
+    """
+    Add an *outlier* column to the given per-well Cq values, if outlier
+    detection is enabled by the `qpcr.outliers` metadata.
+
+    The metadata should be a table with the following (optional) keys:
+
+        method: 'mad'
+            How to detect outliers.  Currently the only option is 'mad', the
+            modified z-score based on the median absolute deviation.
+
+        threshold: 3.5
+            How far from the other replicates a well must be to be rejected.
+
+        min_mad: 0.05
+            The smallest median absolute deviation (in cycles) to use when
+            scoring a group of replicates.  Without a lower limit, replicates
+            that agree very closely would have wells rejected over tiny
+            differences.
+    """
+    options = extra.get('qpcr', {}).get('outliers')
+    if options is None:
+        return
+
+    by = [x for x in REPLICATE_COLS if x in df]
+    df['outlier'] = flag_outliers(df, by, **options)
+
+def flag_outliers(df, by, *, method='mad', threshold=3.5, min_mad=0.05):
+    """
+    Return a boolean series indicating which wells have Cq values that are
+    outliers relative to the other wells in the same group.
+
+    Every group is handled at once, without iterating over the groups.  The
+    median absolute deviation of each group is raised to at least *min_mad*
+    cycles before scoring.  Wells without a Cq value, and wells in groups
+    where the deviation is still 0 (e.g. if *min_mad* is 0), are never
+    outliers.
+    """
+    if method != 'mad':
+        raise ValueError(f"unknown outlier detection method: {method!r}")
+
+    # The modified z-score: Iglewicz and Hoaglin (1993).  The constant scales
+    # the MAD to be comparable to the standard deviation of a normal
+    # distribution.
+    cq = df['cq'].astype(float)
+    keys = [df[k] for k in by]
+
+    median = cq.groupby(keys, dropna=False).transform('median')
+    deviation = (cq - median).abs()
+    mad = deviation\
+            .groupby(keys, dropna=False)\
+            .transform('median')\
+            .clip(lower=min_mad)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = 0.6745 * deviation / mad
+
+    return (z > threshold) & (mad > 0)
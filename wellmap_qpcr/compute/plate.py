@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import warnings
+import numpy as np
+import pandas as pd
+
+def cq_grid(df, value='cq'):
+    """
+    Arrange the Cq value of each well into the shape of the plate.
+
+    The data frame must have *row_i* and *col_j* columns, e.g. as returned by
+    `wellmap.load()`.  The return value is indexed by row index and has a
+    column for each column index.  Every row and column between the first and
+    last ones in the layout is included, and any well without a value is NaN.
+    If the data frame has a *plate* column, the plates are stacked on top of
+    each other and the index also includes the name of each plate.
+    """
+    plates = ['plate'] if 'plate' in df else []
+
+    rows = pd.RangeIndex(df['row_i'].min(), df['row_i'].max() + 1)
+    cols = pd.RangeIndex(df['col_j'].min(), df['col_j'].max() + 1)
+
+    grid = df\
+            .set_index([*plates, 'row_i', 'col_j'])[value]\
+            .unstack('col_j')\
+            .reindex(columns=cols)
+
+    if plates:
+        index = pd.MultiIndex.from_product(
+                [grid.index.unique('plate'), rows],
+                names=['plate', 'row_i'],
+        )
+    else:
+        index = rows.rename('row_i')
+
+    grid = grid.reindex(index)
+    grid.columns.name = 'col_j'
+    return grid
+
+def cq_stack(df, value='cq', shape=None):
+    """
+    Arrange the Cq value of each well into a plates × rows × columns array.
+
+    Unlike `cq_grid()`, the array always starts at the first row and column
+    of the plate, so the same index refers to the same physical well on every
+    plate.  The array extends to the last row and column in the layout, or
+    can be given a *shape* (e.g. the dimensions of the plate format).  The
+    plates are identified by the *plate* column, or by the *path* column if
+    there isn't one.  Return the names of the plates and the array.
+    """
+    key = 'plate' if 'plate' in df else 'path' if 'path' in df else None
+    codes, plates = pd.factorize(df[key]) if key else \
+            (np.zeros(len(df), dtype=int), pd.Index([None]))
+
+    i = df['row_i'].to_numpy()
+    j = df['col_j'].to_numpy()
+    n_rows, n_cols = shape or (i.max() + 1, j.max() + 1)
+
+    stack = np.full((len(plates), n_rows, n_cols), np.nan)
+    stack[codes, i, j] = df[value].to_numpy(dtype=float)
+
+    return pd.Index(plates, name=key), stack
+
+def median_polish(stack, max_iter=10, tol=0.01):
+    """
+    Decompose each plate in the given plates × rows × columns array into an
+    overall value, row effects, column effects, and residuals, using Tukey's
+    median polish.
+
+    Every plate is polished at once: each sweep takes the median across the
+    rows or columns of every plate in a single vectorized operation.  Missing
+    values are ignored.  Sweeping stops after *max_iter* iterations, or once
+    no effect changes by more than *tol*.
+
+    Return the overall values (plates), the row effects (plates × rows), the
+    column effects (plates × columns), and the residuals (same shape as the
+    input), such that each value is the sum of the corresponding overall
+    value, row effect, column effect, and residual.
+    """
+    n_plates, n_rows, n_cols = stack.shape
+    resid = np.array(stack, dtype=float)
+    overall = np.zeros(n_plates)
+    rows = np.zeros((n_plates, n_rows))
+    cols = np.zeros((n_plates, n_cols))
+
+    # Rows and columns without any wells always have an effect of 0, and
+    # aren't included when centering the effects.
+    has_row = np.isfinite(resid).any(axis=2)
+    has_col = np.isfinite(resid).any(axis=1)
+
+    for _ in range(max_iter):
+        row_delta = _nanmedian(resid, axis=2)
+        resid -= row_delta[:, :, np.newaxis]
+        rows += row_delta
+
+        delta = _nanmedian(np.where(has_col, cols, np.nan), axis=1)
+        cols -= delta[:, np.newaxis] * has_col
+        overall += delta
+
+        col_delta = _nanmedian(resid, axis=1)
+        resid -= col_delta[:, np.newaxis, :]
+        cols += col_delta
+
+        delta = _nanmedian(np.where(has_row, rows, np.nan), axis=1)
+        rows -= delta[:, np.newaxis] * has_row
+        overall += delta
+
+        if max(np.abs(row_delta).max(initial=0),
+               np.abs(col_delta).max(initial=0)) < tol:
+            break
+
+    return overall, rows, cols, resid
+
+def polish_plates(df, by=None, *, shape=None):
+    """
+    Decompose the Cq values on each plate in the given data frame into
+    overall, row, and column effects, using `median_polish()`.
+
+    The data frame must have *cq*, *row_i*, and *col_j* columns, and can have
+    any number of plates (see `cq_stack()`).  Differences between wells that
+    are due to the experimental design (e.g. dilution series) would look like
+    spatial effects, so if *by* is given, the Cq value expected for each well
+    is subtracted first: the median of every well (on any plate) with the
+    same values in those columns.  For example, `by=['well']` compares each
+    plate to the consensus of every plate with the same layout, and
+    `by=['primers', 'template_conc']` compares replicates to each other.
+
+    Return the names of the plates, the plates × rows × columns array that
+    was decomposed, and the results of `median_polish()`.
+    """
+    cq = df['cq'].astype(float)
+    if by:
+        keys = [df[k] for k in by]
+        cq = cq - cq.groupby(keys, dropna=False).transform('median')
+
+    plates, stack = cq_stack(df.assign(cq=cq), shape=shape)
+    return plates, stack, median_polish(stack)
+
+def plate_effects(df, by=None, *, shape=None, threshold=0.5):
+    """
+    Estimate the spatial effects (e.g. from an uneven block heater) on each
+    plate in the given data frame, and flag the plates where they're large.
+
+    The plates are decomposed by `polish_plates()`; see that function for a
+    description of the arguments.  The return value has one row per plate,
+    with the number of wells with Cq values (*n*), the overall Cq offset of
+    the plate (*overall*), the change in Cq from the first row to the last
+    (*row_gradient*) and from the first column to the last (*col_gradient*)
+    according to a line fit to the row and column effects, the median
+    difference in Cq between wells on the edge of the plate and those in the
+    interior (*edge*), the robust standard deviation of the residuals
+    (*noise*), and whether any of the gradients or the edge effect exceed
+    *threshold* cycles (*flagged*).
+    """
+    plates, stack, (overall, rows, cols, resid) = \
+            polish_plates(df, by, shape=shape)
+    n_plates, n_rows, n_cols = stack.shape
+
+    edge = np.zeros((n_rows, n_cols), dtype=bool)
+    edge[[0, -1], :] = True
+    edge[:, [0, -1]] = True
+
+    centered = stack - overall[:, np.newaxis, np.newaxis]
+    edge_effect = \
+            _nanmedian(np.where(edge, centered, np.nan), axis=(1, 2)) - \
+            _nanmedian(np.where(~edge, centered, np.nan), axis=(1, 2))
+
+    # The robust standard deviation: the MAD, scaled to be comparable to the
+    # standard deviation of a normal distribution.
+    noise = 1.4826 * _nanmedian(np.abs(resid), axis=(1, 2))
+
+    row_gradient = _fit_gradient(rows, np.isfinite(stack).sum(axis=2))
+    col_gradient = _fit_gradient(cols, np.isfinite(stack).sum(axis=1))
+
+    effects = pd.DataFrame({
+        'n': np.isfinite(stack).sum(axis=(1, 2)),
+        'overall': overall,
+        'row_gradient': row_gradient,
+        'col_gradient': col_gradient,
+        'edge': edge_effect,
+        'noise': noise,
+    }, index=plates)
+
+    effects['flagged'] = effects[['row_gradient', 'col_gradient', 'edge']]\
+            .abs()\
+            .gt(threshold)\
+            .any(axis=1)
+
+    return effects.reset_index()
+
+def _nanmedian(x, axis):
+    # Slices without any values (e.g. empty rows) have no effect, rather than
+    # a NaN effect that would spread to every other well.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        median = np.nanmedian(x, axis=axis)
+
+    return np.nan_to_num(median, nan=0.0)
+
+def _fit_gradient(effects, counts):
+    # Fit a line to the row/column effects of every plate at once, weighted by
+    # the number of wells in each row/column (so that e.g. a column with just
+    # a few controls doesn't count as much as a full one), and return the
+    # change from the first row/column to the last.
+    w = counts.astype(float)
+    x = np.arange(effects.shape[1], dtype=float)
+
+    n = w.sum(axis=1)
+    sx = (w * x).sum(axis=1)
+    sy = (w * effects).sum(axis=1)
+    sxx = (w * x**2).sum(axis=1)
+    sxy = (w * x * effects).sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx**2)
+
+    n_lines = (counts > 0).sum(axis=1)
+    return np.where(n_lines >= 2, slope * (len(x) - 1), np.nan)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+def absolute_quant(df, curves, by=None):
+    """
+    Infer the concentration of template in each well from its Cq value, using
+    previously fit standard curves.
+
+    The data frame must have *cq* and *primers* columns, and may have *date*
+    and *standard* columns (see `qpcr-absolute-quant -h`).  *curves* should be
+    in the format returned by `standard_curves()` or
+    `ResultsDb.query_efficiency()`, and can come from any number of other
+    experiments.  Each well is quantified using the curve chosen by
+    `match_standard_curves()`.  Every well is quantified at once, so there's
+    no per-plate or per-curve overhead.
+
+    If *by* is given, the Cq values of each group of wells with the same
+    values in those columns (e.g. technical replicates) are averaged, and
+    each group is quantified instead of each well.
+
+    The return value has one row per well (or group), with the template of
+    the standard curve that was used (*standard*), the date of that curve
+    (*curve_date*), log10 of the concentration (*log_conc*) and its standard
+    error (*log_conc_err*), the concentration itself (*conc*), and the range
+    of concentrations within one standard error (*conc_lo*, *conc_hi*).  The
+    standard error accounts for the scatter of the standard curve, the
+    uncertainty in the fit, and the number of wells averaged.  Wells without
+    a Cq value or a matching standard curve get NaN.
+    """
+    curves = curves.reset_index(drop=True)
+    curve_i = match_standard_curves(df, curves)
+
+    if by is None:
+        out = df.copy()
+        y = df['cq'].to_numpy(dtype=float)
+        k = np.ones(len(df))
+    else:
+        out = df\
+                .assign(curve_i=curve_i)\
+                .groupby([*by, 'curve_i'], dropna=False)['cq']\
+                .agg(cq='mean', n_wells='count')\
+                .reset_index()
+        curve_i = out.pop('curve_i').to_numpy()
+        y = out['cq'].to_numpy(dtype=float)
+        k = out['n_wells'].to_numpy(dtype=float)
+
+    def get_curve_col(col):
+        # Unmatched wells have index -1, which `reindex()` fills with NaN.
+        return curves[col].reindex(curve_i).to_numpy()
+
+    m = get_curve_col('slope').astype(float)
+    b = get_curve_col('intercept').astype(float)
+    n = get_curve_col('n').astype(float)
+    x_mean = get_curve_col('log_conc_mean').astype(float)
+    x_ss = get_curve_col('log_conc_ss').astype(float)
+    s = get_curve_col('residual_std').astype(float)
+
+    # The usual standard error for a value read back from a calibration line,
+    # given the mean of k measurements.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_conc = (y - b) / m
+        y_mean = b + m * x_mean
+        log_conc_err = s / np.abs(m) * np.sqrt(
+                1 / k + 1 / n + (y - y_mean)**2 / (m**2 * x_ss)
+        )
+
+    out['standard'] = get_curve_col('template')
+    out['curve_date'] = get_curve_col('date')
+    out['log_conc'] = log_conc
+    out['log_conc_err'] = log_conc_err
+    out['conc'] = 10**log_conc
+    out['conc_lo'] = 10**(log_conc - log_conc_err)
+    out['conc_hi'] = 10**(log_conc + log_conc_err)
+
+    return out
+
+def match_standard_curves(df, curves):
+    """
+    Choose a standard curve for each well.
+
+    Each well is matched to the curves for the same primers and, if the well
+    has a *standard* column, the same template.  Of those, the most recent
+    curve from on or before the date of the well is used, or the earliest
+    curve from after it if there aren't any.  Wells without a date are
+    matched to the most recent curve, and curves without a date are treated
+    as older than every well.
+
+    Return an array with the position of the chosen curve in *curves* for
+    each well, or -1 for wells without a matching curve.
+    """
+    keys = {'primers': 'primers'}
+    if 'standard' in df:
+        keys['template'] = 'standard'
+
+    wells = pd.DataFrame({
+        'date': _get_dates(df, pd.Timestamp.max),
+        **{k: _get_key(df, col) for k, col in keys.items()},
+        'row': np.arange(len(df)),
+    })
+    candidates = pd.DataFrame({
+        'date': _get_dates(curves, pd.Timestamp.min),
+        **{k: _get_key(curves, k) for k in keys},
+        'curve_i': np.arange(len(curves)),
+    })
+
+    wells = wells.sort_values('date', kind='stable')
+    candidates = candidates.sort_values('date', kind='stable')
+    by = list(keys)
+
+    before = pd.merge_asof(
+            wells, candidates, on='date', by=by, direction='backward')
+    after = pd.merge_asof(
+            wells, candidates, on='date', by=by, direction='forward')
+
+    curve_i = np.full(len(df), -1)
+    curve_i[before['row']] = before['curve_i']\
+            .fillna(after['curve_i'])\
+            .fillna(-1)\
+            .astype(int)
+
+    return curve_i
+
+def _get_dates(df, default):
+    # `merge_asof()` doesn't allow missing dates, so replace them with
+    # whichever extreme gives the behavior described above.
+    if 'date' not in df:
+        return np.full(len(df), default, dtype='datetime64[ns]')
+
+    dates = pd.to_datetime(pd.Series(df['date'].to_numpy()))
+    return dates.fillna(default).to_numpy(dtype='datetime64[ns]')
+
+def _get_key(df, col):
+    # Missing values would never match, so treat them as a value of their
+    # own, like `groupby(..., dropna=False)` does.
+    if col not in df:
+        return np.full(len(df), '')
+
+    x = pd.Series(df[col].to_numpy(dtype=object))
+    return x.where(x.notna(), '').astype(str).to_numpy()
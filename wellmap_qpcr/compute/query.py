@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import ast, io, operator, tokenize
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+
+def compile_query(expr):
+    """
+    Parse the given query expression into a `QueryPredicate`.
+
+    The same expression is only ever parsed once, so applying the same layout
+    template to any number of plates doesn't repeat any work.
+    """
+    return _compile_query(str(expr))
+
+class QueryPredicate:
+    """
+    A boolean expression (e.g. `gene == "gapdh"`) to evaluate against the
+    columns of a data frame.
+
+    The expressions that layouts typically use are parsed once, when the
+    predicate is created, and evaluated directly with numpy: column names,
+    literals (including lists, for `in` and `not in`), comparisons,
+    arithmetic, and the `and`, `or`, and `not` operators (or their `&`, `|`,
+    and `~` equivalents).  Any other expression (e.g. one with backtick-quoted
+    column names, or `.str` methods) is passed to `DataFrame.eval()` each
+    time the predicate is called, so every query that pandas understands can
+    still be used.  The same goes for queries on columns with pandas
+    extension dtypes (e.g. 'string'), since numpy can't compare their
+    missing values.
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.columns = set()
+
+        try:
+            tree = ast.parse(_replace_booleans(expr), mode='eval')
+            self._eval = self._compile(tree.body)
+        except (SyntaxError, tokenize.TokenError, _UnsupportedSyntax):
+            self.columns = None
+            self._eval = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.expr!r})'
+
+    def __call__(self, df):
+        """
+        Return a boolean array with one element for each row in the given
+        data frame.
+        """
+        if self._eval is None or not self._has_numpy_columns(df):
+            result = self._eval_pandas(df)
+        else:
+            result = self._eval_numpy(df)
+
+        result = np.broadcast_to(result, len(df))
+        if result.dtype != bool:
+            raise ValueError(
+                    f"query doesn't evaluate to true/false: {self.expr!r}")
+
+        return result
+
+    def _has_numpy_columns(self, df):
+        # Extension arrays (e.g. the 'string' and 'Int64' dtypes) represent
+        # missing values with `pd.NA`, which numpy can't compare.  Leave those
+        # columns to pandas, which knows how to handle them.
+        return all(
+                isinstance(df[k].dtype, np.dtype)
+                for k in self.columns
+                if k in df
+        )
+
+    def _eval_numpy(self, df):
+        missing = self.columns - set(df.columns)
+        if missing:
+            raise ValueError(
+                    f"unknown column(s) in query {self.expr!r}: "
+                    f"{', '.join(sorted(missing))}\n"
+                    f"available columns: {', '.join(map(str, df.columns))}"
+            )
+
+        return self._eval({k: df[k].to_numpy() for k in self.columns})
+
+    def _eval_pandas(self, df):
+        try:
+            result = df.eval(self.expr)
+        except Exception as err:
+            raise ValueError(f"can't evaluate query {self.expr!r}: {err}") \
+                    from err
+
+        # Comparisons between extension arrays give nullable booleans.  Treat
+        # missing values as false, like `DataFrame.query()` does.
+        if isinstance(getattr(result, 'dtype', None), pd.BooleanDtype):
+            result = result.fillna(False).astype(bool)
+
+        return np.asarray(result)
+
+    def _compile(self, node):
+        # Return a function that evaluates the node given a dictionary of
+        # columns.
+
+        if isinstance(node, ast.Name):
+            self.columns.add(node.id)
+            return lambda cols: cols[node.id]
+
+        if isinstance(node, ast.Constant):
+            value = node.value
+            return lambda cols: value
+
+        if isinstance(node, (ast.List, ast.Tuple)):
+            values = [self._compile_literal(x) for x in node.elts]
+            return lambda cols: values
+
+        if isinstance(node, ast.BoolOp):
+            op = _BOOL_OPS[type(node.op)]
+            return self._compile_chain(op, node.values)
+
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+            op = _UNARY_OPS[type(node.op)]
+            f = self._compile(node.operand)
+            return lambda cols: op(f(cols))
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+            op = _BIN_OPS[type(node.op)]
+            return self._compile_chain(op, [node.left, node.right])
+
+        if isinstance(node, ast.Compare) and \
+                all(type(op) in _COMPARE_OPS for op in node.ops):
+
+            # Chained comparisons (e.g. `1 < x < 2`) are the conjunction of
+            # each individual comparison.
+            operands = [node.left, *node.comparators]
+            pairs = zip(operands, node.ops, operands[1:])
+            fs = [
+                    _bind_binary(
+                        _COMPARE_OPS[type(op)],
+                        self._compile(left),
+                        self._compile(right),
+                    )
+                    for left, op, right in pairs
+            ]
+            return lambda cols: _all(f(cols) for f in fs)
+
+        raise _UnsupportedSyntax
+
+    def _compile_chain(self, op, nodes):
+        fs = [self._compile(x) for x in nodes]
+
+        def f(cols):
+            result = fs[0](cols)
+            for f_i in fs[1:]:
+                result = op(result, f_i(cols))
+            return result
+
+        return f
+
+    def _compile_literal(self, node):
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            raise _UnsupportedSyntax from None
+
+class _UnsupportedSyntax(Exception):
+    pass
+
+@lru_cache(maxsize=None)
+def _compile_query(expr):
+    return QueryPredicate(expr)
+
+def _replace_booleans(expr):
+    # Like `pandas.eval()`, give `&` and `|` the same precedence as `and` and
+    # `or`, so that e.g. `a == 1 & b == 2` means what it looks like.
+    tokens = tokenize.generate_tokens(io.StringIO(expr.strip()).readline)
+    return tokenize.untokenize(
+            (tokenize.NAME, _BOOLEAN_TOKENS[tok.string])
+            if tok.type == tokenize.OP and tok.string in _BOOLEAN_TOKENS
+            else (tok.type, tok.string)
+            for tok in tokens
+    )
+
+def _bind_binary(op, f_left, f_right):
+    return lambda cols: op(f_left(cols), f_right(cols))
+
+def _all(results):
+    out = True
+    for result in results:
+        out = np.logical_and(out, result)
+    return out
+
+def _isin(left, right):
+    return np.isin(left, right)
+
+def _notin(left, right):
+    return ~np.isin(left, right)
+
+_BOOLEAN_TOKENS = {'&': 'and', '|': 'or'}
+_BOOL_OPS = {
+        ast.And: np.logical_and,
+        ast.Or: np.logical_or,
+}
+_UNARY_OPS = {
+        ast.Not: np.logical_not,
+        ast.Invert: operator.invert,
+        ast.USub: operator.neg,
+        ast.UAdd: operator.pos,
+}
+_BIN_OPS = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+}
+_COMPARE_OPS = {
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+        ast.In: _isin,
+        ast.NotIn: _notin,
+}
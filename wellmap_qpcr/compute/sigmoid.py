@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+from .traces import trace_matrix, DEFAULT_BASELINE_CYCLES
+from concurrent.futures import ProcessPoolExecutor
+
+# The parameters of the 5-parameter logistic model:
+#
+#     rfu(c) = y0 + fmax / (1 + exp(-(c - c0) / b))^g
+#
+# The 4-parameter model is the same, with g fixed at 1.
+PARAMS = ['y0', 'fmax', 'c0', 'b', 'g']
+MODELS = {'l4': 4, 'l5': 5}
+CQ_MODELS = ['instrument', *MODELS]
+
+def fit_sigmoids(
+        df_trace, model='l4', *,
+        workers=None,
+        chunk_size=96,
+        min_snr=10,
+):
+    """
+    Fit a logistic model to the amplification curve of every well.
+
+    *df_trace* should be in the format returned by `load_trace()`, and *model*
+    can be either 'l4' or 'l5' (see `PARAMS`).  The initial guesses for every
+    well are derived at once from the wells × cycles matrix, and the wells are
+    then fit in chunks of *chunk_size* across a pool of *workers* processes
+    (all available CPUs by default; 1 to fit in this process).  Wells whose
+    curves don't rise at least *min_snr* times the noise in the baseline are
+    assumed not to have amplified, and aren't fit.
+
+    The return value is indexed by well (see `trace_matrix()`), and has the
+    model-based Cq value (*cq*, the cycle where the second derivative of the
+    model is greatest), the fluorescence at the *plateau*, the maximum *slope*
+    of the curve (in RFU/cycle), and the fitted parameters.
+    """
+    if model not in MODELS:
+        raise ValueError(f"unknown sigmoid model: {model!r}")
+
+    rfu = trace_matrix(df_trace)
+    x = rfu.columns.to_numpy(dtype=float)
+    y = rfu.to_numpy(dtype=float)
+
+    p0, amplified = guess_params(x, y, min_snr)
+    p0 = p0[:, :MODELS[model]]
+
+    i = np.flatnonzero(amplified)
+    n_chunks = max(1, -(-len(i) // chunk_size))
+    chunks = [j for j in np.array_split(i, n_chunks) if len(j)]
+    args = [(model, x, y[j], p0[j]) for j in chunks]
+
+    if workers == 1 or len(chunks) <= 1:
+        results = [_fit_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_fit_chunk, *zip(*args)))
+
+    cols = ['cq', 'slope', *PARAMS]
+    fits = np.full((len(y), len(cols)), np.nan)
+    for j, fit in zip(chunks, results):
+        fits[j] = fit
+
+    df = pd.DataFrame(fits, columns=cols, index=rfu.index)
+    df.insert(1, 'plateau', df['y0'] + df['fmax'])
+    return df
+
+def add_model_cq(df_cq, fits):
+    """
+    Replace the Cq values reported by the instrument with those from the given
+    model fits (see `fit_sigmoids()`).
+
+    The original values are kept in the *cq_instrument* column, and the
+    plateau and slope of each fit are added as well.
+    """
+    keys = fits.index.names
+    return df_cq\
+            .rename(columns={'cq': 'cq_instrument'})\
+            .join(fits[['cq', 'plateau', 'slope']], on=keys)
+
+def get_cq_model(extra):
+    """
+    Return the value of the `qpcr.cq_model` metadata, which determines where
+    the Cq value of each well comes from.
+    """
+    model = extra.get('qpcr', {}).get('cq_model', 'instrument')
+    if model not in CQ_MODELS:
+        raise ValueError(f"unknown Cq model: {model!r}")
+    return model
+
+def guess_params(x, y, min_snr=10):
+    """
+    Guess the parameters of the logistic model for each row of the given
+    wells × cycles matrix, without fitting.
+
+    Return the guesses and a boolean array indicating which wells appear to
+    have amplified at all.
+    """
+    first, last = DEFAULT_BASELINE_CYCLES
+    i = (x >= first) & (x <= last)
+
+    y0 = np.nanmean(y[:, i], axis=1)
+    noise = np.nanstd(y[:, i], axis=1, ddof=1)
+    fmax = np.nanmax(y, axis=1) - y0
+
+    # For the logistic function, the curve reaches 25%, 50%, and 75% of its
+    # height at c0 - b·ln(3), c0, and c0 + b·ln(3), respectively.
+    def first_crossing(fraction):
+        above = y >= (y0 + fraction * fmax)[:, np.newaxis]
+        return x[np.argmax(above, axis=1)]
+
+    c0 = first_crossing(0.5)
+    b = (first_crossing(0.75) - first_crossing(0.25)) / (2 * np.log(3))
+    b = np.maximum(b, 0.5)
+    g = np.ones_like(b)
+
+    p0 = np.stack([y0, fmax, c0, b, g], axis=1)
+    amplified = np.isfinite(p0).all(axis=1) & (fmax > min_snr * noise)
+    return p0, amplified
+
+def sigmoid(x, y0, fmax, c0, b, g=1):
+    e = _exp_term(x, c0, b)
+    return y0 + fmax * (1 + e)**-g
+
+def sigmoid_jacobian(x, y0, fmax, c0, b, g=None):
+    """
+    Return the partial derivatives of `sigmoid()` with respect to each
+    parameter, as an array with one column per parameter.  If *g* is None,
+    the 4-parameter model is assumed.
+    """
+    l5 = g is not None
+    g = g if l5 else 1
+    e = _exp_term(x, c0, b)
+
+    f = (1 + e)**-g
+    df_dc0 = -fmax * g * (1 + e)**(-g - 1) * e / b
+
+    jac = [
+            np.ones_like(x),
+            f,
+            df_dc0,
+            df_dc0 * (x - c0) / b,
+    ]
+    if l5:
+        jac.append(-fmax * f * np.log1p(e))
+
+    return np.stack(jac, axis=-1)
+
+def _fit_chunk(model, x, y, p0):
+    # Import scipy here, so that importing this package stays cheap.
+    from scipy.optimize import least_squares
+
+    n = MODELS[model]
+    lower = [-np.inf, 0, -np.inf, 1e-3, 1e-3][:n]
+    params = np.full((len(y), n), np.nan)
+
+    for k, (y_k, p0_k) in enumerate(zip(y, p0)):
+        i = np.isfinite(y_k)
+        x_i, y_i = x[i], y_k[i]
+
+        try:
+            fit = least_squares(
+                    lambda p: sigmoid(x_i, *p) - y_i,
+                    p0_k,
+                    jac=lambda p: sigmoid_jacobian(x_i, *p),
+                    bounds=(lower, np.inf),
+                    x_scale='jac',
+            )
+        except ValueError:
+            continue
+
+        if fit.success:
+            params[k] = fit.x
+
+    if n == 4:
+        params = np.column_stack([params, np.ones(len(params))])
+
+    cq, slope = _find_sdm(x, params)
+    return np.column_stack([cq, slope, params])
+
+def _find_sdm(x, params, step=0.01):
+    # Evaluate the first derivative of every model on a fine grid at once, 
+    # then find the maxima of the first and second derivatives numerically.  
+    # This works for both models, and is accurate to within *step* cycles.  
+    # Failed fits are NaN, and stay NaN.
+    grid = np.arange(x.min(), x.max() + step, step)
+    y0, fmax, c0, b, g = params.T[:, :, np.newaxis]
+
+    e = _exp_term(grid, c0, b)
+    d1 = fmax * g * (1 + e)**(-g - 1) * e / b
+    d2 = np.gradient(d1, step, axis=1)
+
+    fit = np.isfinite(params).all(axis=1)
+    i = np.argmax(np.where(fit[:, np.newaxis], d2, 0), axis=1)
+
+    cq = np.where(fit, grid[i], np.nan)
+    slope = np.where(fit, np.max(d1, axis=1, initial=0, where=fit[:, None]), np.nan)
+    return cq, slope
+
+def _exp_term(x, c0, b):
+    # Clip the exponent to avoid overflow far from the midpoint of the curve,
+    # where the curve is flat anyways.
+    return np.exp(np.clip(-(x - c0) / b, -500, 500))
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+class CqStats:
+    """
+    Summary statistics of Cq values, accumulated one chunk (e.g. plate) at a
+    time.
+
+    `agg_cq()` needs every Cq value in a group to be in memory at once.  This
+    class instead keeps a small partial state for each group---the count, the
+    number of missing values, the sum, the sum of squares, the minimum, the
+    maximum, and a histogram of the values---so it can consume any number of
+    plates in bounded memory.  The partial states can also be merged, so
+    plates can be accumulated in different processes (or on different days)
+    and combined later.  `agg()` returns the same columns as `agg_cq()`.
+
+    The median is estimated from the histogram, with bins of the given
+    *resolution*, so it's accurate to within the width of one bin.  The other
+    statistics are exact (up to floating point error).
+    """
+
+    MOMENTS = {
+            'n': 'sum',
+            'n_nan': 'sum',
+            'sum': 'sum',
+            'sum_sq': 'sum',
+            'min': 'min',
+            'max': 'max',
+    }
+
+    def __init__(self, by, resolution=0.01):
+        self.by = list(by)
+        self.resolution = resolution
+        self.moments = None
+        self.hist = None
+
+    def add(self, df):
+        """
+        Include the Cq values from the given data frame, which must have a
+        *cq* column and a column for each grouping key.
+        """
+        cq = df['cq'].astype(float)
+        df = df[self.by].assign(
+                cq=cq,
+                is_nan=cq.isna(),
+                cq_sq=cq**2,
+                bin=np.floor(cq / self.resolution),
+        )
+        groups = df.groupby(self.by, dropna=False)
+
+        moments = pd.DataFrame({
+            'n': groups.size(),
+            'n_nan': groups['is_nan'].sum(),
+            'sum': groups['cq'].sum(),
+            'sum_sq': groups['cq_sq'].sum(),
+            'min': groups['cq'].min(),
+            'max': groups['cq'].max(),
+        })
+        hist = df\
+                .dropna(subset=['cq'])\
+                .astype({'bin': int})\
+                .groupby([*self.by, 'bin'], dropna=False)\
+                .size()
+
+        self._merge(moments, hist)
+        return self
+
+    def update(self, other):
+        """
+        Include the partial state accumulated by another instance.
+        """
+        if other.by != self.by or other.resolution != self.resolution:
+            raise ValueError("can't merge statistics with different groups or resolutions")
+
+        if other.moments is not None:
+            self._merge(other.moments, other.hist)
+
+        return self
+
+    def agg(self):
+        """
+        Return the statistics accumulated so far, in the same format as
+        `agg_cq()` (after grouping).
+        """
+        if self.moments is None:
+            raise ValueError("no Cq values have been added")
+
+        m = self.moments
+        n_valid = m['n'] - m['n_nan']
+
+        # Use the same degrees of freedom as `pandas.Series.std()`.  Clip tiny
+        # negative variances, which are just floating point error.
+        var = (m['sum_sq'] - m['sum']**2 / n_valid) / (n_valid - 1)
+
+        return pd.DataFrame({
+            'n': m['n'].astype(float),
+            'n_nan': m['n_nan'].astype(float),
+            'cq_mean': m['sum'] / n_valid,
+            'cq_median': self._estimate_median(),
+            'cq_min': m['min'],
+            'cq_max': m['max'],
+            'cq_std': np.sqrt(var.clip(lower=0)),
+        })
+
+    def _merge(self, moments, hist):
+        if self.moments is None:
+            self.moments, self.hist = moments, hist
+            return
+
+        self.moments = pd.concat([self.moments, moments])\
+                .groupby(level=self.by, dropna=False)\
+                .agg(self.MOMENTS)
+        self.hist = pd.concat([self.hist, hist])\
+                .groupby(level=[*self.by, 'bin'], dropna=False)\
+                .sum()
+
+    def _estimate_median(self):
+        h = self.hist.rename('count').reset_index()
+        h = h.sort_values([*self.by, 'bin'], kind='stable')
+
+        groups = h.groupby(self.by, dropna=False, sort=False)['count']
+        h['cum'] = groups.cumsum()
+        h['n'] = groups.transform('sum')
+        h['cum_before'] = h['cum'] - h['count']
+
+        # Like `pandas.Series.median()`, average the two middle values if
+        # there are an even number of them.  Within each bin, assume the
+        # values are evenly spaced.
+        def value_at_rank(r):
+            x = h[(h['cum_before'] <= r) & (r < h['cum'])]
+            offset = (r - x['cum_before'] + 0.5) / x['count']
+            x = x.assign(value=(x['bin'] + offset) * self.resolution)
+            return x.set_index(self.by)['value']
+
+        lo = value_at_rank((h['n'] - 1) // 2)
+        hi = value_at_rank(h['n'] // 2)
+
+        median = (lo + hi) / 2
+        return median.reindex(self.moments.index)\
+                .clip(self.moments['min'], self.moments['max'])
+
+def agg_cq_chunks(chunks, by, resolution=0.01):
+    """
+    Calculate the same statistics as `agg_cq()` for each group, reading the
+    per-well Cq values from an iterable of data frames (e.g. one per plate).
+    Only one chunk needs to be in memory at a time.
+    """
+    stats = CqStats(by, resolution)
+    for df in chunks:
+        stats.add(df)
+    return stats.agg()
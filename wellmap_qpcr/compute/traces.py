@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_BASELINE_CYCLES = 3, 15
+
+def preprocess_traces(df, *, baseline=None, drift=False, normalize=False):
+    """
+    Correct and/or normalize the given amplification curves.
+
+    *df* should be in the format returned by `load_trace()`, i.e. with one row
+    per well per cycle.  If *baseline* is a (first, last) pair of cycles, the
+    average fluorescence over those cycles is subtracted from each well.  If
+    *drift* is also true, a line is fit to those cycles instead, and
+    subtracted from the whole curve.  If *normalize* is true, each curve is
+    then scaled so that its maximum is 1.
+
+    The return value is a copy of the data frame with the *rfu* column
+    updated.  All of the wells are processed at once, as a wells × cycles
+    matrix (see `trace_matrix()`).
+    """
+    rfu = trace_matrix(df)
+
+    if baseline is not None:
+        rfu = subtract_baseline(rfu, baseline, drift=drift)
+    if normalize:
+        rfu = normalize_max(rfu)
+
+    keys = [*rfu.index.names, 'cycle']
+    df = df.copy()
+    df['rfu'] = rfu.stack().reindex(pd.MultiIndex.from_frame(df[keys])).values
+    return df
+
+def trace_matrix(df, value='rfu'):
+    """
+    Reshape the given amplification curves into a matrix with one row per
+    well and one column per cycle.
+
+    Wells are identified by their *path* and *well* columns, so data from
+    multiple plates can be included.
+    """
+    keys = ['path', 'well'] if 'path' in df else ['well']
+    return df.pivot(index=keys, columns='cycle', values=value)
+
+def subtract_baseline(rfu, cycles=DEFAULT_BASELINE_CYCLES, drift=False):
+    """
+    Subtract the background fluorescence from each row of the given wells ×
+    cycles matrix.
+
+    The background is estimated from the given (inclusive) range of cycles,
+    which should come before any amplification.  By default the background is
+    the average over that range.  If *drift* is true, it's instead a line fit
+    to that range (by least squares, for every well at once) and extrapolated
+    over every cycle.
+    """
+    first, last = cycles
+    x_all = rfu.columns.to_numpy(dtype=float)
+    i = (x_all >= first) & (x_all <= last)
+
+    if not i.any():
+        raise ValueError(f"no cycles in baseline window: {first}-{last}")
+
+    x = x_all[i]
+    y = rfu.to_numpy(dtype=float)[:, i]
+    y_mean = np.nanmean(y, axis=1, keepdims=True)
+
+    if not drift:
+        return rfu - y_mean
+
+    dx = x - x.mean()
+    slope = np.nansum(dx * (y - y_mean), axis=1, keepdims=True) / np.sum(dx**2)
+    background = y_mean + slope * (x_all - x.mean())
+    return rfu - background
+
+def normalize_max(rfu):
+    """
+    Scale each row of the given wells × cycles matrix so that its maximum
+    is 1.
+    """
+    return rfu.div(rfu.max(axis=1), axis=0)
+
+def get_baseline_options(extra):
+    """
+    Return the keyword arguments for `preprocess_traces()` specified by the
+    `qpcr.baseline` metadata.
+    """
+    options = extra.get('qpcr', {}).get('baseline', {})
+    return dict(
+            baseline=tuple(options.get('cycles', DEFAULT_BASELINE_CYCLES)),
+            drift=options.get('drift', False),
+    )
@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+
+"""\
+Keep a local database of qPCR results, for querying across many experiments.
+
+Usage:
+    qpcr-db ingest <toml>... [-d <path>] [--if-changed]
+    qpcr-db cq [-d <path>] [-p <primers>] [-t <template>] [-l <label>]
+        [-P <plate>] [-s <date>] [-u <date>]
+    qpcr-db efficiency [-d <path>] [-p <primers>] [-t <template>]
+        [-s <date>] [-u <date>]
+
+Subcommands:
+    ingest
+        Analyze the given layouts and add the results to the database.
+        Layouts with a `template_conc` column are treated as standard curves
+        (see `qpcr-check-efficiency -h`), and the efficiency fits are stored
+        (where `qpcr-absolute-quant` can use them).
+        Layouts with a `label` column are treated as relative expression
+        experiments (see `qpcr-relative-expression -h`), and the Cq value of
+        each well and the ΔCq/ΔΔCq value of each label are stored.  Ingesting
+        a layout that's already in the database replaces the old results.
+
+    cq
+        Print the Cq value of every well matching the given criteria.
+
+    efficiency
+        Print every standard curve fit matching the given criteria.
+
+Options:
+    -d --db <path>              [default: qpcr.db]
+        The SQLite database file to use.  It will be created if it doesn't
+        already exist.
+
+    -p --primers <primers>
+        Only include results for the given primers.
+
+    -t --template <template>
+        Only include results for the given template.
+
+    -l --label <label>
+        Only include results for wells with the given label.
+
+    -P --plate <plate>
+        Only include results from the given plate.
+
+    -s --since <date>
+        Only include results from on or after the given date (YYYY-MM-DD).
+
+    -u --until <date>
+        Only include results from on or before the given date (YYYY-MM-DD).
+
+    --if-changed
+        Don't re-ingest layouts that haven't changed (nor has any of the data
+        they reference) since they were last ingested.
+
+Each well is dated using its `date` column, if the layout has one.  Otherwise,
+the modification date of its data file (i.e. the day it was exported from the
+instrument) is used.
+"""
+
+import sys, docopt
+import sqlite3
+import pandas as pd
+
+from .export import get_plate_names
+from .compute import standard_curves
+from .cache import hash_inputs, fingerprint_layouts
+from datetime import date, datetime
+from pathlib import Path
+
+SCHEMA = '''\
+CREATE TABLE IF NOT EXISTS layouts (
+    layout TEXT PRIMARY KEY,
+    ingested TEXT
+);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    layout TEXT PRIMARY KEY,
+    fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS wells (
+    layout TEXT,
+    plate TEXT,
+    well TEXT,
+    label TEXT,
+    sublabel TEXT,
+    template TEXT,
+    primers TEXT,
+    date TEXT,
+    housekeeping INTEGER,
+    treatment INTEGER,
+    cq REAL
+);
+CREATE TABLE IF NOT EXISTS expression (
+    layout TEXT,
+    label TEXT,
+    date TEXT,
+    delta TEXT,
+    delta_mean REAL,
+    delta_median REAL,
+    delta_std REAL,
+    fold_change REAL,
+    fold_change_err REAL
+);
+CREATE TABLE IF NOT EXISTS standard_curves (
+    layout TEXT,
+    template TEXT,
+    primers TEXT,
+    date TEXT,
+    n INTEGER,
+    slope REAL,
+    intercept REAL,
+    r2 REAL,
+    efficiency REAL,
+    log_conc_mean REAL,
+    log_conc_ss REAL,
+    residual_std REAL
+);
+CREATE INDEX IF NOT EXISTS wells_layout ON wells (layout);
+CREATE INDEX IF NOT EXISTS wells_primers ON wells (primers, date);
+CREATE INDEX IF NOT EXISTS wells_template ON wells (template, date);
+CREATE INDEX IF NOT EXISTS wells_label ON wells (label, date);
+CREATE INDEX IF NOT EXISTS wells_plate ON wells (plate);
+CREATE INDEX IF NOT EXISTS wells_date ON wells (date);
+CREATE INDEX IF NOT EXISTS expression_layout ON expression (layout);
+CREATE INDEX IF NOT EXISTS expression_label ON expression (label, date);
+CREATE INDEX IF NOT EXISTS standard_curves_layout ON standard_curves (layout);
+CREATE INDEX IF NOT EXISTS standard_curves_primers ON standard_curves (primers, template, date);
+CREATE INDEX IF NOT EXISTS standard_curves_template ON standard_curves (template, date);
+'''
+
+def main():
+    args = docopt.docopt(__doc__)
+
+    with ResultsDb(args['--db']) as db:
+        if args['ingest']:
+            for toml in args['<toml>']:
+                db.ingest(Path(toml), if_changed=args['--if-changed'])
+            return
+
+        filters = dict(
+                primers=args['--primers'],
+                template=args['--template'],
+                since=args['--since'],
+                until=args['--until'],
+        )
+
+        if args['cq']:
+            df = db.query_cq(
+                    label=args['--label'],
+                    plate=args['--plate'],
+                    **filters,
+            )
+        if args['efficiency']:
+            df = db.query_efficiency(**filters)
+
+        pd.options.display.width = sys.maxsize
+        pd.options.display.max_rows = sys.maxsize
+        print(df.to_string(index=False))
+
+class ResultsDb:
+    """
+    A local SQLite database of qPCR results.
+
+    The database stores the Cq value of each well and the ΔCq/ΔΔCq value of
+    each label from relative expression experiments, and the fits from
+    standard curve experiments.  It's indexed by primers, template, label,
+    plate, and date, so that questions like "what are all the Cq values for
+    these primers from the last year?" can be answered without reloading
+    any of the underlying data.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def ingest(self, layout_path, if_changed=False):
+        """
+        Add the results from the given layout to the database, replacing any
+        results that were previously ingested from the same layout.
+
+        The kind of experiment is inferred from the columns in the layout; see
+        `qpcr-db -h` for details.  If *if_changed* is true, layouts are
+        skipped if neither they nor their data have changed since they were
+        last ingested.
+        """
+        import wellmap
+        layout = wellmap.load(layout_path)
+        fingerprint = hash_inputs(fingerprint_layouts([layout_path]))
+
+        if if_changed:
+            row = self.db.execute(
+                    'SELECT fingerprint FROM fingerprints WHERE layout = ?',
+                    (_layout_key(layout_path),),
+            ).fetchone()
+            if row and row[0] == fingerprint:
+                return
+
+        with self.db:
+            self._forget(layout_path)
+
+            # If a layout is both a standard curve and a relative expression 
+            # experiment, only record the well data once.
+            if 'label' in layout:
+                self._ingest_expression(layout_path)
+            if 'template_conc' in layout:
+                self._ingest_efficiency(
+                        layout_path,
+                        include_wells='label' not in layout,
+                )
+
+            self.db.execute(
+                    'INSERT INTO layouts VALUES (?, ?)',
+                    (_layout_key(layout_path), datetime.now().isoformat()),
+            )
+            self.db.execute(
+                    'INSERT INTO fingerprints VALUES (?, ?)',
+                    (_layout_key(layout_path), fingerprint),
+            )
+
+    def query_cq(
+            self, *,
+            primers=None,
+            template=None,
+            label=None,
+            plate=None,
+            since=None,
+            until=None,
+    ):
+        """
+        Return the Cq value of every well matching the given criteria.
+        """
+        return self._query('wells', dict(
+            primers=primers,
+            template=template,
+            label=label,
+            plate=plate,
+            since=since,
+            until=until,
+        ))
+
+    def query_expression(self, *, label=None, since=None, until=None):
+        """
+        Return the ΔCq/ΔΔCq value of every label matching the given criteria.
+        """
+        return self._query('expression', dict(
+            label=label,
+            since=since,
+            until=until,
+        ))
+
+    def query_efficiency(
+            self, *,
+            primers=None,
+            template=None,
+            since=None,
+            until=None,
+    ):
+        """
+        Return every standard curve fit matching the given criteria.
+        """
+        return self._query('standard_curves', dict(
+            primers=primers,
+            template=template,
+            since=since,
+            until=until,
+        ))
+
+    def _ingest_expression(self, layout_path):
+        # Import the analysis code lazily, so that queries don't have to pay
+        # for importing matplotlib.
+        from .analysis.relative_expression.expression import load
+
+        df, layout, style = load(layout_path)
+        layout = layout.assign(date=get_dates(layout))
+        self._insert_wells(layout_path, layout)
+
+        delta = 'ΔΔcq' if 'ΔΔcq_mean' in df else 'Δcq'
+        dates = layout.groupby('label')['date'].min()
+        expression = pd.DataFrame({
+            'layout': _layout_key(layout_path),
+            'label': df.index,
+            'date': dates.reindex(df.index).values,
+            'delta': delta,
+            'delta_mean': df[f'{delta}_mean'].values,
+            'delta_median': df[f'{delta}_median'].values,
+            'delta_std': df[f'{delta}_std'].values,
+            'fold_change': df['fold_change'].values,
+            'fold_change_err': df['fold_change_err'].values,
+        })
+        self._insert('expression', expression)
+
+    def _ingest_efficiency(self, layout_path, include_wells=True):
+        from .analysis.check_efficiency import CheckEfficiency
+
+        app = CheckEfficiency.from_bare()
+        app.layout_toml = layout_path
+
+        df = app.df.assign(date=get_dates(app.df))
+        if include_wells:
+            self._insert_wells(layout_path, df)
+
+        fits = standard_curves(df)
+        fits.insert(0, 'layout', _layout_key(layout_path))
+        self._insert('standard_curves', fits)
+
+    def _insert_wells(self, layout_path, df):
+        wells = pd.DataFrame({
+            'layout': _layout_key(layout_path),
+            'plate': get_plate_names(df),
+            'well': df['well'],
+            'label': df.get('label'),
+            'sublabel': df.get('sublabel'),
+            'template': df.get('template'),
+            'primers': df.get('primers'),
+            'date': df['date'],
+            'housekeeping': df.get('housekeeping'),
+            'treatment': df.get('treatment'),
+            'cq': df['cq'],
+        })
+        self._insert('wells', wells)
+
+    def _forget(self, layout_path):
+        key = _layout_key(layout_path),
+        tables = [
+                'layouts', 'fingerprints', 'wells', 'expression',
+                'standard_curves',
+        ]
+        for table in tables:
+            self.db.execute(f'DELETE FROM {table} WHERE layout = ?', key)
+
+    def _insert(self, table, df):
+        df = df.astype(object).where(df.notna(), None)
+        cols = ', '.join(df.columns)
+        params = ', '.join('?' * len(df.columns))
+        self.db.executemany(
+                f'INSERT INTO {table} ({cols}) VALUES ({params})',
+                df.itertuples(index=False, name=None),
+        )
+
+    def _query(self, table, filters):
+        where, params = [], []
+
+        for col, value in filters.items():
+            if value is None:
+                continue
+            if col == 'since':
+                where.append('date >= ?')
+            elif col == 'until':
+                where.append('date <= ?')
+            else:
+                where.append(f'{col} = ?')
+            params.append(_format_filter(value))
+
+        sql = f'SELECT * FROM {table}'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+
+        return pd.read_sql_query(sql, self.db, params=params)
+
+def _layout_key(layout_path):
+    return str(Path(layout_path).resolve())
+
+def get_dates(df):
+    """
+    Return the date of each well, as a YYYY-MM-DD string.
+
+    Wells are dated by their *date* column, if the layout has one, and
+    otherwise by the modification date of their data file.
+    """
+    if 'date' in df:
+        dates = pd.to_datetime(df['date'])
+    else:
+        dates = pd.Series(pd.NaT, index=df.index)
+
+    if 'path' in df:
+        mtimes = df['path'].map(
+                lambda p: pd.Timestamp.fromtimestamp(Path(p).stat().st_mtime)
+        )
+        dates = dates.fillna(mtimes)
+
+    return dates.dt.strftime('%Y-%m-%d')
+
+def _format_filter(value):
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    return value
+
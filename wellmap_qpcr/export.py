@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+import shutil
+
+from pathlib import Path, PurePath
+from urllib.parse import quote
+
+def export_parquet(export_dir, layout_path, name, df):
+    """
+    Write the given data frame to a Parquet dataset.
+
+    The dataset is hive-partitioned by layout and, if the data frame has
+    per-plate rows, by plate::
+
+        <export_dir>/<name>/layout=<stem>/plate=<plate>/part-0.parquet
+
+    The plate is taken from the *plate* column if there is one, and from the
+    name of the data file (i.e. the *path* column) otherwise.  Any files
+    previously exported for the same layout are replaced, so exporting a
+    layout twice won't duplicate any rows.
+
+    Writing Parquet files requires ``pyarrow``, which can be installed via
+    the ``export`` extra.
+    """
+    layout_path = Path(layout_path)
+    layout_dir = Path(export_dir) / name / _partition('layout', layout_path.stem)
+
+    if layout_dir.exists():
+        shutil.rmtree(layout_dir)
+
+    df = _prepare(df)
+    plates = get_plate_names(df)
+
+    if plates is None:
+        _write(layout_dir, df)
+    else:
+        for plate, g in df.groupby(plates, sort=False):
+            _write(layout_dir / _partition('plate', plate), g)
+
+def get_plate_names(df):
+    """
+    Return the name of the plate that each row of the given data frame came 
+    from, or None if the data frame doesn't have per-plate rows.
+    """
+    if 'plate' in df:
+        return df['plate']
+    if 'path' in df:
+        return df['path'].map(lambda x: PurePath(x).name)
+    return None
+
+def _prepare(df):
+    # Keep any meaningful index (e.g. the groups from `agg_cq()`) as regular
+    # columns, since dashboards won't know how to interpret a pandas index.
+    if any(x is not None for x in df.index.names):
+        df = df.reset_index()
+    else:
+        df = df.reset_index(drop=True)
+
+    # Arrow doesn't know how to serialize paths.
+    for col in df.select_dtypes(include='object'):
+        df[col] = df[col].map(
+                lambda x: str(x) if isinstance(x, PurePath) else x
+        )
+
+    return df
+
+def _partition(key, value):
+    return f'{key}={quote(str(value), safe="")}'
+
+def _write(dir, df):
+    dir.mkdir(parents=True, exist_ok=True)
+    df.drop(columns='plate', errors='ignore')\
+            .to_parquet(dir / 'part-0.parquet', index=False)
+
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+"""
+Reuse pre-laid-out figures when the same kind of plot is rendered many times.
+
+Making a figure from scratch (creating the axes, formatting the ticks, and
+especially working out the layout) often takes longer than drawing the data.
+In batch use, e.g. a server rendering one plot after another, most of those
+figures have the same structure: the same kind of plot, with the same grid of
+axes.  When templates are enabled, each such figure is created only once.
+Rendering another plot with the same structure just removes the data from the
+template and draws the new data in its place.  The layout is only worked out
+again if the text around the axes (e.g. the titles and tick labels) has
+changed, since that's what the layout depends on.
+
+Templates are disabled by default, because the figures they return aren't
+managed by pyplot (so `plt.savefig()`, `plt.show()`, etc. won't see them) and
+are reused by the next plot with the same structure.  Callers that enable
+templates must save each figure before making the next one.
+"""
+
+import matplotlib.pyplot as plt
+
+from matplotlib.figure import Figure
+from collections import OrderedDict
+from weakref import WeakKeyDictionary
+
+_templates = None
+_layouts = WeakKeyDictionary()
+_colorbars = WeakKeyDictionary()
+
+def enable_templates(max_templates=32):
+    """
+    Start reusing figures in this process.  At most *max_templates* figures
+    are kept; the least recently used are discarded first.
+    """
+    global _templates
+    _templates = _TemplateCache(max_templates)
+
+def disable_templates():
+    global _templates
+    _templates = None
+
+def subplots(key, *args, **kwargs):
+    """
+    Return a figure and axes, like `plt.subplots()`.
+
+    If templates are enabled, the figure is reused from the last call with the
+    same *key* and arguments (after removing any data plotted on it).  The
+    key should identify the kind of plot, and anything else (e.g. the scale
+    of an axis) that isn't set every time the plot is drawn.
+    """
+    if _templates is None:
+        return plt.subplots(*args, **kwargs)
+
+    return _templates.get((key, args, tuple(sorted(kwargs.items()))))
+
+def tight_layout(fig):
+    """
+    Adjust the layout of the given figure, like `Figure.tight_layout()`, unless
+    it's a template that was already laid out with the same text.
+    """
+    if _templates is None or not _templates.contains(fig):
+        fig.tight_layout()
+        return
+
+    key = _get_layout_key(fig)
+    if _layouts.get(fig) != key:
+        # The result of `tight_layout()` depends on where the axes start out,
+        # so start from the same place as a new figure would.
+        fig.subplots_adjust(**{
+                k: plt.rcParams[f'figure.subplot.{k}']
+                for k in _SUBPLOT_PARAMS
+        })
+        fig.tight_layout()
+        _layouts[fig] = key
+
+def colorbar(mappable, ax, **kwargs):
+    """
+    Add a colorbar for the given artist next to the given axes, like
+    `plt.colorbar()`, but redraw the same colorbar when a template is reused.
+    """
+    fig = ax.get_figure()
+    cax = _colorbars.get(ax)
+
+    if cax is None:
+        cbar = fig.colorbar(mappable, ax=ax, **kwargs)
+        _colorbars[ax] = cbar.ax
+    else:
+        cax.clear()
+        cbar = fig.colorbar(mappable, cax=cax, **kwargs)
+
+    return cbar
+
+class _TemplateCache:
+
+    def __init__(self, max_templates):
+        self.max_templates = max_templates
+        self.templates = OrderedDict()
+
+    def get(self, key):
+        if key in self.templates:
+            self.templates.move_to_end(key)
+            fig, axes = self.templates[key]
+            _clear_figure(fig)
+            return fig, axes
+
+        (_, args, kwargs) = key
+        kwargs = dict(kwargs)
+        fig = Figure(figsize=kwargs.pop('figsize', None))
+        axes = fig.subplots(*args, **kwargs)
+
+        self.templates[key] = fig, axes
+        while len(self.templates) > self.max_templates:
+            self.templates.popitem(last=False)
+
+        return fig, axes
+
+    def contains(self, fig):
+        return any(fig is x for x, _ in self.templates.values())
+
+def _clear_figure(fig):
+    colorbar_axes = set(_colorbars.values())
+
+    for ax in fig.axes:
+        if ax not in colorbar_axes:
+            _clear_axes(ax)
+
+def _clear_axes(ax):
+    # Remove the data, but keep everything about the axes themselves (e.g.
+    # position, scales, axis labels), since that's the expensive part.
+    for container in list(ax.containers):
+        container.remove()
+
+    artists = [
+            *ax.lines,
+            *ax.collections,
+            *ax.patches,
+            *ax.images,
+            *ax.texts,
+    ]
+    for artist in artists:
+        artist.remove()
+
+    legend = ax.get_legend()
+    if legend:
+        legend.remove()
+
+    # Axes that don't get any data this time might not get a title either.
+    for loc in _TITLE_LOCS:
+        ax.set_title('', loc=loc)
+
+    ax.relim()
+    ax.set_autoscale_on(True)
+
+def _get_layout_key(fig):
+    # All the text that `tight_layout()` has to make room for.  Tick labels
+    # depend on the data limits, so these are only known once the data has
+    # been plotted.
+    texts = [x.get_text() for x in fig.texts]
+
+    for ax in fig.axes:
+        texts += [ax.get_title(loc) for loc in _TITLE_LOCS]
+        texts += [ax.get_xlabel(), ax.get_ylabel()]
+        texts += [x.get_text() for x in ax.get_xticklabels()]
+        texts += [x.get_text() for x in ax.get_yticklabels()]
+
+        legend = ax.get_legend()
+        if legend:
+            texts += [x.get_text() for x in legend.get_texts()]
+
+        texts.append(None)
+
+    return texts
+
+_TITLE_LOCS = 'left', 'center', 'right'
+_SUBPLOT_PARAMS = 'left', 'right', 'bottom', 'top', 'wspace', 'hspace'
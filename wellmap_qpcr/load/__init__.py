@@ -1,4 +1,4 @@
 #!/usr/bin/env python3
 
-from . import biorad
+from . import biorad, store
 from .infer import *
@@ -1,37 +1,119 @@
 #!/usr/bin/env python3
 
+import csv
 import pandas as pd
-from functools import partial
+from functools import partial, lru_cache
 from more_itertools import one
-from os.path import getmtime
 
-LOADERS = {
-        '.csv': pd.read_csv,
-        '.tsv': partial(pd.read_csv, sep='\t'),
-        '.xslx': pd.read_excel,
-}
+# The names of the files exported by the instrument, for each kind of data.
+CQ_GLOB = 'Quantification Cq Results.*'
+TRACE_GLOB = 'Quantification Amplification Results*'
+MELT_GLOB = 'Melt Curve Derivative Results*'
 
 def load_cq(path):
     if path.is_dir():
-        path = one(path.glob('Quantification Cq Results.*'))
+        path = one(path.glob(CQ_GLOB))
 
     return LOADERS[path.suffix](path)\
             .rename(columns={'Well': 'well0', 'Cq': 'cq'})
 
 def load_trace(path):
     if path.is_dir():
-        path = one(path.glob('Quantification Amplification Results*'))
+        path = one(path.glob(TRACE_GLOB))
 
-    return LOADERS[path.suffix](path)\
+    return LOADERS[path.suffix](path, x_col='Cycle')\
             .rename(columns={'Cycle': 'cycle'})\
             .melt(id_vars=['cycle'], var_name='well', value_name='rfu')
 
 def load_melt(path):
     if path.is_dir():
-        path = one(path.glob('Melt Curve Derivative Results*'))
+        path = one(path.glob(MELT_GLOB))
 
-    return LOADERS[path.suffix](path)\
+    return LOADERS[path.suffix](path, x_col='Temperature')\
             .rename(columns={'Temperature': 'temp_C'})\
             .melt(id_vars=['temp_C'], var_name='well', value_name='rfu_deriv')
 
+def read_csv(path, sep=',', x_col=None):
+    """
+    Read a CSV (or TSV) file exported by the instrument.
+
+    If *x_col* is given, the file is assumed to contain curves: that column
+    holds the cycle or temperature, and every other column holds the
+    measurements for one well.  The well columns are then parsed as floats
+    without any type inference, which is faster and avoids surprises (e.g.
+    integer columns) for wells with unusual data.  These files can be large,
+    so they're parsed by pyarrow, using multiple threads, if it's installed.
+    The columns are named the same way pandas would name them (e.g. the
+    unnamed first column of some exports is 'Unnamed: 0'), so the result
+    doesn't depend on which library parsed the file.
+
+    Other files (e.g. the Cq values) are small, and are always parsed by
+    pandas.
+    """
+    if x_col is None:
+        return pd.read_csv(path, sep=sep)
+
+    names = _read_header(path, sep)
+    dtype = {k: float for k in names if k != x_col}
+
+    pa_csv = _get_pyarrow_csv()
+    if not pa_csv:
+        return pd.read_csv(path, sep=sep, dtype=dtype)
+
+    import pyarrow as pa
+
+    table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(
+                use_threads=True,
+                column_names=names,
+                skip_rows=1,
+            ),
+            parse_options=pa_csv.ParseOptions(delimiter=sep),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={k: pa.float64() for k in dtype},
+            ),
+    )
+    return table.to_pandas()
 
+def read_excel(path, x_col=None):
+    """
+    Read an Excel file exported by the instrument.  See `read_csv()` for a
+    description of *x_col*.
+    """
+    df = pd.read_excel(path)
+
+    if x_col is not None:
+        df = df.astype({k: float for k in df.columns if k != x_col})
+
+    return df
+
+def _read_header(path, sep):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        names = next(csv.reader(f, delimiter=sep), [])
+
+    # Name empty and duplicate columns like `pd.read_csv()` does.
+    counts = {}
+    for i, name in enumerate(names):
+        name = name or f'Unnamed: {i}'
+        n = counts.get(name, 0)
+        counts[name] = n + 1
+        names[i] = f'{name}.{n}' if n else name
+
+    return names
+
+@lru_cache(maxsize=None)
+def _get_pyarrow_csv():
+    # pyarrow is optional; it parses large files much faster, but isn't
+    # needed.
+    try:
+        import pyarrow.csv
+    except ImportError:
+        return None
+    return pyarrow.csv
+
+LOADERS = {
+        '.csv': read_csv,
+        '.tsv': partial(read_csv, sep='\t'),
+        '.xslx': read_excel,
+}
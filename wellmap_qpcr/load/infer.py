@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from . import biorad
+from . import biorad, store
 
 # In the future, I'll want these functions to make an effort at guessing the 
 # correct file format.  But for now I only have one, so it's kinda trivial.
@@ -9,8 +9,12 @@ def load_cq(path):
     return biorad.load_cq(path)
 
 def load_trace(path):
+    if store.has_store(path, 'trace'):
+        return store.load_trace(path)
     return biorad.load_trace(path)
 
 def load_melt(path):
+    if store.has_store(path, 'melt'):
+        return store.load_melt(path)
     return biorad.load_melt(path)
 
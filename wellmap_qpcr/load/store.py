@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""\
+Convert amplification and melt curves into a compact binary format.
+
+Parsing the CSV files exported by the instrument is slow, and requires reading
+every well on the plate even if only a few are needed.  The binary store keeps
+the curves for each plate as a float32 array (wells × cycles, or wells ×
+temperatures) that is memory-mapped when loaded, so reading a handful of wells
+only touches the parts of the file containing those wells.
+
+Usage:
+    qpcr-store <path>... [--if-changed]
+
+Arguments:
+    <path>
+        Either a directory of data exported by the instrument, or a wellmap
+        file, in which case every data directory referenced by the layout is
+        converted.  The binary store is written to a subdirectory of each data
+        directory, and from then on is used in place of the CSV files by every
+        `qpcr-*` command.  If the CSV files are re-exported, the store will be
+        ignored until it's rebuilt.
+
+Options:
+    --if-changed
+        Don't rebuild stores that are already up-to-date.
+"""
+
+import os, docopt
+import numpy as np
+import pandas as pd
+
+from . import biorad
+from dataclasses import dataclass
+from pathlib import Path
+
+STORE_DIR = 'qpcr_store'
+
+# For each kind of curve: the name of the x-axis column, the name of the
+# y-axis column, the function that parses the original data, and the name of
+# the file it parses.
+KINDS = {
+        'trace': ('cycle', 'rfu', biorad.load_trace, biorad.TRACE_GLOB),
+        'melt': ('temp_C', 'rfu_deriv', biorad.load_melt, biorad.MELT_GLOB),
+}
+
+def main():
+    args = docopt.docopt(__doc__)
+
+    for path in args['<path>']:
+        for data_path in _find_data_paths(Path(path)):
+            kinds = find_kinds(data_path)
+            if args['--if-changed'] and \
+                    all(has_store(data_path, k) for k in kinds):
+                continue
+            write_store(data_path, kinds)
+
+@dataclass
+class Curves:
+    """
+    The curves of one kind (e.g. amplification) for every well on a plate.
+
+    *values* is a (possibly memory-mapped) array with one row per well, *wells*
+    gives the well for each row, and *x* gives the cycle/temperature for each
+    column.
+    """
+    kind: str
+    x: np.ndarray
+    wells: np.ndarray
+    values: np.ndarray
+
+    def to_frame(self, wells=None):
+        """
+        Return the given wells (or every well) in the same long format as the
+        CSV loaders, i.e. one row per well per cycle/temperature.
+        """
+        x_col, y_col, *_ = KINDS[self.kind]
+
+        if wells is None:
+            wells, values = self.wells, self.values
+        else:
+            index = {well: i for i, well in enumerate(self.wells)}
+            wells = np.asarray(wells)
+            values = self.values[[index[well] for well in wells]]
+
+        n_x = len(self.x)
+        return pd.DataFrame({
+            x_col: np.tile(self.x, len(wells)),
+            'well': np.repeat(wells, n_x),
+            y_col: np.asarray(values).reshape(-1),
+        })
+
+def load_trace(path, wells=None):
+    return open_store(path, 'trace').to_frame(wells)
+
+def load_melt(path, wells=None):
+    return open_store(path, 'melt').to_frame(wells)
+
+def open_store(path, kind):
+    """
+    Memory-map the curves of the given kind from the store in the given data
+    directory.
+    """
+    store_dir = Path(path) / STORE_DIR
+    return Curves(
+            kind=kind,
+            x=np.load(store_dir / f'{kind}_x.npy'),
+            wells=np.load(store_dir / f'{kind}_wells.npy'),
+            values=np.load(store_dir / f'{kind}.npy', mmap_mode='r'),
+    )
+
+def write_store(path, kinds=None):
+    """
+    Convert the curves in the given data directory into a binary store.
+
+    By default, every kind of curve that was exported to the directory is
+    converted (see `find_kinds()`).
+    """
+    path = Path(path)
+    store_dir = path / STORE_DIR
+    store_dir.mkdir(exist_ok=True)
+
+    if kinds is None:
+        kinds = find_kinds(path)
+
+    for kind in kinds:
+        x_col, y_col, loader, _ = KINDS[kind]
+        df = loader(path)
+
+        wells = pd.unique(df['well'])
+        x = pd.unique(df[x_col])
+        values = df\
+                .pivot(index='well', columns=x_col, values=y_col)\
+                .reindex(index=wells, columns=x)\
+                .to_numpy(dtype=np.float32)
+
+        _save(store_dir / f'{kind}_x.npy', x)
+        _save(store_dir / f'{kind}_wells.npy', wells.astype(str))
+
+        # Write the values last, because they're what `has_store()` checks.
+        _save(store_dir / f'{kind}.npy', values)
+
+def find_kinds(path):
+    """
+    Return the kinds of curves that were exported to the given data
+    directory.  Plates don't always have melt curves, for example.
+    """
+    path = Path(path)
+    return [
+            kind for kind, (*_, pattern) in KINDS.items()
+            if any(path.glob(pattern))
+    ]
+
+def has_store(path, kind):
+    """
+    Return True if the given data directory has an up-to-date store for the
+    given kind of curve.
+
+    The store is out-of-date if any of the files in the data directory were
+    modified after it was written.
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return False
+
+    try:
+        store_mtime = (path / STORE_DIR / f'{kind}.npy').stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+    return all(
+            p.stat().st_mtime_ns <= store_mtime
+            for p in path.iterdir()
+            if p.is_file()
+    )
+
+def _find_data_paths(path):
+    if path.suffix != '.toml':
+        return [path]
+
+    import wellmap
+    layout = wellmap.load(path, path_guess='{0.stem}', path_required=True)
+    return layout['path'].unique()
+
+def _save(path, array):
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with tmp_path.open('wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
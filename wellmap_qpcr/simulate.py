@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+
+"""\
+Simulate qPCR experiments, for testing and profiling the analysis scripts.
+
+Usage:
+    qpcr-simulate <design> <dir> [-n <plates>] [-w <wells>] [-s <seed>]
+        [-e <percent>] [--noise <rfu>] [--drift <rfu>]
+
+Arguments:
+    <design>
+        The kind of experiment to simulate.  The following designs are
+        available:
+
+        expression:
+            Pairs of rows with a housekeeping gene (gapdh) and a gene of
+            interest, with the left half of the plate treated with a drug.
+            Each gene has a random fold-change in response to the drug.
+            Suitable for `qpcr-relative-expression`.
+
+        dilution:
+            Columns of 10-fold template dilutions, with pairs of rows for each
+            set of primers and no-template controls in the last column.  Each
+            set of primers has a random efficiency.  Suitable for
+            `qpcr-check-efficiency`.
+
+        anneal:
+            A temperature gradient down the rows, with pairs of columns for
+            each set of primers and no-template controls in the last column.
+            Each set of primers has a random optimal annealing temperature.
+            Suitable for `qpcr-optimize-ta`.
+
+    <dir>
+        The directory to write the simulated experiment to.  The layout is
+        written to `<design>.toml`, and the data for each plate is written to
+        `<design>/<plate>/`, in the same format as the Bio-Rad CFX software
+        exports.
+
+Options:
+    -n --num-plates <n>         [default: 1]
+        The number of plates to simulate.  Every plate has the same layout,
+        but different random noise.
+
+    -w --num-wells <n>          [default: 96]
+        The number of wells on each plate: 96, 384, or 1536.
+
+    -s --seed <n>
+        Seed the random number generator, to make the same data every time.
+
+    -e --efficiency <percent>   [default: 95]
+        The average amplification efficiency of the reactions.
+
+    --noise <rfu>               [default: 10]
+        The standard deviation of the noise added to each fluorescence
+        measurement.
+
+    --drift <rfu>               [default: 0.5]
+        How much the baseline fluorescence increases with each cycle.
+
+The amplification curves are logistic, with the initial growth rate set by the
+efficiency of each reaction.  The Cq values are found from the simulated
+curves (after subtracting a linear baseline), in the same way that the
+instrument finds them, so they include the effect of the noise.  Each product
+has a melting temperature, and some no-template controls form primer dimers
+that amplify late and melt at a lower temperature.
+"""
+
+import wellmap
+import docopt
+import numpy as np
+import pandas as pd
+
+from .wells import PLATE_FORMATS
+from .compute.traces import subtract_baseline
+from dataclasses import dataclass
+from pathlib import Path
+
+@dataclass
+class Chemistry:
+    """
+    The parameters that determine how each simulated reaction behaves.
+    """
+
+    # The average efficiency of the reactions, as a fraction (e.g. 0.95 is
+    # 95% efficient).  Some designs vary the efficiency between primers.
+    efficiency: float = 0.95
+
+    # The standard deviation of the noise in each fluorescence measurement,
+    # in RFU.
+    noise: float = 10
+
+    # The background fluorescence at cycle 0, and how much it increases with
+    # each cycle, in RFU.
+    baseline: float = 100
+    drift: float = 0.5
+
+    # The increase in fluorescence at the plateau, and at the threshold used
+    # to find Cq values, in RFU.
+    plateau: float = 3000
+    threshold: float = 200
+
+    # The number of copies of the product that give the threshold
+    # fluorescence.
+    threshold_copies: float = 1e11
+
+    # The relative standard deviation in the amount of template added to each
+    # well, i.e. pipetting error.
+    pipetting_cv: float = 0.1
+
+    # The fraction of no-template controls that form primer dimers, and the
+    # melting temperature of those dimers.
+    dimer_rate: float = 0.1
+    dimer_tm_C: float = 74
+
+    # The cycles and temperatures that are measured.
+    num_cycles: int = 40
+    melt_range_C: tuple = (65, 95, 0.5)
+
+    def get_cycles(self):
+        return np.arange(1, self.num_cycles + 1)
+
+    def get_melt_temps(self):
+        start, stop, step = self.melt_range_C
+        return np.arange(start, stop + step / 2, step)
+
+def main():
+    args = docopt.docopt(__doc__)
+    chemistry = Chemistry(
+            efficiency=float(args['--efficiency']) / 100,
+            noise=float(args['--noise']),
+            drift=float(args['--drift']),
+    )
+    toml_path = simulate(
+            args['<dir>'],
+            args['<design>'],
+            n_plates=int(args['--num-plates']),
+            n_wells=int(args['--num-wells']),
+            chemistry=chemistry,
+            seed=args['--seed'] and int(args['--seed']),
+    )
+    print(toml_path)
+
+def simulate(
+        out_dir, design, *,
+        n_plates=1,
+        n_wells=96,
+        chemistry=None,
+        seed=None,
+):
+    """
+    Write a layout and simulated data for the given experimental design.
+
+    *design* is one of the keys of `DESIGNS`.  The layout is written to
+    `<out_dir>/<design>.toml`, and the data for each plate to
+    `<out_dir>/<design>/<plate>/`.  Return the path to the layout.
+    """
+    if design not in DESIGNS:
+        raise ValueError(f"unknown design: {design!r}")
+    if n_wells not in PLATE_FORMATS:
+        raise ValueError(f"unknown plate format: {n_wells} wells")
+
+    chemistry = chemistry or Chemistry()
+    rng = np.random.default_rng(seed)
+
+    n_rows, n_cols = PLATE_FORMATS[n_wells]
+    toml, reactions = DESIGNS[design](n_rows, n_cols, chemistry, rng)
+
+    out_dir = Path(out_dir)
+    toml_path = out_dir / f'{design}.toml'
+    plates = [f'p{i:0{len(str(n_plates))}d}' for i in range(1, n_plates + 1)]
+
+    for plate in plates:
+        cq, trace, melt = simulate_plate(reactions, chemistry, rng)
+        write_biorad(out_dir / design / plate, cq, trace, melt)
+
+    header = [
+            "[meta]",
+            f"paths = '{design}/{{}}'",
+            "",
+            *(f"[plate.{plate}]" for plate in plates),
+            "",
+    ]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    toml_path.write_text('\n'.join(header) + toml)
+
+    return toml_path
+
+def simulate_plate(reactions, chemistry, rng):
+    """
+    Simulate the data that the instrument would record for the given
+    reactions.
+
+    *reactions* must have one row per well, with the following columns: *well*
+    (e.g. 'A1'), *copies* (the number of template molecules at the start of
+    the reaction, before pipetting error), *efficiency* (as a fraction), and
+    *tm_C* (the melting temperature of the product).  Wells with 0 copies
+    only amplify if they form primer dimers.
+
+    Return the Cq values, the amplification curves, and the melt curves, as
+    data frames in the format exported by the Bio-Rad CFX software.
+    """
+    n = len(reactions)
+    c = chemistry
+
+    copies = reactions['copies'].to_numpy(dtype=float)
+    copies = copies * rng.lognormal(0, c.pipetting_cv, n)
+    tm = reactions['tm_C'].to_numpy(dtype=float, copy=True)
+
+    dimers = (copies == 0) & (rng.random(n) < c.dimer_rate)
+    copies[dimers] = 10**rng.uniform(0, 1, dimers.sum())
+    tm[dimers] = c.dimer_tm_C
+
+    # Each curve is logistic: it grows by a factor of (1 + efficiency) per
+    # cycle to begin with, and crosses the threshold after the number of
+    # cycles needed to amplify the template to `threshold_copies`.
+    log_growth = np.log1p(reactions['efficiency'].to_numpy(dtype=float))
+    amplified = copies > 0
+
+    with np.errstate(divide='ignore'):
+        cq_true = np.log(c.threshold_copies / copies) / log_growth
+
+    b = 1 / log_growth
+    c0 = cq_true + b * np.log(c.plateau / c.threshold - 1)
+
+    cycles = c.get_cycles()
+    x = cycles[np.newaxis, :] - c0[:, np.newaxis]
+    signal = np.where(
+            amplified[:, np.newaxis],
+            c.plateau / (1 + np.exp(np.clip(-x / b[:, np.newaxis], -500, 500))),
+            0,
+    )
+    rfu = c.baseline + c.drift * cycles + signal
+    rfu += rng.normal(0, c.noise, rfu.shape)
+
+    cq = find_cq(cycles, rfu, c.threshold)
+
+    # The melt curve is a peak at the melting temperature of the product,
+    # proportional to how much product was made.
+    temps = c.get_melt_temps()
+    height = signal[:, -1] / 2
+    peak = np.exp(-(temps[np.newaxis, :] - tm[:, np.newaxis])**2 / 2)
+    rfu_deriv = height[:, np.newaxis] * peak
+    rfu_deriv += rng.normal(0, c.noise, rfu_deriv.shape)
+
+    wells = reactions['well'].to_numpy()
+    wells0 = [wellmap.well0_from_well(x) for x in wells]
+
+    df_cq = pd.DataFrame({'Well': wells0, 'Cq': cq})
+    df_trace = pd.DataFrame(rfu.T, columns=wells)
+    df_trace.insert(0, 'Cycle', cycles)
+    df_melt = pd.DataFrame(rfu_deriv.T, columns=wells)
+    df_melt.insert(0, 'Temperature', temps)
+
+    return df_cq, df_trace, df_melt
+
+def find_cq(cycles, rfu, threshold):
+    """
+    Find the fractional cycle where each row of the given wells × cycles
+    matrix first crosses the given threshold, after subtracting a linear
+    baseline.
+
+    Rows that never cross the threshold get NaN.
+    """
+    y = subtract_baseline(pd.DataFrame(rfu, columns=cycles), drift=True)
+    y = y.to_numpy()
+    x = cycles.astype(float)
+
+    above = y >= threshold
+    k = np.argmax(above, axis=1)
+    found = above.any(axis=1) & (k > 0)
+    k = np.maximum(k, 1)
+
+    i = np.arange(len(y))
+    y0, y1 = y[i, k - 1], y[i, k]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cq = x[k - 1] + (threshold - y0) / (y1 - y0) * (x[k] - x[k - 1])
+
+    return np.where(found, cq, np.nan)
+
+def write_biorad(plate_dir, df_cq, df_trace, df_melt):
+    """
+    Write the given data to a directory, with the same file names that the
+    Bio-Rad CFX software uses when exporting data.
+    """
+    plate_dir = Path(plate_dir)
+    plate_dir.mkdir(parents=True, exist_ok=True)
+
+    df_cq.to_csv(plate_dir / 'Quantification Cq Results.csv', index=False)
+    df_trace.to_csv(
+            plate_dir / 'Quantification Amplification Results_SYBR.csv',
+            index=False,
+    )
+    df_melt.to_csv(
+            plate_dir / 'Melt Curve Derivative Results_SYBR.csv',
+            index=False,
+    )
+
+def design_expression(n_rows, n_cols, chemistry, rng):
+    """
+    Lay out a relative expression experiment; see `qpcr-simulate -h`.
+
+    Return the body of the layout (i.e. everything except the `[meta]` and
+    `[plate]` tables) and the reactions to simulate (see `simulate_plate()`).
+    """
+    i, j = _grid(n_rows, n_cols)
+    pair = i // 2
+    housekeeping = i % 2 == 0
+    treated = j < n_cols // 2
+
+    n_genes = n_rows // 2
+    genes = [f'g{k + 1}' for k in range(n_genes)]
+    base_copies = 10**rng.uniform(3, 5, n_genes)
+    fold_change = 2**rng.uniform(-3, 3, n_genes)
+    tm = rng.uniform(78, 88, n_genes)
+
+    copies = np.where(
+            housekeeping,
+            1e6,
+            base_copies[pair] * np.where(treated, fold_change[pair], 1),
+    )
+
+    toml = [
+            "[qpcr.housekeeping]",
+            "true = 'gene == \"gapdh\"'",
+            "false = 'gene != \"gapdh\"'",
+            "",
+            "[qpcr.treatment]",
+            "true = 'drug == \"yes\"'",
+            "false = 'drug == \"no\"'",
+            "",
+            f"[block.{n_cols}x{n_rows}.A1]",
+            "sublabel = '{gene} {drug}'",
+            "",
+            f"[block.{n_cols // 2}x{n_rows}.A1]",
+            "drug = 'yes'",
+            "",
+            f"[block.{n_cols - n_cols // 2}x{n_rows}.A{n_cols // 2 + 1}]",
+            "drug = 'no'",
+            "",
+    ]
+    for k, gene in enumerate(genes):
+        for row_i, row_gene in [(2 * k, 'gapdh'), (2 * k + 1, gene)]:
+            toml += [
+                    f"[row.{wellmap.row_from_i(row_i)}]",
+                    f"gene = '{row_gene}'",
+                    f"label = '{gene}'",
+                    "",
+            ]
+
+    reactions = pd.DataFrame({
+        'well': _wells(i, j),
+        'copies': copies,
+        'efficiency': chemistry.efficiency,
+        'tm_C': np.where(housekeeping, 84.5, tm[pair]),
+    })
+    return '\n'.join(toml), reactions
+
+def design_dilution(n_rows, n_cols, chemistry, rng):
+    """
+    Lay out a standard curve experiment; see `qpcr-simulate -h`.
+
+    Return the body of the layout and the reactions to simulate, like
+    `design_expression()`.
+    """
+    i, j = _grid(n_rows, n_cols)
+    pair = i // 2
+    ntc = j == n_cols - 1
+
+    # Repeat the dilution series if there are more columns than useful
+    # dilutions, e.g. on 384- and 1536-well plates.
+    n_steps = min(6, n_cols - 1)
+    conc = 10.0**-(np.arange(n_cols - 1) % n_steps)
+
+    n_primers = n_rows // 2
+    efficiency = rng.normal(chemistry.efficiency, 0.03, n_primers)
+    tm = rng.uniform(78, 88, n_primers)
+
+    toml = [
+            "[qpcr]",
+            "conc_unit = 'ng/uL'",
+            "",
+            f"[block.{n_cols - 1}x{n_rows}.A1]",
+            "template = 'gblock'",
+            "",
+            f"[col.{n_cols}]",
+            "control = 'NTC'",
+            "",
+    ]
+    for col_j, conc_j in enumerate(conc):
+        toml += [
+                f"[col.{wellmap.col_from_j(col_j)}]",
+                f"template_conc = {conc_j:g}",
+                "",
+        ]
+    for k in range(n_primers):
+        toml += [
+                f"[block.{n_cols}x2.{wellmap.row_from_i(2 * k)}1]",
+                f"primers = 'p{k + 1}'",
+                "",
+        ]
+
+    reactions = pd.DataFrame({
+        'well': _wells(i, j),
+        'copies': np.where(ntc, 0, 1e6 * conc[np.minimum(j, n_cols - 2)]),
+        'efficiency': efficiency[pair],
+        'tm_C': tm[pair],
+    })
+    return '\n'.join(toml), reactions
+
+def design_anneal(n_rows, n_cols, chemistry, rng):
+    """
+    Lay out an annealing temperature gradient; see `qpcr-simulate -h`.
+
+    Return the body of the layout and the reactions to simulate, like
+    `design_expression()`.
+    """
+    i, j = _grid(n_rows, n_cols)
+    pair = np.minimum(j, n_cols - 2) // 2
+    ntc = j == n_cols - 1
+
+    temps = np.round(np.linspace(55, 68, n_rows), 1)
+
+    n_primers = n_cols // 2
+    ta_optimum = rng.uniform(58, 64, n_primers)
+    tm = rng.uniform(78, 88, n_primers)
+
+    # Annealing away from the optimal temperature delays amplification by a
+    # number of cycles that grows quadratically with the distance.
+    delay = 0.08 * (temps[i] - ta_optimum[pair])**2
+    copies = 1e5 * (1 + chemistry.efficiency)**-delay
+
+    toml = [
+            f"[block.{n_cols - 1}x{n_rows}.A1]",
+            "template = 'gblock'",
+            "",
+            f"[col.{n_cols}]",
+            "control = 'NTC'",
+            "primers = 'p1'",
+            "",
+    ]
+    for row_i, temp in enumerate(temps):
+        toml += [
+                f"[row.{wellmap.row_from_i(row_i)}]",
+                f"anneal_temp_C = {temp:g}",
+                "",
+        ]
+    for k in range(n_primers):
+        first_j, last_j = 2 * k, min(2 * k + 2, n_cols - 1)
+        toml += [
+                f"[block.{last_j - first_j}x{n_rows}."
+                f"A{wellmap.col_from_j(first_j)}]",
+                f"primers = 'p{k + 1}'",
+                "",
+        ]
+
+    reactions = pd.DataFrame({
+        'well': _wells(i, j),
+        'copies': np.where(ntc, 0, copies),
+        'efficiency': chemistry.efficiency,
+        'tm_C': tm[pair],
+    })
+    return '\n'.join(toml), reactions
+
+def _grid(n_rows, n_cols):
+    # The row and column indices of every well, in row-major order.
+    i, j = np.divmod(np.arange(n_rows * n_cols), n_cols)
+    return i, j
+
+def _wells(i, j):
+    return [wellmap.well_from_ij(*ij) for ij in zip(i, j)]
+
+DESIGNS = {
+        'expression': design_expression,
+        'dilution': design_dilution,
+        'anneal': design_anneal,
+}
+
+if __name__ == '__main__':
+    main()
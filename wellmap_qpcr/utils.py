@@ -2,29 +2,40 @@
 
 import wellmap
 import matplotlib.pyplot as plt
-import os, sys
+import sys
 
+from .viewer import show_figures
+from .wells import ij_from_wells, get_plate_format, well_ids_from_ij, well_mask
+from more_itertools import flatten
 from pathlib import Path
 from contextlib import contextmanager
 
-# Way to plot or savefig.  Need to os.fork before plotting.  Want to use with 
-# statement, save gcf().  Good enough for now, I can be more clever later.
+# Way to plot or savefig.  Interactive plots are sent to the viewer process, 
+# so the command can exit right away.  Want to use with statement, save gcf().
 
 @contextmanager
-def plot_or_save(layout_path, img_path, fork=True):
-    if fork and not img_path:
-        if os.fork() != 0:
-            sys.exit()
-
+def plot_or_save(layout_path, img_path):
     yield
 
     if img_path:
         plt.savefig(img_path)
         plt.close()
     else:
-        cmd = Path(sys.argv[0]).name
-        plt.gcf().canvas.set_window_title(f'{cmd} {layout_path}')
-        plt.show()
+        show_in_viewer(layout_path)
+
+def show_in_viewer(layout_path):
+    """
+    Send the open figures to the viewer (see `wellmap_qpcr.viewer`).
+
+    Figures from the same command line, apart from the layout, replace each
+    other in place.  This makes it fast to review a series of plates.
+    """
+    cmd = Path(sys.argv[0]).name
+    key = cmd, *[
+            '%' if arg == str(layout_path) else arg
+            for arg in sys.argv[1:]
+    ]
+    show_figures(key, f'{cmd} {layout_path}')
 
 def resolve_img_path(img_template, default_img_template, use_default, layout_path):
     if not img_template and not use_default:
@@ -48,5 +59,11 @@ def filter_by_label(labels, df):
     pass
 
 def filter_by_wells(wells, df):
-    return df[df['well'].isin(wells)]
+    i, j = ij_from_wells(df['well'])
+    n_wells = max(
+            get_plate_format(i, j),
+            get_plate_format(*ij_from_wells(wells)),
+    )
+    mask = well_mask(wells, n_wells)
+    return df[mask[well_ids_from_ij(i, j, n_wells)]]
 
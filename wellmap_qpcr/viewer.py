@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+"""\
+Display the figures made by every `qpcr-*` command in one persistent process.
+
+Starting a GUI and importing the analysis code again for every plate is slow.
+Instead, the commands draw their figures without a GUI and send them over a
+local socket to this viewer, which keeps its windows open between commands.
+When a figure arrives from the same command as one that's already on screen
+(e.g. the same plot of the next plate), the existing window is updated in
+place rather than being re-created.
+
+The viewer is started automatically the first time it's needed, and exits
+once all of its windows have been closed.
+
+Usage:
+    qpcr-viewer
+"""
+
+import os, sys, time, pickle, socket, tempfile, docopt, subprocess
+import matplotlib.pyplot as plt
+
+from matplotlib.lines import Line2D
+from matplotlib.image import AxesImage
+from matplotlib.patches import Polygon, Rectangle
+from matplotlib.collections import LineCollection
+from multiprocessing.connection import Listener, Client
+from threading import Thread
+from queue import Queue, Empty
+from pathlib import Path
+
+def main():
+    docopt.docopt(__doc__)
+    serve()
+
+def show_figures(key, title):
+    """
+    Send every open figure to the viewer, starting the viewer if necessary.
+
+    *key* identifies the command that made the figures; a figure replaces the
+    one that was previously sent with the same key and position.  *title* is
+    used for the window title.  If the viewer can't be reached (e.g. on
+    platforms without Unix sockets), the figures are instead shown in this
+    process, which blocks until they're closed.
+    """
+    figs = [plt.figure(i) for i in plt.get_fignums()]
+
+    try:
+        conn = connect()
+    except OSError:
+        plt.show()
+        return
+
+    with conn:
+        for i, fig in enumerate(figs):
+            conn.send((key, i, title, pickle.dumps(fig)))
+
+    plt.close('all')
+
+def connect(timeout=10):
+    """
+    Connect to the viewer, starting it if it isn't already running.
+    """
+    address = get_address()
+
+    try:
+        return Client(address, 'AF_UNIX')
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass
+
+    subprocess.Popen(
+            [sys.executable, '-m', 'wellmap_qpcr.viewer'],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            start_new_session=True,
+    )
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Client(address, 'AF_UNIX')
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def serve(poll_s=0.05):
+    """
+    Show figures sent by `show_figures()` until every window is closed.
+
+    Connections are accepted on a background thread, but the figures are
+    unpickled and drawn on the main thread, since that's where the GUI event
+    loop runs.
+    """
+    address = get_address()
+
+    # Don't displace a viewer that's already running, e.g. if two commands
+    # tried to start one at the same time.
+    try:
+        Client(address, 'AF_UNIX').close()
+        return
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass
+
+    if os.path.exists(address):
+        os.unlink(address)
+
+    queue = Queue()
+    listener = Listener(address, 'AF_UNIX')
+    Thread(target=_accept, args=(listener, queue), daemon=True).start()
+
+    windows = {}
+    shown = False
+
+    try:
+        while True:
+            while True:
+                try:
+                    key, i, title, fig_bytes = queue.get_nowait()
+                except Empty:
+                    break
+
+                _show(windows, (key, i), title, fig_bytes)
+                shown = True
+
+            windows = {
+                    k: fig for k, fig in windows.items()
+                    if plt.fignum_exists(fig.number)
+            }
+            if shown and not windows:
+                break
+
+            if windows:
+                plt.pause(poll_s)
+            else:
+                time.sleep(poll_s)
+
+    finally:
+        listener.close()
+
+def get_address():
+    """
+    Return the path to the socket used to communicate with the viewer.
+
+    The socket is kept in a directory that only the current user can access,
+    since anyone who can connect to it can make the viewer unpickle arbitrary
+    data.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError("the viewer requires Unix domain sockets")
+
+    root = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    dir = Path(root) / f'wellmap_qpcr-{os.getuid()}'
+    dir.mkdir(mode=0o700, exist_ok=True)
+
+    if dir.stat().st_uid != os.getuid() or dir.stat().st_mode & 0o077:
+        raise PermissionError(f"viewer directory is not private: {dir}")
+
+    return str(dir / 'viewer.sock')
+
+def update_figure(fig, new_fig):
+    """
+    Copy the data from *new_fig* into the artists of *fig*, without creating
+    any new artists.
+
+    This only works if the two figures have the same structure, i.e. the same
+    axes containing the same kinds of artists.  Return False (without having
+    changed anything) if that isn't the case, in which case the whole figure
+    has to be replaced.
+    """
+    pairs = list(zip(_get_plot_axes(fig), _get_plot_axes(new_fig)))
+
+    if len(_get_plot_axes(fig)) != len(_get_plot_axes(new_fig)):
+        return False
+    if not all(_same_structure(ax, new_ax) for ax, new_ax in pairs):
+        return False
+
+    for ax, new_ax in pairs:
+        _update_axes(ax, new_ax)
+
+    return True
+
+def _accept(listener, queue):
+    while True:
+        try:
+            conn = listener.accept()
+        except OSError:
+            return
+
+        with conn:
+            try:
+                while True:
+                    queue.put(conn.recv())
+            except EOFError:
+                pass
+
+def _show(windows, key, title, fig_bytes):
+    # Unpickling a figure that was made with pyplot registers it with pyplot
+    # again, so it gets a window of its own.  Close that window immediately if
+    # the data can be transferred to an existing window instead.
+    new_fig = pickle.loads(fig_bytes)
+    fig = windows.get(key)
+
+    if fig is not None and update_figure(fig, new_fig):
+        plt.close(new_fig)
+    else:
+        if fig is not None:
+            plt.close(fig)
+        fig = windows[key] = new_fig
+        fig.show()
+
+    fig.canvas.manager.set_window_title(title)
+    fig.canvas.draw_idle()
+
+def _get_plot_axes(fig):
+    # Colorbars are updated by their mappables, so they don't need to be (and
+    # can't easily be) updated directly.
+    return [
+            ax for ax in fig.axes
+            if not hasattr(ax, '_colorbar')
+    ]
+
+def _get_artists(ax):
+    return [
+            ax.lines,
+            ax.images,
+            ax.collections,
+            ax.patches,
+            ax.texts,
+    ]
+
+def _same_structure(ax, new_ax):
+    for artists, new_artists in zip(_get_artists(ax), _get_artists(new_ax)):
+        if len(artists) != len(new_artists):
+            return False
+        for a, b in zip(artists, new_artists):
+            if type(a) is not type(b) or type(a) not in UPDATERS:
+                return False
+
+    legend, new_legend = ax.get_legend(), new_ax.get_legend()
+    if (legend is None) != (new_legend is None):
+        return False
+    if legend and _legend_labels(legend) != _legend_labels(new_legend):
+        return False
+
+    return True
+
+def _update_axes(ax, new_ax):
+    for artists, new_artists in zip(_get_artists(ax), _get_artists(new_ax)):
+        for a, b in zip(artists, new_artists):
+            UPDATERS[type(a)](a, b)
+
+    ax.set_position(new_ax.get_position())
+    ax.set_title(new_ax.get_title())
+    ax.set_xlabel(new_ax.get_xlabel())
+    ax.set_ylabel(new_ax.get_ylabel())
+    ax.set_xscale(new_ax.get_xscale())
+    ax.set_yscale(new_ax.get_yscale())
+
+    # Fixed tick labels (e.g. well names) are part of the data, so copy the
+    # locators and formatters rather than the ticks they produced.
+    for axis, new_axis in [(ax.xaxis, new_ax.xaxis), (ax.yaxis, new_ax.yaxis)]:
+        axis.set_major_locator(new_axis.get_major_locator())
+        axis.set_major_formatter(new_axis.get_major_formatter())
+        axis.set_minor_locator(new_axis.get_minor_locator())
+        axis.set_minor_formatter(new_axis.get_minor_formatter())
+
+    ax.set_xlim(new_ax.get_xlim())
+    ax.set_ylim(new_ax.get_ylim())
+
+def _update_line(line, new_line):
+    line.set_data(new_line.get_xdata(), new_line.get_ydata())
+    line.set(
+            color=new_line.get_color(),
+            linestyle=new_line.get_linestyle(),
+            linewidth=new_line.get_linewidth(),
+            marker=new_line.get_marker(),
+            markersize=new_line.get_markersize(),
+            markerfacecolor=new_line.get_markerfacecolor(),
+            markeredgecolor=new_line.get_markeredgecolor(),
+    )
+    _update_common(line, new_line)
+
+def _update_image(im, new_im):
+    im.set_data(new_im.get_array())
+    im.set_extent(new_im.get_extent())
+    im.set_cmap(new_im.get_cmap())
+    im.set_clim(new_im.get_clim())
+
+def _update_line_collection(lc, new_lc):
+    lc.set_segments(new_lc.get_segments())
+    lc.set(
+            color=new_lc.get_color(),
+            linestyle=new_lc.get_linestyle(),
+            linewidth=new_lc.get_linewidth(),
+    )
+    _update_common(lc, new_lc)
+
+def _update_polygon(p, new_p):
+    p.set_xy(new_p.get_xy())
+    _update_patch_colors(p, new_p)
+
+def _update_rectangle(r, new_r):
+    r.set_bounds(*new_r.get_bbox().bounds)
+    _update_patch_colors(r, new_r)
+
+def _update_text(t, new_t):
+    t.set_text(new_t.get_text())
+    t.set_position(new_t.get_position())
+
+def _update_patch_colors(p, new_p):
+    p.set(
+            facecolor=new_p.get_facecolor(),
+            edgecolor=new_p.get_edgecolor(),
+    )
+    _update_common(p, new_p)
+
+def _update_common(a, new_a):
+    # Don't use `Artist.update_from()`, because it would also copy the
+    # transform, which refers to the axes of the new figure.
+    a.set(
+            alpha=new_a.get_alpha(),
+            label=new_a.get_label(),
+            visible=new_a.get_visible(),
+            zorder=new_a.get_zorder(),
+    )
+
+def _legend_labels(legend):
+    return [x.get_text() for x in legend.get_texts()]
+
+UPDATERS = {
+        Line2D: _update_line,
+        AxesImage: _update_image,
+        LineCollection: _update_line_collection,
+        Polygon: _update_polygon,
+        Rectangle: _update_rectangle,
+        plt.Text: _update_text,
+}
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""
+Integer identifiers for wells.
+
+Wells are named by strings like 'A1' or 'A01', but comparing and joining on
+strings is slow when there are millions of rows (e.g. one per well per
+cycle).  Instead, each well can be identified by its position in row-major
+order on a plate of a standard format, so that joins are on integers and sets
+of wells are boolean masks that can be indexed by those integers.
+"""
+
+import wellmap
+import numpy as np
+import pandas as pd
+
+# The number of wells in each standard plate format, and the corresponding
+# number of rows and columns.
+PLATE_FORMATS = {
+        96: (8, 12),
+        384: (16, 24),
+        1536: (32, 48),
+}
+
+def get_plate_format(i, j):
+    """
+    Return the smallest plate format (i.e. number of wells) with room for
+    every given row and column index.
+    """
+    max_i = np.max(np.asarray(i), initial=0)
+    max_j = np.max(np.asarray(j), initial=0)
+
+    for n_wells, (n_rows, n_cols) in PLATE_FORMATS.items():
+        if max_i < n_rows and max_j < n_cols:
+            return n_wells
+
+    raise ValueError(f"no plate format has a well at row={max_i}, col={max_j}")
+
+def ij_from_wells(wells, strict=True):
+    """
+    Return the row and column indices of the given well names, as two integer
+    arrays.
+
+    Each distinct name is only parsed once, so this is fast even if the same
+    wells are repeated many times.  If *strict* is false, names that can't be
+    parsed (e.g. missing values, or other columns that ended up among the
+    wells, like the unnamed first column of some exports) get indices of -1,
+    instead of raising an error.
+    """
+    codes, uniques = pd.factorize(np.asarray(wells), sort=False)
+    if strict and (codes < 0).any():
+        raise ValueError("can't get the index of a missing well")
+
+    def parse_well(x):
+        if strict:
+            return wellmap.ij_from_well(x)
+        try:
+            return wellmap.ij_from_well(x)
+        except wellmap.LayoutError:
+            return -1, -1
+
+    # Missing values have a code of -1, which selects the last row of this
+    # array, i.e. the extra row of -1 indices.
+    ij = np.array(
+            [*map(parse_well, uniques), (-1, -1)],
+            dtype=int,
+    ).reshape(-1, 2)
+    return ij[codes, 0], ij[codes, 1]
+
+def well_ids_from_ij(i, j, n_wells):
+    """
+    Return the integer id of the well at each of the given row and column
+    indices, for the given plate format.
+    """
+    n_rows, n_cols = PLATE_FORMATS[n_wells]
+    i, j = np.asarray(i), np.asarray(j)
+
+    if (i >= n_rows).any() or (j >= n_cols).any():
+        raise ValueError(f"well doesn't fit on a {n_wells}-well plate")
+
+    return i * n_cols + j
+
+def well_ids(wells, n_wells=None):
+    """
+    Return the integer id of each of the given well names.
+
+    If no plate format is given, the smallest one that fits every well is
+    used.  The ids of wells on plates of different formats can't be compared.
+    """
+    i, j = ij_from_wells(wells)
+    if n_wells is None:
+        n_wells = get_plate_format(i, j)
+    return well_ids_from_ij(i, j, n_wells)
+
+def well_mask(wells, n_wells):
+    """
+    Return a boolean array, indexed by well id, that is true for each of the
+    given wells.
+
+    Testing whether the wells in a data frame are part of the selection is
+    then a matter of indexing this array with their ids (see `well_ids()`).
+    """
+    mask = np.zeros(n_wells, dtype=bool)
+    mask[well_ids(wells, n_wells)] = True
+    return mask
+
+class WellIndex:
+    """
+    Find the row of a layout describing any well on any of its plates.
+
+    The index is a plates × well ids array of row positions, built once from
+    the layout, so locating the layout rows for a data frame with millions of
+    rows is just a matter of indexing that array.  This is how data from
+    multiple plates is joined to the layout without mixing up wells that have
+    the same name on different plates.
+    """
+
+    def __init__(self, layout, plate_col='path'):
+        self.plates = pd.Index(pd.unique(layout[plate_col]))
+        self.n_wells = get_plate_format(layout['row_i'], layout['col_j'])
+
+        plate_i = self.plates.get_indexer(layout[plate_col])
+        well_ids = well_ids_from_ij(
+                layout['row_i'], layout['col_j'], self.n_wells)
+
+        self.rows = np.full((len(self.plates), self.n_wells), -1)
+        self.rows[plate_i, well_ids] = np.arange(len(layout))
+
+        if (self.rows >= 0).sum() != len(layout):
+            raise ValueError("layout describes the same well more than once")
+
+    def locate(self, plate, wells):
+        """
+        Return the row of the layout describing each of the given wells, which
+        must all be on the given plate.
+
+        Wells that aren't in the layout (including wells that wouldn't fit on
+        the layout's plate format, and names that aren't wells at all) get -1.
+        """
+        n_rows, n_cols = PLATE_FORMATS[self.n_wells]
+        i, j = ij_from_wells(wells, strict=False)
+        rows = np.full(len(i), -1)
+
+        fits = (i >= 0) & (i < n_rows) & (j >= 0) & (j < n_cols)
+        plate_rows = self.rows[self.plates.get_loc(plate)]
+        rows[fits] = plate_rows[i[fits] * n_cols + j[fits]]
+
+        return rows